@@ -0,0 +1,135 @@
+"""
+FlipTracker NLP — Serialization benchmark
+
+Cost of getting a batch in and out of ``/extract/batch``, per batch size,
+without the extraction itself:
+
+- request: stdlib ``json.loads`` + pydantic ``model_validate`` (FastAPI's
+  default path) vs ``model_validate_json`` vs msgpack, plus gzip/zstd
+  decompression;
+- response: ``jsonable_encoder`` + ``json.dumps`` (FastAPI's default) vs
+  orjson vs msgpack.
+
+Bodies are synthetic HTML emails of ``--body-kb`` KB, or the emails of
+``--input`` (JSON / JSONL exports, see ``src.bulk``).
+
+Usage:
+    python scripts/bench_wire.py
+    python scripts/bench_wire.py --sizes 1 32 256 --body-kb 150
+    python scripts/bench_wire.py --input aa.jsonl.json
+"""
+import argparse
+import gzip
+import json
+import sys
+import time
+from itertools import cycle, islice
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+
+from src import wire
+from src.api import EmailBatchRequest
+
+ROW = ('<tr><td style="padding:8px;font-family:Arial,sans-serif;color:#333">'
+       'Votre colis 6A{:011d} est en cours de livraison — suivez-le sur notre site.</td></tr>\n')
+
+
+def synthetic_body(kb: int, seed: int) -> str:
+    rows = []
+    size = 0
+    while size < kb * 1024:
+        rows.append(ROW.format(seed * 1000 + len(rows)))
+        size += len(rows[-1])
+    return "<html><body><table>" + "".join(rows) + "</table></body></html>"
+
+
+def sample_result(i: int) -> dict:
+    return {
+        "address": "12 rue de la Paix, 75002 Paris", "carrier": "colissimo",
+        "tracking_number": f"6A{i:011d}", "type": "purchase", "marketplace": "vinted",
+        "email_type": "shipping_confirmation",
+        "confidence": {"tracking_number": 0.95, "carrier": 0.85, "address": 0.9},
+        "source": {"tracking_number": "regex", "carrier": "regex", "address": "regex"},
+        "classification": {"email_type": {"label": "shipping_confirmation", "confidence": 0.93}},
+    }
+
+
+def best_of(fn, repeat: int) -> float:
+    """Best wall time (ms) over ``repeat`` runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--body-kb", type=int, default=100)
+    parser.add_argument("--input", type=Path, default=None)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.input:
+        from src.bulk import iter_records
+        bodies = [r["body"] for r in iter_records([args.input]) if r["body"]]
+        print(f"📂 {len(bodies)} emails from {args.input}")
+    else:
+        bodies = [synthetic_body(args.body_kb, seed) for seed in range(8)]
+        print(f"🧪 Synthetic HTML emails of {args.body_kb} KB")
+
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+        print("   ⚠️  zstandard not installed — zstd column skipped")
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+        print("   ⚠️  msgpack not installed — msgpack columns skipped")
+
+    columns = ["emails", "MB", "json+validate", "validate_json", "msgpack", "gunzip", "unzstd",
+               "resp default", "resp orjson", "resp msgpack"]
+    print("\n" + " | ".join(f"{c:>13}" for c in columns))
+    print("-" * (16 * len(columns)))
+
+    for n in args.sizes:
+        payload = {"tenant_id": "bench", "emails": [
+            {"body": body, "subject": "Votre colis", "sender": "noreply@vinted.fr"}
+            for body in islice(cycle(bodies), n)
+        ]}
+        raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        results = {"results": [sample_result(i) for i in range(n)], "count": n, "totalProcessingTimeMs": 1.0}
+        gzipped = gzip.compress(raw, compresslevel=6)
+
+        row = {
+            "json+validate": best_of(lambda: EmailBatchRequest.model_validate(json.loads(raw)), args.repeat),
+            "validate_json": best_of(lambda: wire.parse(EmailBatchRequest, raw, "application/json"), args.repeat),
+            "gunzip": best_of(lambda: wire.decompress(gzipped, "gzip", len(raw)), args.repeat),
+            "resp default": best_of(lambda: json.dumps(jsonable_encoder(results)).encode("utf-8"), args.repeat),
+            "resp orjson": best_of(lambda: wire.dumps(results), args.repeat),
+        }
+        if msgpack is not None:
+            packed = msgpack.packb(payload, use_bin_type=True)
+            row["msgpack"] = best_of(lambda: wire.parse(EmailBatchRequest, packed, "application/msgpack"), args.repeat)
+            row["resp msgpack"] = best_of(lambda: msgpack.packb(results, use_bin_type=True), args.repeat)
+        if zstandard is not None:
+            zstded = zstandard.ZstdCompressor(level=3).compress(raw)
+            row["unzstd"] = best_of(lambda: wire.decompress(zstded, "zstd", len(raw)), args.repeat)
+
+        cells = [f"{n:>13}", f"{len(raw) / 1e6:>13.1f}"]
+        cells += [f"{row[c]:>10.2f} ms" if c in row else f"{'-':>13}" for c in columns[2:]]
+        print(" | ".join(cells))
+        print(f"{'':>13}   gzip: {len(raw) / len(gzipped):.1f}x smaller on the wire")
+
+    print("\n✅ Times are the best of", args.repeat, "runs, per batch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+FlipTracker NLP — Import-time budget
+
+Render spins instances down and back up, so the time to import ``src.api``
+is paid on every cold start. This check runs ``python -X importtime`` in a
+fresh interpreter and fails (exit 1) when:
+
+- the cumulative import time of a module exceeds the budget
+  (``--budget-ms``, default ``NLP_IMPORT_BUDGET_MS``), best of ``--runs``;
+- a module pulls in something it must load lazily (spaCy, bs4, ONNX
+  Runtime for ``src.api``), or a training-only dependency (torch,
+  transformers, pandas, ...: e.g. thinc imports torch whenever it is
+  installed, which triples spaCy's import time).
+
+The heaviest imported packages are listed to show where the time goes.
+
+Usage:
+    python scripts/check_import_time.py
+    python scripts/check_import_time.py --module spacy --budget-ms 1500  # engine load path
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+SERVICE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SERVICE_DIR))
+
+# Never needed to serve requests (requirements-train.txt)
+TRAINING_ONLY = ("torch", "transformers", "datasets", "spacy_transformers", "pandas",
+                 "sklearn", "firebase_admin", "langdetect")
+# Loaded on first use (engine load, debug endpoints...), never at startup
+LAZY = {
+    "src.api": ("spacy", "thinc", "bs4", "lxml", "onnxruntime", "tokenizers", "numpy",
+                "src.extractor", "src.classifiers", "tracemalloc"),
+}
+
+
+def measure(module: str) -> dict[str, tuple[int, int]]:
+    """``{imported module: (self_us, cumulative_us)}`` for a fresh ``import module``."""
+    env = {**os.environ, "PYTHONPATH": str(SERVICE_DIR), "PYTHONDONTWRITEBYTECODE": "1"}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SERVICE_DIR, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"❌ import {module} failed:\n{proc.stderr[-2000:]}")
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def heaviest(timings: dict, top: int) -> list[tuple[str, float]]:
+    """Self time aggregated per top-level package (ms)."""
+    per_package = defaultdict(int)
+    for name, (self_us, _) in timings.items():
+        per_package[name.split(".")[0]] += self_us
+    return sorted(((p, us / 1000) for p, us in per_package.items()), key=lambda x: -x[1])[:top]
+
+
+def main():
+    from src.config import settings
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="src.api")
+    parser.add_argument("--budget-ms", type=float, default=settings.import_budget_ms)
+    parser.add_argument("--runs", type=int, default=3, help="Keep the fastest run (disk cache noise)")
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    timings = min(runs, key=lambda t: t[args.module][1])
+    total_ms = timings[args.module][1] / 1000
+
+    print(f"⏱️  import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms, "
+          f"best of {len(runs)})")
+    for package, ms in heaviest(timings, args.top):
+        print(f"   {ms:8.1f} ms  {package}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"{total_ms:.0f} ms exceeds the {args.budget_ms:.0f} ms budget")
+    for name in TRAINING_ONLY + LAZY.get(args.module, ()):
+        if name in timings:
+            kind = "training-only dependency" if name in TRAINING_ONLY else "must be imported lazily"
+            failures.append(f"{name} is imported at startup ({kind})")
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("✅ Import time within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import os
+import sys
 import json
 import base64
 import firebase_admin
 from firebase_admin import credentials, firestore
 from bs4 import BeautifulSoup
 from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from src.boilerplate import BoilerplateModel
+from src.links import find_tracking_links, text_and_links
 
 # 1. Configuration Firebase (via variable d'environnement GitHub Secrets)
 base64_creds = os.getenv("FIREBASE_SERVICE_ACCOUNT_BASE64")
@@ -19,13 +25,18 @@ if not firebase_admin._apps:
 
 db = firestore.client()
 
-def clean_content(html_content):
+# Boilerplate appris par domaine (python -m src.boilerplate learn ...), optionnel
+boilerplate = BoilerplateModel.load_default()
+
+def clean_content(html_content, sender="", with_links=False):
     """
     Nettoie le HTML et transforme le texte en une seule ligne propre 
     sans sauts de ligne (\n) ni espaces multiples.
+
+    Avec ``with_links``, renvoie aussi les liens de suivi trouvés dans les href.
     """
     if not html_content: 
-        return ""
+        return ("", []) if with_links else ""
     try:
         soup = BeautifulSoup(html_content, "html.parser")
         
@@ -33,13 +44,17 @@ def clean_content(html_content):
         for s in soup(["script", "style", "head", "title", "meta", "header", "footer"]):
             s.decompose()
         
-        # Extraire le texte avec un espace comme séparateur
-        raw_text = soup.get_text(separator=' ')
+        # Extraire le texte avec un espace comme séparateur (+ les href, même parcours)
+        raw_text, hrefs = text_and_links(soup, separator=' ')
         
         # --- LA MAGIE DE LA FIABILITÉ ---
         # .split() découpe sur TOUS les types d'espaces (\n, \t, \xa0, espaces multiples)
         # " ".join() regroupe tout avec UN SEUL espace standard.
         clean_text = " ".join(raw_text.split())
+
+        # Footers / notifications propres à l'expéditeur
+        if boilerplate is not None:
+            clean_text, stats = boilerplate.strip(clean_text, sender)
         
         # Nettoyage des mentions légales (optionnel)
         stop_keywords = ["Chronopost SAS", "©", "Siège social", "RCS Paris"]
@@ -47,10 +62,12 @@ def clean_content(html_content):
             if word in clean_text:
                 clean_text = clean_text.split(word)[0]
         
+        if with_links:
+            return clean_text.strip(), find_tracking_links(hrefs)
         return clean_text.strip()
     except Exception as e:
         print(f"⚠️ Erreur nettoyage : {e}")
-        return ""
+        return ("", []) if with_links else ""
 
 def run_export():
     print("🔎 Connexion à Firestore et récupération des données...")
@@ -68,7 +85,7 @@ def run_export():
             raw_html = data.get('rawBody', '')
             
             # Nettoyage linéaire
-            clean_text = clean_content(raw_html)
+            clean_text, tracking_links = clean_content(raw_html, data.get('from', ''), with_links=True)
             
             if clean_text and len(clean_text) > 20: # On évite les mails vides/trop courts
                 # Structure JSONL optimisée pour l'annotation
@@ -77,6 +94,9 @@ def run_export():
                     "text": clean_text,
                     "label": []  # À remplir via script de matching ou outil web
                 }
+                # Numéros/transporteurs lus dans les liens de suivi : pré-annotation
+                if tracking_links:
+                    record["tracking_links"] = [link._asdict() for link in tracking_links]
                 f.write(json.dumps(record, ensure_ascii=False) + "\n")
                 count += 1
             
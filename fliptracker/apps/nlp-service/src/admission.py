@@ -0,0 +1,179 @@
+"""
+FlipTracker NLP — Admission control
+
+Bounds the work accepted by ``/extract/batch`` so overload degrades into
+fast 429s instead of unbounded latency and OOMs:
+
+- at most ``max_inflight`` emails are being extracted at any time;
+- requests that don't fit wait in a bounded queue (``max_queue`` requests,
+  at most ``max_wait`` seconds each), served tenant-fairly: the first waiting
+  request of the tenant with the fewest emails in flight goes next (FIFO
+  among equals), so one tenant's burst cannot hold the whole queue;
+- beyond that they are rejected with ``Retry-After`` derived from the
+  measured drain rate (emails/s, exponentially smoothed).
+
+Size limits (per email, per batch) are checked before any work is queued.
+
+Admission runs on the event loop (``async with admission.admit(...)``),
+before the request takes a worker thread: waiting requests hold no thread,
+so they cannot exhaust the threadpool that serves ``/health`` and the admin
+routes, and no request can be stuck unseen behind the threadpool's limiter.
+"""
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+
+from src.metrics import metrics
+
+metrics.describe("nlp_admission_inflight_emails", "gauge", "Emails currently being extracted")
+metrics.describe("nlp_admission_queue_depth", "gauge", "Requests waiting for admission")
+metrics.describe("nlp_admission_queued_emails", "gauge", "Emails in waiting requests")
+metrics.describe("nlp_admission_drain_rate", "gauge", "Smoothed extraction rate (emails/s)")
+metrics.describe("nlp_admission_admitted_total", "counter", "Requests admitted")
+metrics.describe("nlp_admission_rejected_total", "counter", "Requests rejected, by reason")
+
+
+class AdmissionRejected(Exception):
+    """Request refused; ``status`` is the HTTP code to return."""
+
+    def __init__(self, status: int, detail: str, retry_after: int = None):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+
+
+class AdmissionController:
+    """In-flight email budget + bounded, tenant-fair wait queue."""
+
+    def __init__(self, max_inflight: int = 256, max_queue: int = 32, max_wait: float = 10.0,
+                 max_email_bytes: int = 1_000_000, max_batch_bytes: int = 20_000_000,
+                 smoothing: float = 0.2):
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_email_bytes = max_email_bytes
+        self.max_batch_bytes = max_batch_bytes
+        self.smoothing = smoothing
+
+        self._cond = asyncio.Condition()  # event-loop only: no thread ever touches the state
+        self._inflight = 0
+        self._tenant_inflight: Counter = Counter()
+        self._queue: deque = deque()  # tickets: [n_emails, tenant]
+        self._drain_rate = 0.0        # emails/s while busy, all requests together
+        self._busy = 0.0              # busy seconds since the last release
+        self._last_change = time.monotonic()
+
+    # ── Limits ──
+    def check_sizes(self, bodies: list[str], limit_count: bool = True):
+        """413 for an oversized email or batch (or a batch over the whole budget)."""
+        if limit_count and len(bodies) > self.max_inflight:
+            self._reject("batch_too_large", 413,
+                         f"Batch of {len(bodies)} emails exceeds the limit of {self.max_inflight}")
+        total = 0
+        for i, body in enumerate(bodies):
+            size = len(body.encode("utf-8"))
+            if size > self.max_email_bytes:
+                self._reject("email_too_large", 413,
+                             f"Email {i} is {size} bytes (limit {self.max_email_bytes})")
+            total += size
+        if total > self.max_batch_bytes:
+            self._reject("batch_too_large", 413,
+                         f"Batch is {total} bytes (limit {self.max_batch_bytes})")
+
+    # ── Admission ──
+    def retry_after(self, n_emails: int = 0) -> int:
+        """Seconds until the current backlog (+ ``n_emails``) fits the budget at the drain rate."""
+        backlog = self._inflight + sum(t[0] for t in self._queue) + n_emails - self.max_inflight
+        if self._drain_rate <= 0:
+            return 1
+        return int(min(60, max(1, math.ceil(backlog / self._drain_rate))))
+
+    @asynccontextmanager
+    async def admit(self, n_emails: int, tenant: str = ""):
+        """Hold ``n_emails`` of budget for the duration of the ``async with`` block."""
+        await self._acquire(n_emails, tenant)
+        try:
+            yield
+        finally:
+            # Even when the client disconnects (cancellation), the budget comes back
+            await asyncio.shield(self._release(n_emails, tenant))
+
+    def _next_ticket(self):
+        """Waiting ticket of the least-served tenant (``min`` keeps FIFO order among ties)."""
+        return min(self._queue, key=lambda t: self._tenant_inflight[t[1]])
+
+    async def _acquire(self, n: int, tenant: str):
+        async with self._cond:
+            if not self._queue and self._inflight + n <= self.max_inflight:
+                self._admitted(n, tenant)
+                return
+            if len(self._queue) >= self.max_queue:
+                self._reject("queue_full", 429, "Too many requests waiting", self.retry_after(n))
+
+            ticket = [n, tenant]
+            self._queue.append(ticket)
+            self._publish()
+            deadline = time.monotonic() + self.max_wait
+            try:
+                # Only the next ticket may take budget (no overtaking by small requests
+                # of the same tenant, no starvation of large ones)
+                while not (self._next_ticket() is ticket and self._inflight + n <= self.max_inflight):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject("timeout", 429, "Overloaded, retry later", self.retry_after(n))
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass  # deadline checked on the next iteration
+            finally:
+                self._queue.remove(ticket)
+                self._cond.notify_all()
+            self._admitted(n, tenant)
+
+    def _tick(self):
+        """Accumulate busy time (some work in flight) since the last state change."""
+        now = time.monotonic()
+        if self._inflight > 0:
+            self._busy += now - self._last_change
+        self._last_change = now
+
+    def _admitted(self, n: int, tenant: str):
+        self._tick()
+        self._inflight += n
+        self._tenant_inflight[tenant] += n
+        metrics.inc("nlp_admission_admitted_total")
+        self._publish()
+
+    async def _release(self, n: int, tenant: str):
+        async with self._cond:
+            self._tick()
+            self._inflight -= n
+            self._tenant_inflight[tenant] -= n
+            if not self._tenant_inflight[tenant]:
+                del self._tenant_inflight[tenant]
+            # Emails finished / busy time: the aggregate rate of concurrent requests
+            if self._busy > 0:
+                rate = n / self._busy
+                self._drain_rate = rate if self._drain_rate == 0 else (
+                    self.smoothing * rate + (1 - self.smoothing) * self._drain_rate
+                )
+                self._busy = 0.0
+            self._publish()
+            self._cond.notify_all()
+
+    def _reject(self, reason: str, status: int, detail: str, retry_after: int = None):
+        metrics.inc("nlp_admission_rejected_total", reason=reason)
+        raise AdmissionRejected(status, detail, retry_after)
+
+    def _publish(self):
+        metrics.set("nlp_admission_inflight_emails", self._inflight)
+        metrics.set("nlp_admission_queue_depth", len(self._queue))
+        metrics.set("nlp_admission_queued_emails", sum(t[0] for t in self._queue))
+        metrics.set("nlp_admission_drain_rate", round(self._drain_rate, 3))
@@ -1,8 +1,19 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from pydantic import BaseModel
+from typing import Optional
+import anyio
+import hmac
+import threading
 import time
 import logging
 
+from src import wire
+from src.admission import AdmissionController, AdmissionRejected
+from src.config import settings
+from src.metrics import metrics
+
 # Configuration du logger pour voir les sorties dans Render
 logger = logging.getLogger(__name__)
 
@@ -21,60 +32,401 @@ class Email(BaseModel):
 
 class EmailBatchRequest(BaseModel):
     emails: list[Email]
+    tenant_id: str = ""  # utilisateur : ordonnancement équitable entre tenants
+
+# Modèles de réponse : documentation OpenAPI uniquement, les routes renvoient
+# directement du JSON (orjson) / msgpack sans re-valider les résultats
+class Prediction(BaseModel):
+    label: str
+    confidence: float
+
+class Candidate(BaseModel):
+    value: str
+    confidence: float
+    source: str
+
+class ExtractionResult(BaseModel):
+    address: Optional[str] = None
+    carrier: Optional[str] = None
+    tracking_number: Optional[str] = None
+    type: Optional[str] = None
+    marketplace: Optional[str] = None
+    email_type: Optional[str] = None
+    confidence: dict[str, float] = {}
+    source: dict[str, str] = {}
+    classification: dict[str, Prediction] = {}
+    candidates: dict[str, Candidate] = {}  # champs restés sous le seuil (valeur à None)
+    model_version: str
+
+class BatchResponse(BaseModel):
+    results: list[ExtractionResult]
+    count: int
+    totalProcessingTimeMs: float
+    modelVersion: str
+
+# Corps compressés (gzip/deflate/zstd), JSON ou msgpack ; schéma déclaré à la main
+# pour l'OpenAPI (FastAPI ne voit plus le modèle du corps)
+batch_body = wire.body(EmailBatchRequest)
+batch_openapi = wire.openapi_body(EmailBatchRequest)
 
 # ========================================
-# 3. LAZY LOADING DU MOTEUR NLP
+# 2b. ADMISSION (budget d'emails en cours + file d'attente bornée)
 # ========================================
-nlp_engine = None
+admission = AdmissionController(
+    max_inflight=settings.admission_max_inflight_emails,
+    max_queue=settings.admission_max_queue,
+    max_wait=settings.admission_max_wait_seconds,
+    max_email_bytes=settings.max_email_bytes,
+    max_batch_bytes=settings.max_batch_bytes,
+)
+# Threads des extractions admises, distincts du pool par défaut (routes sync,
+# admin) : chaque requête admise tient au moins un email du budget, ce pool
+# ne fait donc jamais attendre une requête déjà admise
+extraction_limiter = anyio.CapacityLimiter(settings.admission_max_inflight_emails)
+
+@app.exception_handler(AdmissionRejected)
+def _admission_rejected(request: Request, exc: AdmissionRejected):
+    return JSONResponse({"detail": exc.detail}, status_code=exc.status, headers=exc.headers)
+
+@app.middleware("http")
+async def _limit_body_size(request: Request, call_next):
+    """Refuse les corps trop gros avant même de les parser"""
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > settings.max_batch_bytes * 2:
+        metrics.inc("nlp_admission_rejected_total", reason="body_too_large")
+        return JSONResponse({"detail": "Request body too large"}, status_code=413)
+    return await call_next(request)
+
+# ========================================
+# 3. LAZY LOADING DU MOTEUR NLP (+ registre de modèles, hot swap)
+# ========================================
+model_manager = None
+_engine_lock = threading.Lock()
 
 def _ensure_engine_loaded():
-    global nlp_engine
-    if nlp_engine is None:
-        print("🚀 Loading NLP engine...")
-        from src.extractor import HybridExtractor
-        nlp_engine = HybridExtractor()
-        print("✅ NLP engine ready")
+    global model_manager
+    with _engine_lock:  # requêtes et workers de jobs peuvent arriver ensemble
+        if model_manager is None:
+            print("🚀 Loading NLP engine...")
+            from src.registry import ModelManager
+            manager = ModelManager.from_settings()
+            manager.load_initial(settings.model_version)
+            model_manager = manager
+            print(f"✅ NLP engine ready (model {model_manager.version})")
+
+def _get_engine():
+    """Moteur courant ; un lot en cours garde sa référence pendant un swap"""
+    _ensure_engine_loaded()
+    return model_manager.engine
+
+# ========================================
+# 3b. ORDONNANCEUR ÉQUITABLE (round-robin entre tenants)
+# ========================================
+scheduler = None
+
+@app.on_event("startup")
+def _start_scheduler():
+    global scheduler
+    if not settings.scheduler_enabled:
+        return
+    from src.scheduler import FairScheduler
+    scheduler = FairScheduler(
+        _get_engine,
+        batch_size=settings.scheduler_batch_size,
+        quantum=settings.scheduler_quantum,
+        workers=settings.scheduler_workers,
+        tenant_labels=settings.scheduler_tenant_labels,
+        timeout=settings.scheduler_timeout_seconds,
+    )
+    scheduler.start()
+
+def _extract(tenant_id: str, emails: list[Email], stats: dict = None) -> list[dict]:
+    bodies = [email.body for email in emails]
+    senders = [email.sender for email in emails]
+    subjects = [email.subject for email in emails]
+    if scheduler is not None:
+        return scheduler.extract(tenant_id, bodies, senders, subjects, stats=stats)
+    engine = _get_engine()
+    start = time.perf_counter()
+    results = engine.extract_batch(bodies, senders=senders, subjects=subjects)
+    if stats is not None:
+        stats["extract_seconds"] = time.perf_counter() - start
+    return results
+
+# ========================================
+# 3c. SHADOW : MODÈLE CANDIDAT SUR LE TRAFIC RÉEL
+# ========================================
+shadow = None
+
+def _start_shadow(version: str, sample_rate: float):
+    global shadow
+    from src.registry import ModelRegistry
+    from src.shadow import ShadowEvaluator
+    if shadow is not None:
+        shadow.stop()
+    shadow = ShadowEvaluator(
+        ModelRegistry(settings.model_registry_path), version,
+        sample_rate=sample_rate, max_queue=settings.shadow_max_queue,
+    )
+    shadow.start()
+    print(f"👥 Shadow mode: {version} on {sample_rate:.0%} of /extract/batch")
+
+@app.on_event("startup")
+def _start_shadow_from_settings():
+    if settings.shadow_version:
+        _start_shadow(settings.shadow_version, settings.shadow_sample_rate)
+
+# ========================================
+# 3d. JOBS EN ARRIÈRE-PLAN (SQLite)
+# ========================================
+job_store = None
+job_runner = None
+
+@app.on_event("startup")
+def _start_jobs():
+    global job_store, job_runner
+    if not settings.jobs_enabled:
+        return
+    from src.jobs import JobRunner, JobStore
+    job_store = JobStore(settings.jobs_db_path)
+    job_runner = JobRunner(
+        job_store, _get_engine,
+        workers=settings.jobs_workers,
+        chunk_size=settings.jobs_chunk_size,
+        lease_seconds=settings.jobs_lease_seconds,
+        scheduler=scheduler,
+        max_attempts=settings.jobs_max_attempts,
+    )
+    job_runner.start()
+
+@app.on_event("shutdown")
+def _stop_jobs():
+    if job_runner is not None:
+        job_runner.stop()
+    if scheduler is not None:
+        scheduler.stop()
+    if shadow is not None:
+        shadow.stop()
+
+def _job_or_404(job_id: str) -> dict:
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="Jobs are disabled")
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+def _job_view(job: dict) -> dict:
+    return {
+        "jobId": job["id"],
+        "tenantId": job["tenant_id"] or None,
+        "status": job["status"],
+        "total": job["total"],
+        "done": job["done"],
+        "progress": job["done"] / job["total"] if job["total"] else 1.0,
+        "error": job["error"],
+        "createdAt": job["created_at"],
+        "updatedAt": job["updated_at"],
+    }
 
 # ========================================
 # 4. ROUTES
 # ========================================
 @app.get("/health")
-def health():
+async def health():
     """Vérification de l'état du service"""
     return {"status": "ok"}
 
-@app.post("/extract/batch")
-def extract_batch(request: EmailBatchRequest):
-    _ensure_engine_loaded()
+@app.post("/extract/batch", response_model=BatchResponse, openapi_extra=batch_openapi)
+async def extract_batch(request: EmailBatchRequest = Depends(batch_body), accept: str = Header("")):
+    bodies = [email.body for email in request.emails]
+    admission.check_sizes(bodies)
+    await run_in_threadpool(_ensure_engine_loaded)
     
-    results = []
     start_time = time.time()
     
-    for email in request.emails:
-        print(f"--- 📩 Processing Email ---")
-        print(f"Subject: {email.subject}")
-        
-        # On appelle la méthode exacte de ton extractor.py
-        # On passe le body du mail à l'IA
-        result = nlp_engine.extract_entities(email.body)
-        
+    # Les emails rejoignent la file du tenant ; les lots du modèle (nlp.pipe +
+    # classifieurs batchés) alternent entre tenants, un gros backfill n'affame
+    # plus les petites synchros
+    # (429 + Retry-After si le budget est dépassé et la file d'attente pleine ;
+    # l'attente se fait sur la boucle d'événements, sans tenir de thread)
+    stats = {}
+    async with admission.admit(len(bodies), request.tenant_id):
+        results = await anyio.to_thread.run_sync(
+            _extract, request.tenant_id, request.emails, stats, limiter=extraction_limiter
+        )
+    if shadow is not None:  # rejoué plus tard par le thread shadow, hors du chemin de réponse
+        shadow.offer(bodies, [email.sender for email in request.emails], results, stats["extract_seconds"],
+                     subjects=[email.subject for email in request.emails])
+    
+    for email, result in zip(request.emails, results):
         # ON LOG LE RÉSULTAT DANS RENDER POUR VÉRIFIER
-        # Note: On utilise les clés définies dans ton extractor.py
-        print(f"🔍 Extraction Result:")
+        print(f"--- 📩 {email.subject}")
         print(f"   📍 Address: {result.get('address')}")
         print(f"   🚚 Carrier: {result.get('carrier')}")
         print(f"   🔢 Tracking: {result.get('tracking_number')}")
-        
-        results.append(result)
+        print(f"   🎯 Sources: {result.get('source')}")
+        print(f"   🏷️  Type: {result.get('type')} | Marketplace: {result.get('marketplace')} "
+              f"| Email type: {result.get('email_type')}")
     
     elapsed = (time.time() - start_time) * 1000
     print(f"✅ Batch complete: {len(results)} emails in {elapsed:.1f}ms")
     
-    return {
+    # Un swap pendant la requête peut mélanger deux versions : on les liste toutes
+    versions = sorted({r["model_version"] for r in results}) or [model_manager.version]
+    return wire.respond({
         "results": results,
         "count": len(results),
-        "totalProcessingTimeMs": elapsed
-    }
+        "totalProcessingTimeMs": elapsed,
+        "modelVersion": ",".join(versions),
+    }, accept)
+
+@app.post("/jobs", status_code=202, openapi_extra=batch_openapi)
+def submit_job(request: EmailBatchRequest = Depends(batch_body)):
+    """Soumet un lot d'emails ; l'extraction se fait en arrière-plan"""
+    if job_store is None:
+        raise HTTPException(status_code=503, detail="Jobs are disabled")
+    admission.check_sizes([email.body for email in request.emails], limit_count=False)
+    job_id = job_store.submit([email.model_dump() for email in request.emails], request.tenant_id)
+    job_runner.notify()
+    print(f"📥 Job {job_id}: {len(request.emails)} emails queued (tenant: {request.tenant_id or '-'})")
+    return _job_view(job_store.get(job_id))
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, accept: str = Header("")):
+    """Progression + premiers résultats disponibles"""
+    job = _job_or_404(job_id)
+    return wire.respond(
+        {**_job_view(job), "results": job_store.results(job_id, 0, settings.jobs_page_size)}, accept
+    )
+
+@app.get("/jobs/{job_id}/results")
+def get_job_results(job_id: str, offset: int = 0, limit: int = 100, accept: str = Header("")):
+    """Résultats paginés, dans l'ordre des emails soumis"""
+    job = _job_or_404(job_id)
+    limit = max(1, min(limit, 1000))
+    results = job_store.results(job_id, offset, limit)
+    next_offset = offset + len(results)
+    return wire.respond({
+        "jobId": job["id"],
+        "status": job["status"],
+        "offset": offset,
+        "limit": limit,
+        "results": results,
+        "nextOffset": next_offset if next_offset < job["done"] else None,
+    }, accept)
+
+# ========================================
+# 5. ADMIN : VERSIONS DU MODÈLE (désactivé sans NLP_ADMIN_TOKEN)
+# ========================================
+class ActivateModelRequest(BaseModel):
+    version: str
+
+def _admin_guard(x_admin_token: str = Header("")):
+    if not settings.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_admin_token, settings.admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/models", dependencies=[Depends(_admin_guard)])
+def list_models():
+    """Version servie, chargement en cours, versions publiées"""
+    _ensure_engine_loaded()
+    return model_manager.status()
+
+@app.post("/admin/models/activate", status_code=202, dependencies=[Depends(_admin_guard)])
+def activate_model(request: ActivateModelRequest):
+    """Charge + préchauffe la version en arrière-plan, puis bascule sans coupure"""
+    from src.registry import RegistryError
+    _ensure_engine_loaded()
+    registry = model_manager.registry
+    try:
+        registry.manifest(request.version)
+    except RegistryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        registry.verify(request.version)  # jamais d'ACTIVE vers une version corrompue
+        registry.activate(request.version)  # persiste pour les redémarrages
+        model_manager.swap(request.version)
+    except RegistryError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    print(f"🔄 Model {request.version} activation requested")
+    return model_manager.status()
+
+class ShadowRequest(BaseModel):
+    version: str
+    sampleRate: float = 0.1
+
+@app.get("/admin/shadow", dependencies=[Depends(_admin_guard)])
+def shadow_report():
+    """Accord par champ, latences p50/p95/p99 et surcoût CPU du candidat"""
+    if shadow is None:
+        raise HTTPException(status_code=404, detail="Shadow mode is off")
+    return {**shadow.report(), "primary": model_manager.version if model_manager else None}
+
+@app.post("/admin/shadow", status_code=202, dependencies=[Depends(_admin_guard)])
+def start_shadow(request: ShadowRequest):
+    """(Re)démarre le shadow sur une version du registre ; remet le rapport à zéro"""
+    from src.registry import ModelRegistry, RegistryError
+    try:
+        ModelRegistry(settings.model_registry_path).manifest(request.version)
+    except RegistryError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    _start_shadow(request.version, max(0.0, min(request.sampleRate, 1.0)))
+    return shadow.report()
+
+@app.delete("/admin/shadow", dependencies=[Depends(_admin_guard)])
+def stop_shadow():
+    """Arrête le shadow et renvoie le rapport final"""
+    global shadow
+    if shadow is None:
+        raise HTTPException(status_code=404, detail="Shadow mode is off")
+    shadow.stop()
+    report, shadow = shadow.report(), None
+    return report
+
+# ========================================
+# 6. DIAGNOSTIC (désactivé par défaut)
+# ========================================
+@app.on_event("startup")
+def _check_debug_token():
+    if settings.debug_endpoints and not settings.debug_token:
+        logger.warning("⚠️  NLP_DEBUG_ENDPOINTS sans NLP_DEBUG_TOKEN : /debug/* refusés (403)")
+
+def _debug_guard(x_debug_token: str = Header("")):
+    """404 si désactivé (on ne révèle pas les routes), 403 sans jeton configuré ou s'il ne correspond pas"""
+    if not settings.debug_endpoints:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not settings.debug_token:  # jamais ouvert à tous : le jeton est obligatoire
+        raise HTTPException(status_code=403, detail="Debug endpoints require NLP_DEBUG_TOKEN")
+    if not hmac.compare_digest(x_debug_token, settings.debug_token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+@app.get("/debug/profile", response_class=PlainTextResponse, dependencies=[Depends(_debug_guard)])
+def debug_profile(seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    """Profil par échantillonnage du trafic réel, au format collapsed stacks (flamegraph)"""
+    from src import debug
+    seconds = max(0.1, min(seconds, settings.debug_profile_max_seconds))
+    print(f"🔬 Profiling for {seconds:.1f}s...")
+    try:
+        folded, samples = debug.profile(seconds, max(interval_ms, 1.0) / 1000, include_idle=idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    print(f"✅ Profile done: {samples} samples")
+    return folded
+
+@app.get("/debug/memory", dependencies=[Depends(_debug_guard)])
+def debug_memory(limit: int = 25, stop: bool = False):
+    """Top des allocations (tracemalloc) + différence avec l'appel précédent"""
+    from src import debug
+    return debug.memory_report(limit=max(1, min(limit, 200)), stop=stop)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Compteurs au format Prometheus (tiers de la cascade, ...)"""
+    return metrics.render()
     
 @app.get("/")
 def root():
@@ -85,6 +437,8 @@ def root():
         "status": "active",
         "endpoints": {
             "health": "/health",
-            "extract": "/extract/batch"
+            "extract": "/extract/batch",
+            "jobs": "/jobs",
+            "metrics": "/metrics"
         }
     }
\ No newline at end of file
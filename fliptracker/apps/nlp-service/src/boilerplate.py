@@ -0,0 +1,253 @@
+"""
+FlipTracker NLP — Boilerplate stripping
+
+Transactional emails are mostly footer text (notification settings, privacy
+notices, legal mentions) that repeats verbatim across a sender's emails. The
+model stores, per sender domain, the 64-bit fingerprints of the lines and
+sentences that recur in a large share of that domain's emails, plus a global
+table for segments shared by many domains. ``strip()`` drops matching segments
+before tokenization, so NER and classifiers see only the variable part.
+
+Segments carrying extraction cues ("suivi", "n°", "adresse"...) are never
+stripped, even when they recur.
+
+Usage:
+    python -m src.boilerplate learn aa.jsonl.json data/rawEmails.json
+    python -m src.boilerplate strip --sender no-reply@vinted.fr < email.txt
+"""
+import argparse
+import hashlib
+import logging
+import re
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+
+try:
+    import tldextract
+    # Bundled Public Suffix List snapshot: no download at import or in the container
+    _tld_extract = tldextract.TLDExtract(suffix_list_urls=())
+except ImportError:  # MULTI_LABEL_SUFFIXES fallback
+    _tld_extract = None
+
+logger = logging.getLogger(__name__)
+
+GLOBAL = "*"
+
+SEGMENT_REGEX = re.compile(r"[^\n.!?]*(?:[.!?]+|\n|$)")
+KEEP_REGEX = re.compile(
+    r"suivi|tracking|n°|num[ée]ro|code de retrait|adresse|point relais|\d{5}",
+    re.IGNORECASE,
+)
+SENDER_DOMAIN_REGEX = re.compile(r"@([\w.-]+)")
+# Public suffixes of two labels seen in senders, when tldextract is missing
+MULTI_LABEL_SUFFIXES = frozenset((
+    "co.uk", "org.uk", "me.uk", "ac.uk", "gov.uk", "com.fr", "asso.fr", "gouv.fr",
+    "com.es", "com.pt", "com.pl", "com.tr", "com.gr", "co.it", "com.de", "co.at",
+    "com.au", "com.br", "com.mx", "com.ar", "com.cn", "com.hk", "com.sg", "com.tw",
+    "co.jp", "co.kr", "co.in", "co.nz", "co.za", "co.il",
+))
+
+
+class StripStats(NamedTuple):
+    chars_before: int
+    chars_after: int
+    tokens_before: int
+    tokens_after: int
+
+    @property
+    def chars_removed(self) -> int:
+        return self.chars_before - self.chars_after
+
+    @property
+    def tokens_removed(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def sender_domain(sender: str) -> str:
+    """
+    Registrable domain of the sender: ``"Vinted" <no-reply@notif.vinted.fr>``
+    -> ``vinted.fr``, ``news@mail.asos.co.uk`` -> ``asos.co.uk``.
+    """
+    match = SENDER_DOMAIN_REGEX.search(sender or "")
+    if not match:
+        return ""
+    host = match.group(1).lower().strip(".")
+    if _tld_extract is not None:
+        parts = _tld_extract(host)
+        if parts.domain and parts.suffix:
+            return f"{parts.domain}.{parts.suffix}"
+        return host  # IP, unknown suffix, bare suffix: the full host
+    labels = host.split(".")
+    keep = 3 if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 2
+    return ".".join(labels[-keep:])
+
+
+def segments(text: str) -> list[str]:
+    """Lines, further split into sentences (exports flatten emails to one line)."""
+    return [s for s in SEGMENT_REGEX.findall(text) if s]
+
+
+def fingerprint(segment: str) -> int:
+    """64-bit hash of the case/whitespace-normalized segment (0 if empty)."""
+    normalized = " ".join(segment.split()).lower()
+    if not normalized:
+        return 0
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class BoilerplateModel:
+    """Sorted uint64 fingerprint tables keyed by sender domain."""
+
+    def __init__(self, tables: dict[str, np.ndarray]):
+        self.tables = {domain: np.sort(np.asarray(t, dtype=np.uint64)) for domain, t in tables.items()}
+
+    # ── Persistence ──
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, **self.tables)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as data:
+            return cls({domain: data[domain] for domain in data.files})
+
+    @classmethod
+    def load_default(cls):
+        """Model at ``settings.boilerplate_path``, or None when disabled / not learnt."""
+        from src.config import settings
+
+        path = Path(settings.boilerplate_path)
+        if not settings.boilerplate_enabled:
+            return None
+        if not path.exists():
+            logger.info(f"Boilerplate model not found at {path} — stripping disabled")
+            return None
+        model = cls.load(path)
+        logger.info(f"✅ Boilerplate model loaded ({len(model.tables)} domains, "
+                    f"{sum(len(t) for t in model.tables.values())} fingerprints)")
+        return model
+
+    # ── Learning ──
+    @classmethod
+    def learn(cls, emails, min_docs: int = 5, min_ratio: float = 0.2,
+              min_domains: int = 3, min_chars: int = 4):
+        """
+        ``emails``: iterable of ``(sender, text)``.
+
+        A segment is boilerplate for a domain when it appears in at least
+        ``min_docs`` emails and ``min_ratio`` of that domain's emails; it goes
+        to the global table when it appears in ``min_domains`` domains.
+        """
+        doc_counts: dict[str, Counter] = defaultdict(Counter)
+        n_docs: Counter = Counter()
+        domains_per_hash: dict[int, set] = defaultdict(set)
+
+        for sender, text in emails:
+            domain = sender_domain(sender) or GLOBAL
+            n_docs[domain] += 1
+            hashes = {
+                fingerprint(s) for s in segments(text)
+                if len(s.strip()) >= min_chars and not KEEP_REGEX.search(s)
+            }
+            hashes.discard(0)
+            doc_counts[domain].update(hashes)
+            for h in hashes:
+                domains_per_hash[h].add(domain)
+
+        tables = {}
+        for domain, counts in doc_counts.items():
+            threshold = max(min_docs, min_ratio * n_docs[domain])
+            recurring = [h for h, c in counts.items() if c >= threshold]
+            if recurring and domain != GLOBAL:
+                tables[domain] = np.array(recurring, dtype=np.uint64)
+        shared = [h for h, domains in domains_per_hash.items() if len(domains) >= min_domains]
+        if shared:
+            tables[GLOBAL] = np.array(shared, dtype=np.uint64)
+        return cls(tables)
+
+    # ── Stripping ──
+    def strip(self, text: str, sender: str = "") -> tuple[str, StripStats]:
+        """Remove known boilerplate segments of ``sender``'s domain (and global ones)."""
+        parts = segments(text)
+        if not parts:
+            return text, StripStats(len(text), len(text), 0, 0)
+
+        hashes = np.fromiter((fingerprint(s) for s in parts), dtype=np.uint64, count=len(parts))
+        drop = np.zeros(len(parts), dtype=bool)
+        for domain in (sender_domain(sender), GLOBAL):
+            table = self.tables.get(domain)
+            if table is not None and len(table):
+                pos = np.minimum(np.searchsorted(table, hashes), len(table) - 1)
+                drop |= table[pos] == hashes
+        drop &= hashes != 0
+
+        kept = [s for s, d in zip(parts, drop) if not d or KEEP_REGEX.search(s)]
+        stripped = "".join(kept).strip()
+        if "\n" in stripped:
+            stripped = "\n".join(line.strip() for line in stripped.splitlines() if line.strip())
+        stats = StripStats(len(text), len(stripped), len(text.split()), len(stripped.split()))
+        return stripped, stats
+
+
+# ── CLI ──────────────────────────────────────────────────────────
+def _load_emails(paths: list[Path]):
+    """(sender, text) pairs from JSON / JSONL exports (incl. ``aa.jsonl.json`` records)."""
+    from src.bulk import iter_records
+    from src.cleaning import clean_html_content
+
+    existing = [p for p in paths if p.exists()]
+    for path in set(paths) - set(existing):
+        print(f"   ⚠️  {path} not found — skipping")
+    for record in iter_records(existing):
+        text = record["body"]
+        if "<" in text:
+            text = clean_html_content(text)
+        if text:
+            yield record["sender"], text
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    learn = sub.add_parser("learn", help="Learn per-domain boilerplate from exported emails")
+    learn.add_argument("inputs", type=Path, nargs="+")
+    learn.add_argument("--output", type=Path, default=None)
+    learn.add_argument("--min-docs", type=int, default=5)
+    learn.add_argument("--min-ratio", type=float, default=0.2)
+    strip = sub.add_parser("strip", help="Strip boilerplate from stdin")
+    strip.add_argument("--sender", default="")
+    args = parser.parse_args()
+
+    from src.config import settings
+
+    if args.command == "learn":
+        emails = list(_load_emails(args.inputs))
+        model = BoilerplateModel.learn(emails, min_docs=args.min_docs, min_ratio=args.min_ratio)
+        output = args.output or Path(settings.boilerplate_path)
+        model.save(output)
+
+        before = after = tokens_before = tokens_after = 0
+        for sender, text in emails:
+            _, stats = model.strip(text, sender)
+            before, after = before + stats.chars_before, after + stats.chars_after
+            tokens_before, tokens_after = tokens_before + stats.tokens_before, tokens_after + stats.tokens_after
+        print(f"✅ {output}: {len(model.tables)} domains, "
+              f"{sum(len(t) for t in model.tables.values())} fingerprints from {len(emails)} emails")
+        if before:
+            print(f"   ✂️  chars: {before} → {after} (-{1 - after / before:.0%}) | "
+                  f"tokens: {tokens_before} → {tokens_after} (-{1 - tokens_after / max(tokens_before, 1):.0%})")
+    else:
+        model = BoilerplateModel.load(settings.boilerplate_path)
+        text, stats = model.strip(sys.stdin.read(), args.sender)
+        print(text)
+        print(f"\n✂️  {stats.chars_removed} chars / {stats.tokens_removed} tokens removed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+FlipTracker NLP — Offline bulk extraction
+
+Backfills extraction results for exported emails without going through the
+HTTP API. Input shards are read in order and cut into chunks. Each worker
+process loads its own ``HybridExtractor`` once and runs ``extract_batch``
+(``nlp.pipe`` + batched classifiers) on whole chunks. Results are written in
+input order to a JSONL file.
+
+A checkpoint next to the output records how many chunks are done and the
+output size at that point: an interrupted run resumes where it stopped
+(``--resume``), dropping any partially written chunk.
+
+Usage:
+    python -m src.bulk data/rawEmails.jsonl.gz --output data/parsed.jsonl
+    python -m src.bulk exports/*.jsonl.zst --output data/parsed.jsonl --workers 8 --resume
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from multiprocessing import get_context
+from pathlib import Path
+
+
+# ── Input ────────────────────────────────────────────────────────
+def open_shard(path: Path):
+    """Text stream over a .json/.jsonl shard, optionally .gz or .zst compressed."""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.suffix == ".zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise SystemExit(f"❌ {path}: reading .zst shards needs `pip install zstandard`")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, "rb"))
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def _shard_format(path: Path) -> str:
+    suffixes = [s for s in Path(path).suffixes if s not in (".gz", ".zst")]
+    return suffixes[-1] if suffixes else ".jsonl"
+
+
+def _normalize(record: dict, fallback_id: str) -> dict:
+    # aa.jsonl.json style: the email is JSON-encoded in "line"
+    if "line" in record and "text" not in record:
+        try:
+            record = json.loads(record["line"])
+        except (json.JSONDecodeError, TypeError):
+            record = {"id": fallback_id, "text": record.get("line") or ""}
+    return {
+        "id": record.get("id") or record.get("messageId") or fallback_id,
+        "body": record.get("rawBody") or record.get("body") or record.get("text") or "",
+        "subject": record.get("subject") or "",
+        "sender": record.get("from") or record.get("sender") or "",
+    }
+
+
+def iter_records(paths: list[Path]):
+    """Emails of all shards, in order, as ``{id, body, subject, sender}``."""
+    for path in paths:
+        with open_shard(path) as f:
+            if _shard_format(path) == ".jsonl":
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = iter(json.load(f))
+            for i, record in enumerate(records):
+                yield _normalize(record, f"{Path(path).name}:{i}")
+
+
+def iter_chunks(records, chunk_size: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ── Workers ──────────────────────────────────────────────────────
+_extractor = None
+
+
+def _init_worker(threads: int):
+    """Load the models once per process."""
+    global _extractor
+    from src.config import settings
+    from src.extractor import HybridExtractor
+
+    if threads:
+        settings.cls_num_threads = threads
+    _extractor = HybridExtractor()
+
+
+def _process_chunk(chunk: list[dict]) -> list[str]:
+    results = _extractor.extract_batch(
+        [r["body"] for r in chunk], senders=[r["sender"] for r in chunk],
+        subjects=[r["subject"] for r in chunk],
+    )
+    return [
+        json.dumps({"id": record["id"], **result}, ensure_ascii=False)
+        for record, result in zip(chunk, results)
+    ]
+
+
+# ── Checkpoint ───────────────────────────────────────────────────
+def load_checkpoint(path: Path, run_key: dict) -> dict:
+    if not path.exists():
+        return {"chunks_done": 0, "records_done": 0, "output_bytes": 0}
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("run") != run_key:
+        raise SystemExit(f"❌ {path} belongs to another run (inputs/chunk size differ) — "
+                         f"remove it or drop --resume")
+    return checkpoint
+
+
+def save_checkpoint(path: Path, checkpoint: dict):
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)  # atomic: never a half-written checkpoint
+
+
+def run(inputs: list[Path], output: Path, workers: int, chunk_size: int,
+        resume: bool = False, threads_per_worker: int = 1):
+    checkpoint_path = output.with_name(output.name + ".ckpt.json")
+    run_key = {"inputs": [str(p) for p in inputs], "chunk_size": chunk_size}
+    checkpoint = load_checkpoint(checkpoint_path, run_key) if resume else {
+        "chunks_done": 0, "records_done": 0, "output_bytes": 0,
+    }
+    if checkpoint["output_bytes"] and not output.exists():
+        raise SystemExit(f"❌ {output} is missing but {checkpoint_path} says it has "
+                         f"{checkpoint['records_done']} results — cannot resume")
+    checkpoint["run"] = run_key
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    out = open(output, "r+b" if resume and output.exists() else "wb")
+    out.truncate(checkpoint["output_bytes"])  # drop a partially written chunk
+    out.seek(checkpoint["output_bytes"])
+
+    chunks = iter_chunks(iter_records(inputs), chunk_size)
+    skipped = 0
+    for _ in range(checkpoint["chunks_done"]):
+        skipped += len(next(chunks, []))
+    if skipped:
+        print(f"   ⏩ Resuming after {checkpoint['chunks_done']} chunks ({skipped} emails)")
+
+    start = time.perf_counter()
+    processed = 0
+
+    def write(lines: list[str]):
+        nonlocal processed
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        out.flush()
+        processed += len(lines)
+        checkpoint["chunks_done"] += 1
+        checkpoint["records_done"] += len(lines)
+        checkpoint["output_bytes"] = out.tell()
+        save_checkpoint(checkpoint_path, checkpoint)
+        elapsed = time.perf_counter() - start
+        print(f"   ⚡ {checkpoint['records_done']} emails | "
+              f"{processed / elapsed:.1f} emails/s", flush=True)
+
+    try:
+        if workers <= 1:
+            _init_worker(threads_per_worker)
+            for chunk in chunks:
+                write(_process_chunk(chunk))
+        else:
+            # Bounded window of in-flight chunks: results come back in input
+            # order and the reader never gets far ahead of the workers.
+            with get_context("spawn").Pool(workers, _init_worker, (threads_per_worker,)) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.apply_async(_process_chunk, (chunk,)))
+                    if len(pending) >= 2 * workers:
+                        write(pending.popleft().get())
+                while pending:
+                    write(pending.popleft().get())
+    finally:
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed else 0.0
+    print(f"✅ {processed} emails in {elapsed:.1f}s ({rate:.1f} emails/s) → {output}")
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", type=Path, nargs="+", help=".json / .jsonl shards (.gz, .zst)")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--threads-per-worker", type=int, default=1,
+                        help="ONNX Runtime threads per worker process")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    args = parser.parse_args()
+
+    missing = [p for p in args.inputs if not p.exists()]
+    if missing:
+        print(f"❌ Not found: {', '.join(map(str, missing))}")
+        sys.exit(1)
+
+    print(f"🚚 Bulk extraction: {len(args.inputs)} shard(s), {args.workers} worker(s), "
+          f"chunks of {args.chunk_size}")
+    run(args.inputs, args.output, args.workers, args.chunk_size,
+        resume=args.resume, threads_per_worker=args.threads_per_worker)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+FlipTracker NLP — Classifier inference
+
+Serves the fine-tuned CamemBERT classifiers (carrier, type, marketplace,
+email_type) on CPU with ONNX Runtime. Each model is exported once to ONNX
+with dynamic int8 quantization; a batch of texts is tokenized once and the
+same encodings are fed to every task. When the multi-task model
+(``train.py --multitask``) is present, all four labels come from a single
+forward pass.
+
+Usage:
+    python -m src.classifiers --export     # export/quantize all trained models
+"""
+import argparse
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from src.config import settings
+
+logger = logging.getLogger(__name__)
+
+TASKS = ("carrier", "type", "marketplace", "email_type")
+
+ONNX_DIRNAME = "onnx"
+ONNX_FILENAME = "model.int8.onnx"
+
+
+def task_paths(task: str) -> tuple[Path, Path]:
+    """Return (model_dir, label_map_path) for a task, as configured in settings."""
+    return (
+        Path(getattr(settings, f"cls_{task}_path")),
+        Path(getattr(settings, f"cls_{task}_labels_path")),
+    )
+
+
+def onnx_dir_for(model_dir: Path) -> Path:
+    """ONNX artefacts live next to ``model-best``: ``cls_<task>/onnx``."""
+    return Path(model_dir).parent / ONNX_DIRNAME
+
+
+# ── Export (offline, needs torch + transformers) ──────────────────
+def export_onnx(model, tokenizer, onnx_dir: Path, output_names: list[str]) -> Path:
+    """
+    Export a PyTorch sequence classifier to ONNX and quantize its weights to int8.
+
+    The fast tokenizer is saved alongside (``tokenizer.json``) so serving only
+    needs ``tokenizers`` and ``onnxruntime``.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    onnx_dir = Path(onnx_dir)
+    onnx_dir.mkdir(parents=True, exist_ok=True)
+    fp32_path = onnx_dir / "model.fp32.onnx"
+    int8_path = onnx_dir / ONNX_FILENAME
+
+    model.eval()
+    dummy = tokenizer(["Votre colis est en route"], return_tensors="pt")
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        **{name: {0: "batch"} for name in output_names},
+    }
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (dummy["input_ids"], dummy["attention_mask"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask"],
+            output_names=output_names,
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+            dynamo=False,
+        )
+
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+    fp32_path.unlink()
+    tokenizer.save_pretrained(str(onnx_dir))
+    return int8_path
+
+
+def export_task(task: str) -> Path:
+    """Export the trained HuggingFace model of ``task`` to quantized ONNX."""
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    model_dir, _ = task_paths(task)
+    tokenizer = AutoTokenizer.from_pretrained(str(model_dir), use_fast=True)
+    model = AutoModelForSequenceClassification.from_pretrained(str(model_dir))
+    return export_onnx(model, tokenizer, onnx_dir_for(model_dir), ["logits"])
+
+
+# ── Serving ──────────────────────────────────────────────────────
+def softmax(logits: np.ndarray) -> np.ndarray:
+    z = logits - logits.max(axis=-1, keepdims=True)
+    np.exp(z, out=z)
+    return z / z.sum(axis=-1, keepdims=True)
+
+
+class BatchTokenizer:
+    """Fast tokenizer producing dynamically padded int64 batches."""
+
+    def __init__(self, tokenizer_path: Path, max_length: int):
+        from tokenizers import Tokenizer
+
+        self.tokenizer = Tokenizer.from_file(str(tokenizer_path))
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.pad_id = self.tokenizer.token_to_id("<pad>") or 0
+
+    def encode(self, texts: list[str]) -> list[list[int]]:
+        return [enc.ids for enc in self.tokenizer.encode_batch(texts)]
+
+    def pad(self, ids: list[list[int]]) -> dict[str, np.ndarray]:
+        """Pad to the longest sequence of this batch (not to max_length)."""
+        width = max(len(x) for x in ids)
+        input_ids = np.full((len(ids), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(ids), width), dtype=np.int64)
+        for row, seq in enumerate(ids):
+            input_ids[row, :len(seq)] = seq
+            attention_mask[row, :len(seq)] = 1
+        return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+class OnnxClassifier:
+    """One ONNX session producing one or more named logit outputs."""
+
+    def __init__(self, onnx_path: Path, heads: dict[str, str], num_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # output name -> task
+        self.heads = heads
+
+    def run(self, batch: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        feeds = {k: v for k, v in batch.items() if k in self.input_names}
+        outputs = self.session.run(list(self.heads), feeds)
+        return dict(zip(self.heads, outputs))
+
+
+class ClassifierEngine:
+    """
+    Batched CPU inference for the carrier/type/marketplace/email_type classifiers.
+
+    Models are loaded once. Tasks whose tokenizers are identical share a single
+    tokenization pass per batch.
+    """
+
+    def __init__(self, tasks=TASKS, max_length: int = None, batch_size: int = None,
+                 num_threads: int = None):
+        self.max_length = max_length or settings.cls_max_length
+        self.batch_size = batch_size or settings.cls_batch_size
+        num_threads = settings.cls_num_threads if num_threads is None else num_threads
+
+        # tokenizer digest -> (BatchTokenizer, [OnnxClassifier])
+        self.groups: dict[str, tuple[BatchTokenizer, list]] = {}
+        self.labels: dict[str, list[str]] = {}
+        self.num_threads = num_threads
+
+        if settings.cls_multitask:
+            self._load_multitask(tasks)
+
+        for task in tasks:
+            if task in self.labels:
+                continue
+            model_dir, labels_path = task_paths(task)
+            onnx_dir = onnx_dir_for(model_dir)
+            onnx_path = onnx_dir / ONNX_FILENAME
+            if not onnx_path.exists():
+                if not model_dir.exists():
+                    logger.info(f"Classifier '{task}' not trained — skipped")
+                    continue
+                try:
+                    logger.info(f"Exporting classifier '{task}' to ONNX (int8)...")
+                    export_task(task)
+                except ImportError as e:
+                    logger.warning(f"⚠️ Classifier '{task}' has no ONNX export and {e.name} "
+                                   f"is not installed — run `python -m src.classifiers --export`")
+                    continue
+
+            with open(labels_path, "r", encoding="utf-8") as f:
+                self.labels[task] = json.load(f)["labels"]
+
+            self._add(onnx_dir, {"logits": task})
+            logger.info(f"✅ Classifier '{task}' loaded ({len(self.labels[task])} labels)")
+
+    def _load_multitask(self, tasks):
+        onnx_dir = onnx_dir_for(Path(settings.cls_multitask_path))
+        if not (onnx_dir / ONNX_FILENAME).exists():
+            return
+        with open(settings.cls_multitask_labels_path, "r", encoding="utf-8") as f:
+            task_labels = json.load(f)["tasks"]
+        heads = {f"logits_{task}": task for task in task_labels}
+        self._add(onnx_dir, heads)
+        self.labels.update({task: task_labels[task] for task in task_labels if task in tasks})
+        logger.info(f"✅ Multi-task classifier loaded ({', '.join(task_labels)})")
+
+    def _add(self, onnx_dir: Path, heads: dict[str, str]):
+        tokenizer_path = onnx_dir / "tokenizer.json"
+        digest = hashlib.sha1(tokenizer_path.read_bytes()).hexdigest()
+        if digest not in self.groups:
+            self.groups[digest] = (BatchTokenizer(tokenizer_path, self.max_length), [])
+        classifier = OnnxClassifier(onnx_dir / ONNX_FILENAME, heads, self.num_threads)
+        self.groups[digest][1].append(classifier)
+
+    @property
+    def tasks(self) -> list[str]:
+        return list(self.labels)
+
+    @property
+    def available(self) -> bool:
+        """At least one classifier loaded."""
+        return bool(self.labels)
+
+    def classify(self, texts: list[str], tasks=None) -> list[dict]:
+        """
+        Classify ``texts`` for every loaded task (or only ``tasks``).
+
+        Models with no requested head are not run, and their tokenizer group is
+        skipped entirely when none of its models is needed.
+
+        Returns one dict per text: ``{task: {"label": str, "confidence": float}}``.
+        """
+        results = [{} for _ in texts]
+        if not texts:
+            return results
+        wanted = set(self.labels if tasks is None else tasks) & set(self.labels)
+
+        for tokenizer, classifiers in self.groups.values():
+            classifiers = [c for c in classifiers if wanted & set(c.heads.values())]
+            if not classifiers:
+                continue
+            ids = tokenizer.encode(texts)
+            # Length-sorted batches keep padding to a minimum
+            order = np.argsort([len(x) for x in ids], kind="stable")
+            for start in range(0, len(order), self.batch_size):
+                idx = order[start:start + self.batch_size]
+                batch = tokenizer.pad([ids[i] for i in idx])
+                for classifier in classifiers:
+                    for output, logits in classifier.run(batch).items():
+                        task = classifier.heads[output]
+                        if task in wanted:
+                            self._decode(task, logits, idx, results)
+        return results
+
+    def _decode(self, task: str, logits: np.ndarray, idx: np.ndarray, results: list[dict]):
+        probs = softmax(logits.astype(np.float32))
+        best = probs.argmax(axis=-1)
+        labels = self.labels[task]
+        for row, i in enumerate(idx):
+            results[i][task] = {
+                "label": labels[best[row]],
+                "confidence": float(probs[row, best[row]]),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--export", action="store_true", help="Export trained models to int8 ONNX")
+    parser.add_argument("--tasks", nargs="*", default=list(TASKS))
+    args = parser.parse_args()
+
+    if args.export:
+        for task in args.tasks:
+            model_dir, _ = task_paths(task)
+            if not model_dir.exists():
+                print(f"⚠️  No {task} model at {model_dir} — skipping")
+                continue
+            print(f"📦 Exporting {task}...")
+            path = export_task(task)
+            print(f"   ✅ {path} ({path.stat().st_size / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
-from bs4 import BeautifulSoup
-
-
 def clean_html_content(html_body: str) -> str:
+    from bs4 import BeautifulSoup  # import différé : seulement quand on nettoie
+
     soup = BeautifulSoup(html_body, "html.parser")
     # Supprime balises inutiles
     for tag in soup(["style", "script", "head", "link"]):
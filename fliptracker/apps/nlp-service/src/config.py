@@ -12,12 +12,21 @@ class Settings(BaseSettings):
     # Use trained_models as the default model path base
     model_base: Path = Path(__file__).parent.parent / "trained_models"
 
+    # Served spaCy model: registry version (python -m src.registry), else the
+    # folder baked into the image
+    model_path: str = "/app/trained_models"
+    model_registry_path: str = str(model_base / "registry")
+    model_version: str = ""            # pin a registry version ("" = registry ACTIVE)
+    model_watch_interval: float = 10.0  # seconds between ACTIVE checks, 0 = no watch
+    admin_token: str = ""              # X-Admin-Token for /admin/*, disabled when empty
+
     # Model paths
     ner_model_path: str = str(model_base / "ner_model" / "model-best")
     cls_carrier_path: str = str(model_base / "cls_carrier" / "model-best")
     cls_type_path: str = str(model_base / "cls_type" / "model-best")
     cls_marketplace_path: str = str(model_base / "cls_marketplace" / "model-best")
     cls_email_type_path: str = str(model_base / "cls_email_type" / "model-best")
+    cls_multitask_path: str = str(model_base / "cls_multitask" / "model-best")
 
     # Labels
     cls_carrier_labels_path: str = str(model_base / "cls_carrier" / "label_map.json")
@@ -28,10 +37,72 @@ class Settings(BaseSettings):
     cls_email_type_labels_path: str = str(
         model_base / "cls_email_type" / "label_map.json"
     )
+    cls_multitask_labels_path: str = str(
+        model_base / "cls_multitask" / "label_map.json"
+    )
 
     # Confidence thresholds
+    # A field is settled once its confidence reaches ner_confidence_threshold:
+    # later (more expensive) cascade tiers only run for unsettled fields.
     ner_confidence_threshold: float = 0.5
-    cls_confidence_threshold: float = 0.3
+    cls_confidence_threshold: float = 0.3  # minimum to accept a classifier label
+
+    # Extraction cascade: regex/dictionary -> spaCy NER -> classifiers
+    ner_entity_confidence: float = 0.8  # spaCy NER gives no per-span score
+    # unsettled -> run NER (every field NER can fill)
+    cascade_fields: list[str] = ["tracking_number", "carrier", "address", "marketplace"]
+
+    # Postal index (python -m src.postal build <La Poste CSV>), optional
+    postal_index_path: str = str(Path(__file__).parent / "data" / "postal_index.bin")
+
+    # Boilerplate stripping (python -m src.boilerplate learn <exports>), optional
+    boilerplate_enabled: bool = True
+    boilerplate_path: str = str(Path(__file__).parent / "data" / "boilerplate.npz")
+
+    # Classifier serving (ONNX Runtime, int8)
+    cls_enabled: bool = True
+    cls_multitask: bool = True  # prefer the shared-encoder model when present
+    cls_max_length: int = 256
+    cls_batch_size: int = 16
+    cls_num_threads: int = 0  # 0 = ONNX Runtime default
+
+    # Admission control (/extract/batch)
+    admission_max_inflight_emails: int = 256
+    admission_max_queue: int = 32          # waiting requests
+    admission_max_wait_seconds: float = 10.0
+    max_email_bytes: int = 1_000_000
+    max_batch_bytes: int = 20_000_000
+
+    # Shadow evaluation: replay sampled /extract/batch traffic through a
+    # candidate registry version ("" = off), see GET /admin/shadow
+    shadow_version: str = ""
+    shadow_sample_rate: float = 0.1
+    shadow_max_queue: int = 16  # sampled batches waiting; beyond, samples are dropped
+
+    # Fair scheduling across tenants (deficit round-robin over model batches)
+    scheduler_enabled: bool = True
+    scheduler_batch_size: int = 32  # emails per model batch, all tenants together
+    scheduler_quantum: int = 8      # emails per tenant per round
+    scheduler_workers: int = 1      # batches extracted concurrently
+    scheduler_tenant_labels: int = 50  # tenants with their own metrics label, others: "other"
+    scheduler_timeout_seconds: float = 300.0  # longest wait of a request for its results
+
+    # Background jobs (POST /jobs), persisted in SQLite
+    jobs_enabled: bool = True
+    jobs_db_path: str = str(Path(__file__).parent.parent / "data" / "jobs.sqlite3")
+    jobs_workers: int = 1
+    jobs_chunk_size: int = 32
+    jobs_lease_seconds: float = 600.0  # a claimed chunk is retried after this
+    jobs_max_attempts: int = 3  # chunk failures in a row before a job fails
+    jobs_page_size: int = 100
+
+    # Diagnostics (/debug/profile, /debug/memory), off by default
+    debug_endpoints: bool = False
+    debug_token: str = ""  # required in X-Debug-Token; debug endpoints answer 403 while empty
+    debug_profile_max_seconds: int = 60
+
+    # Startup: python scripts/check_import_time.py fails above this
+    import_budget_ms: float = 1000.0  # cumulative import time of src.api
 
     # Server
     host: str = "0.0.0.0"
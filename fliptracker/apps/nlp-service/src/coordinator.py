@@ -0,0 +1,455 @@
+"""
+FlipTracker NLP — Sharding coordinator
+
+Spreads a bulk extraction over several running NLP service replicas
+(Render instances, or local uvicorn processes) instead of one machine's
+worker processes (``src.bulk``). Input shards are read in order and cut into
+shards of ``--shard-size`` emails, each sent to ``POST /extract/batch`` of a
+replica:
+
+- every replica has its own number of concurrent requests (``URL=N``); idle
+  slots pull the next shard, so a faster replica simply takes more of them
+  and throughput grows with the number of replicas;
+- a failed shard is retried (on another replica when one is free) with
+  per-replica backoff, and ``429 Retry-After`` pauses only that replica;
+- work stealing: an idle slot re-sends a shard that has been in flight for
+  more than ``--steal-factor`` × the median shard time on another replica,
+  and the first answer wins, so one slow replica cannot hold back the merge;
+- a shard the replica refuses (413/422: an email over ``max_email_bytes``)
+  is split in halves down to single emails; an email still refused is
+  written as ``{"id", "error"}`` and the run goes on;
+- results are merged and written in input order, with the same JSONL output
+  and ``--resume`` checkpoint as ``src.bulk``.
+
+Usage:
+    uvicorn src.api:app --port 8001 &
+    uvicorn src.api:app --port 8002 &
+    python -m src.coordinator data/rawEmails.jsonl.gz --output data/parsed.jsonl \\
+        --replica http://localhost:8001 --replica http://localhost:8002=2
+"""
+import argparse
+import gzip
+import http.client
+import json
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from src.bulk import iter_chunks, iter_records, load_checkpoint, save_checkpoint
+
+BACKOFF_SECONDS = 1.0       # first pause of a failing replica, doubled per failure
+MAX_BACKOFF_SECONDS = 60.0
+MIN_STEAL_SECONDS = 2.0     # never duplicate a shard younger than this
+LATENCY_SAMPLES = 100       # recent shard times behind the stealing median
+
+
+class ReplicaError(Exception):
+    """
+    A shard failed on a replica: ``retry_after`` pauses the replica, ``fatal``
+    stops the run, ``rejected`` means these emails are refused (not worth a retry).
+    """
+
+    def __init__(self, message: str, retry_after: float = None, fatal: bool = False,
+                 rejected: bool = False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.fatal = fatal
+        self.rejected = rejected
+
+
+# ── Replicas ─────────────────────────────────────────────────────
+class Replica:
+    """One NLP service instance, its concurrency limit and dispatch statistics."""
+
+    def __init__(self, url: str, concurrency: int = 1, timeout: float = 300.0):
+        self.url = url.rstrip("/")
+        parts = urlsplit(self.url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Invalid replica URL: {url}")
+        self._https = parts.scheme == "https"
+        self._host, self._port = parts.hostname, parts.port
+        self._prefix = parts.path
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._local = threading.local()  # one keep-alive connection per slot thread
+
+        self.shards = 0
+        self.emails = 0
+        self.seconds = 0.0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.stolen = 0
+        self.wasted = 0           # stolen shards answered by the other copy first
+        self.rejected = 0         # emails refused even alone (written as errors)
+        self.down_until = 0.0
+
+    @classmethod
+    def parse(cls, spec: str, timeout: float = 300.0) -> "Replica":
+        """``http://host:8001`` or ``http://host:8001=4`` (4 concurrent shards)."""
+        url, _, concurrency = spec.rpartition("=") if "=" in spec.split("/")[-1] else (spec, "", "")
+        return cls(url, int(concurrency) if concurrency else 1, timeout)
+
+    def _connection(self, fresh: bool = False):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or fresh:
+            if conn is not None:
+                conn.close()
+            factory = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            conn = self._local.conn = factory(self._host, self._port, timeout=self.timeout)
+        return conn
+
+    def request(self, method: str, path: str, body: bytes = None, headers: dict = None):
+        """``(status, headers, body)``; reconnects once if a kept-alive connection was closed."""
+        for attempt in range(2):
+            conn = self._connection(fresh=attempt > 0)
+            try:
+                conn.request(method, self._prefix + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                return response.status, response.headers, response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                if attempt:
+                    raise
+        raise AssertionError("unreachable")
+
+    def health(self) -> bool:
+        try:
+            status, _, _ = self.request("GET", "/health")
+        except (OSError, http.client.HTTPException):
+            return False
+        return status == 200
+
+    def extract(self, emails: list[dict], tenant: str = "", compress: bool = True) -> list[dict]:
+        payload = json.dumps({
+            "emails": [{"body": e["body"], "subject": e["subject"], "sender": e["sender"]} for e in emails],
+            "tenant_id": tenant,
+        }, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if compress:
+            payload = gzip.compress(payload, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+
+        status, response_headers, body = self.request("POST", "/extract/batch", payload, headers)
+        if status == 429 or status == 503:
+            retry_after = float(response_headers.get("Retry-After") or BACKOFF_SECONDS)
+            raise ReplicaError(f"{status} (busy)", retry_after=retry_after)
+        if status in (413, 422):
+            raise ReplicaError(f"{status}: {body[:200].decode('utf-8', 'replace')}", rejected=True)
+        if 400 <= status < 500 and status != 408:
+            raise ReplicaError(f"{status}: {body[:200].decode('utf-8', 'replace')}", fatal=True)
+        if status != 200:
+            raise ReplicaError(f"{status}: {body[:200].decode('utf-8', 'replace')}")
+        results = json.loads(body)["results"]
+        if len(results) != len(emails):
+            raise ReplicaError(f"{len(results)} results for {len(emails)} emails")
+        return results
+
+
+# ── Coordinator ──────────────────────────────────────────────────
+class Coordinator:
+    """Dispatches shards to replicas and hands back their results in input order."""
+
+    def __init__(self, replicas: list[Replica], shards, retries: int = 3, steal_factor: float = 2.0,
+                 window: int = None, tenant: str = "bulk", compress: bool = True):
+        self.replicas = replicas
+        self.retries = retries
+        self.steal_factor = steal_factor
+        self.window = window or 4 * sum(r.concurrency for r in replicas)
+        self.tenant = tenant
+        self.compress = compress
+
+        self._source = iter(shards)
+        self._exhausted = False
+        self._cond = threading.Condition()
+        self._shards: dict[int, list[dict]] = {}       # read, not yet written
+        self._pending: deque = deque()                 # waiting for a slot (retries first)
+        self._inflight: dict[int, list[tuple]] = {}    # index -> [(replica, start)]
+        self._results: dict[int, list[dict]] = {}      # done, waiting for their turn
+        self._attempts: dict[int, int] = {}
+        self._latencies: deque = deque(maxlen=LATENCY_SAMPLES)
+        self._next_index = 0
+        self._next_write = 0
+        self._error: Exception = None
+        self._closed = False
+
+    # ── Slots ──
+    def _read_ahead(self):
+        """Read the next shard, unless the window of unwritten shards is full."""
+        if self._exhausted or self._next_index - self._next_write >= self.window:
+            return
+        shard = next(self._source, None)
+        if shard is None:
+            self._exhausted = True
+            return
+        self._shards[self._next_index] = shard
+        self._pending.append(self._next_index)
+        self._next_index += 1
+
+    def _straggler(self, replica: Replica, now: float):
+        """Oldest shard running alone on another replica for too long, if any."""
+        if len(self._latencies) < 3 or replica.consecutive_failures:
+            return None
+        limit = max(MIN_STEAL_SECONDS, self.steal_factor * statistics.median(self._latencies))
+        for index in sorted(self._inflight):
+            copies = self._inflight[index]
+            if self._done(index):
+                continue  # answered by a stolen copy: only the original is still running
+            if len(copies) == 1 and copies[0][0] is not replica and now - copies[0][1] > limit:
+                return index
+        return None
+
+    def _next(self, replica: Replica):
+        """Block until this replica slot has a shard: ``(index, shard, stolen)``, index None when done."""
+        with self._cond:
+            while self._error is None and not self._closed:
+                now = time.monotonic()
+                if self._exhausted and not self._pending and not self._inflight:
+                    return None, None, False
+                if replica.down_until > now:
+                    self._cond.wait(replica.down_until - now)
+                    continue
+                if not self._pending:
+                    self._read_ahead()
+                if self._pending:
+                    index = self._pending.popleft()
+                    self._inflight.setdefault(index, []).append((replica, now))
+                    return index, self._shards[index], False
+                index = self._straggler(replica, now)
+                if index is not None:
+                    self._inflight[index].append((replica, now))
+                    replica.stolen += 1
+                    return index, self._shards[index], True
+                self._cond.wait(timeout=0.5)
+            return None, None, False
+
+    def _release(self, index: int, replica: Replica):
+        copies = self._inflight.get(index, [])
+        for i, (holder, _) in enumerate(copies):
+            if holder is replica:
+                del copies[i]
+                break
+        if not copies:
+            self._inflight.pop(index, None)
+
+    def _done(self, index: int) -> bool:
+        return index in self._results or index < self._next_write
+
+    def _completed(self, index: int, replica: Replica, results: list[dict], seconds: float, stolen: bool):
+        with self._cond:
+            self._release(index, replica)
+            replica.consecutive_failures = 0
+            replica.seconds += seconds
+            self._latencies.append(seconds)
+            if self._done(index):
+                replica.wasted += 1
+            else:
+                self._results[index] = results
+                replica.shards += 1
+                replica.emails += len(results)
+                if stolen:
+                    print(f"   🦊 shard {index} stolen by {replica.url}", flush=True)
+            self._cond.notify_all()
+
+    def _failed(self, index: int, replica: Replica, error: ReplicaError):
+        with self._cond:
+            self._release(index, replica)
+            replica.failures += 1
+            now = time.monotonic()
+            if error.retry_after is not None:
+                replica.down_until = now + error.retry_after
+            else:
+                replica.consecutive_failures += 1
+                backoff = BACKOFF_SECONDS * 2 ** (replica.consecutive_failures - 1)
+                replica.down_until = now + min(MAX_BACKOFF_SECONDS, backoff)
+            print(f"   ⚠️  shard {index} failed on {replica.url}: {error}", flush=True)
+
+            if error.fatal:
+                self._error = error
+            elif not self._done(index) and index not in self._inflight:
+                if error.retry_after is None:  # a busy replica is not the shard's fault
+                    self._attempts[index] = self._attempts.get(index, 0) + 1
+                if self._attempts.get(index, 0) > self.retries:
+                    self._error = RuntimeError(f"shard {index} failed {self._attempts[index]} times: {error}")
+                else:
+                    self._pending.appendleft(index)
+            self._cond.notify_all()
+
+    def _extract(self, replica: Replica, shard: list[dict]) -> list[dict]:
+        """Results of ``shard``; a refused shard is bisected, a refused email becomes an error record."""
+        try:
+            return replica.extract(shard, self.tenant, self.compress)
+        except ReplicaError as e:
+            if not e.rejected:
+                raise
+            if len(shard) == 1:
+                with self._cond:
+                    replica.rejected += 1
+                print(f"   ⛔ email {shard[0]['id']} refused by {replica.url}: {e}", flush=True)
+                return [{"error": str(e)}]
+        half = len(shard) // 2
+        return self._extract(replica, shard[:half]) + self._extract(replica, shard[half:])
+
+    def _worker(self, replica: Replica):
+        while True:
+            index, shard, stolen = self._next(replica)
+            if index is None:
+                return
+            start = time.perf_counter()
+            try:
+                results = self._extract(replica, shard)
+            except ReplicaError as e:
+                self._failed(index, replica, e)
+            except (OSError, http.client.HTTPException, ValueError, KeyError) as e:
+                self._failed(index, replica, ReplicaError(f"{type(e).__name__}: {e}"))
+            else:
+                self._completed(index, replica, results, time.perf_counter() - start, stolen)
+
+    # ── Merge ──
+    def run(self, write):
+        """Call ``write(shard, results)`` for every shard, in input order."""
+        threads = [
+            threading.Thread(target=self._worker, args=(replica,), name=f"coord-{i}-{slot}", daemon=True)
+            for i, replica in enumerate(self.replicas) for slot in range(replica.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while True:
+                with self._cond:
+                    while (self._next_write not in self._results and self._error is None
+                           and not (self._exhausted and not self._shards)):
+                        self._cond.wait(timeout=1.0)
+                    if self._error is not None:
+                        raise self._error
+                    if self._next_write not in self._results:
+                        break  # every shard written
+                    index = self._next_write
+                    shard, results = self._shards.pop(index), self._results.pop(index)
+                    self._next_write += 1
+                    self._cond.notify_all()  # the window moved: slots may read ahead
+                write(shard, results)
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+        # Slots still waiting on a copy whose shard is already written are not
+        # waited for (daemon threads: their late answers are simply dropped)
+        with self._cond:
+            busy = {replica for copies in self._inflight.values() for replica, _ in copies}
+        for thread, replica in zip(threads, (r for r in self.replicas for _ in range(r.concurrency))):
+            if replica not in busy:
+                thread.join()
+
+
+# ── CLI ──────────────────────────────────────────────────────────
+def print_table(replicas: list[Replica], elapsed: float):
+    print(f"\n   {'Replica':<32} {'slots':>5} {'shards':>7} {'emails':>8} {'emails/s':>9} "
+          f"{'failed':>6} {'stolen':>6} {'wasted':>6} {'refused':>7}")
+    print("   " + "-" * 94)
+    for r in replicas:
+        rate = r.emails / elapsed if elapsed else 0.0
+        print(f"   {r.url[:32]:<32} {r.concurrency:>5} {r.shards:>7} {r.emails:>8} {rate:>9.1f} "
+              f"{r.failures:>6} {r.stolen:>6} {r.wasted:>6} {r.rejected:>7}")
+
+
+def run(inputs: list[Path], output: Path, replicas: list[Replica], shard_size: int,
+        resume: bool = False, **options):
+    checkpoint_path = output.with_name(output.name + ".ckpt.json")
+    run_key = {"inputs": [str(p) for p in inputs], "chunk_size": shard_size}
+    checkpoint = load_checkpoint(checkpoint_path, run_key) if resume else {
+        "chunks_done": 0, "records_done": 0, "output_bytes": 0,
+    }
+    if checkpoint["output_bytes"] and not output.exists():
+        raise SystemExit(f"❌ {output} is missing but {checkpoint_path} says it has "
+                         f"{checkpoint['records_done']} results — cannot resume")
+    checkpoint["run"] = run_key
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    out = open(output, "r+b" if resume and output.exists() else "wb")
+    out.truncate(checkpoint["output_bytes"])  # drop a partially written shard
+    out.seek(checkpoint["output_bytes"])
+
+    shards = iter_chunks(iter_records(inputs), shard_size)
+    skipped = 0
+    for _ in range(checkpoint["chunks_done"]):
+        skipped += len(next(shards, []))
+    if skipped:
+        print(f"   ⏩ Resuming after {checkpoint['chunks_done']} shards ({skipped} emails)")
+
+    start = time.perf_counter()
+    processed = 0
+
+    def write(shard: list[dict], results: list[dict]):
+        nonlocal processed
+        lines = [json.dumps({"id": record["id"], **result}, ensure_ascii=False)
+                 for record, result in zip(shard, results)]
+        out.write(("\n".join(lines) + "\n").encode("utf-8"))
+        out.flush()
+        processed += len(lines)
+        checkpoint["chunks_done"] += 1
+        checkpoint["records_done"] += len(lines)
+        checkpoint["output_bytes"] = out.tell()
+        save_checkpoint(checkpoint_path, checkpoint)
+        elapsed = time.perf_counter() - start
+        print(f"   ⚡ {checkpoint['records_done']} emails | "
+              f"{processed / elapsed:.1f} emails/s", flush=True)
+
+    try:
+        Coordinator(replicas, shards, **options).run(write)
+    finally:
+        out.close()
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed else 0.0
+    print_table(replicas, elapsed)
+    print(f"\n✅ {processed} emails in {elapsed:.1f}s ({rate:.1f} emails/s) → {output}")
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", type=Path, nargs="+", help=".json / .jsonl shards (.gz, .zst)")
+    parser.add_argument("--output", type=Path, required=True)
+    parser.add_argument("--replica", action="append", required=True, metavar="URL[=N]",
+                        help="NLP service base URL, N concurrent shards (repeatable)")
+    parser.add_argument("--shard-size", type=int, default=64, help="Emails per request")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per shard after the first")
+    parser.add_argument("--steal-factor", type=float, default=2.0,
+                        help="Re-send a shard in flight for longer than this × the median shard time")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout (s)")
+    parser.add_argument("--tenant", default="bulk", help="tenant_id sent to the fair scheduler")
+    parser.add_argument("--no-gzip", action="store_true", help="Send uncompressed request bodies")
+    parser.add_argument("--resume", action="store_true", help="Continue from the checkpoint")
+    args = parser.parse_args()
+
+    missing = [p for p in args.inputs if not p.exists()]
+    if missing:
+        print(f"❌ Not found: {', '.join(map(str, missing))}")
+        sys.exit(1)
+    try:
+        replicas = [Replica.parse(spec, args.timeout) for spec in args.replica]
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    healthy = [replica.health() for replica in replicas]
+    for replica, ok in zip(replicas, healthy):
+        print(f"   {'✅' if ok else '⚠️ '} {replica.url} ({replica.concurrency} slots)"
+              f"{'' if ok else ' — not answering /health, will be retried'}")
+    if not any(healthy):
+        print("❌ No replica is answering")
+        sys.exit(1)
+
+    slots = sum(r.concurrency for r in replicas)
+    print(f"🛰️  Sharded extraction: {len(args.inputs)} input(s), {len(replicas)} replica(s), "
+          f"{slots} slots, shards of {args.shard_size}")
+    run(args.inputs, args.output, replicas, args.shard_size, resume=args.resume,
+        retries=args.retries, steal_factor=args.steal_factor, tenant=args.tenant,
+        compress=not args.no_gzip)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+FlipTracker NLP — Production diagnostics
+
+On-demand tools behind ``/debug/*`` (disabled unless ``NLP_DEBUG_ENDPOINTS``
+is set, optionally protected by ``NLP_DEBUG_TOKEN``). Nothing runs until an
+endpoint is called, so they cost nothing the rest of the time:
+
+- ``profile(seconds)``: samples the stacks of all threads (``sys._current_frames``)
+  at a fixed interval while live traffic is served, and returns them in the
+  collapsed-stack format read by flamegraph.pl, speedscope and inferno
+  (``thread;outer (file.py:12);inner (file.py:34) <samples>``);
+- ``memory_report()``: starts tracemalloc on the first call, then returns the
+  top allocation sites and the growth since the previous call (leak hunting).
+
+Usage:
+    curl -H "X-Debug-Token: $TOKEN" "localhost:8000/debug/profile?seconds=30" > nlp.folded
+    flamegraph.pl nlp.folded > nlp.svg
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+# Leaf frames of threads that are only waiting (uvicorn loop, idle workers)
+IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py")
+
+_profile_lock = threading.Lock()
+_memory_lock = threading.Lock()
+_last_snapshot = None
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    path = Path(code.co_filename)
+    # Keep package context: src/extractor.py, spacy/language.py...
+    short = "/".join(path.parts[-2:]) if len(path.parts) > 1 else path.name
+    return f"{code.co_name} ({short}:{frame.f_lineno})"
+
+
+def _is_idle(frame) -> bool:
+    return frame.f_code.co_filename.endswith(IDLE_FILES)
+
+
+def profile(seconds: float, interval: float = 0.005, include_idle: bool = False) -> tuple[str, int]:
+    """
+    Sample every thread's stack for ``seconds``.
+
+    Returns ``(collapsed_stacks, n_samples)``. Raises ``RuntimeError`` when a
+    profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (not include_idle and _is_idle(frame)):
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+    finally:
+        _profile_lock.release()
+    folded = "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    return folded + "\n", samples
+
+
+def _site(stat) -> str:
+    frame = stat.traceback[0]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+def memory_report(limit: int = 25, frames: int = 1, stop: bool = False) -> dict:
+    """
+    Top allocation sites (by size) and the diff from the previous call.
+
+    The first call starts tracemalloc (allocations made before it are not
+    attributed); ``stop=True`` stops tracing and drops the saved snapshot.
+    """
+    global _last_snapshot
+    with _memory_lock:
+        if stop:
+            tracemalloc.stop()
+            _last_snapshot = None
+            return {"tracing": False}
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _last_snapshot = None
+
+        ignore = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ]
+        snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+        current, peak = tracemalloc.get_traced_memory()
+        report = {
+            "tracing": True,
+            "tracedBytes": current,
+            "peakBytes": peak,
+            "top": [
+                {"site": _site(stat), "sizeBytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:limit]
+            ],
+            "diff": None,
+        }
+        if _last_snapshot is not None:
+            report["diff"] = [
+                {"site": _site(stat), "sizeDiffBytes": stat.size_diff, "countDiff": stat.count_diff,
+                 "sizeBytes": stat.size}
+                for stat in snapshot.compare_to(_last_snapshot, "lineno")[:limit]
+                if stat.size_diff
+            ]
+        _last_snapshot = snapshot
+        return report
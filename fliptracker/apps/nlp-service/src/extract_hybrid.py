@@ -1,10 +1,11 @@
 import re
-from langdetect import detect
 from .cleaning import clean_html_content
 from .nlp_pipeline import load_nlp
 
 
 def extract_metadata(email_html: str):
+    from langdetect import detect  # dépendance d'entraînement, pas du service
+
     # Nettoyage
     text = clean_html_content(email_html)
     # Détection langue
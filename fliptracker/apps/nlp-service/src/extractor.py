@@ -1,90 +1,290 @@
-import spacy
 import os
 import logging
-import re
-from bs4 import BeautifulSoup
+
+from src import links, patterns
+from src.config import settings
+from src.metrics import metrics
 
 # Configuration du logging
 logger = logging.getLogger(__name__)
 
+FIELDS = ("address", "carrier", "tracking_number", "type", "marketplace", "email_type")
+NER_FIELDS = ("address", "carrier", "tracking_number", "marketplace")
+TIER_OF_SOURCE = {
+    "subject": "header", "sender": "header",
+    "regex": "regex", "dictionary": "regex", "link": "regex",
+    "ner": "ner", "classifier": "classifier",
+}
+# Label NER -> champ du résultat
+NER_LABEL_FIELDS = {
+    "ADDRESS": "address", "CARRIER": "carrier", "ORG": "carrier",
+    "TRACKING": "tracking_number", "TRACKING_NUM": "tracking_number", "MARKETPLACE": "marketplace",
+}
+
+metrics.describe("nlp_cascade_docs_total", "counter", "Emails processed by each cascade tier")
+metrics.describe("nlp_cascade_hits_total", "counter", "Fields settled by each cascade tier")
+metrics.describe("nlp_cascade_seconds_total", "counter", "Time spent in each cascade tier")
+metrics.describe("nlp_boilerplate_chars_removed_total", "counter", "Characters stripped as boilerplate")
+metrics.describe("nlp_boilerplate_tokens_removed_total", "counter", "Whitespace tokens stripped as boilerplate")
+metrics.describe("nlp_boilerplate_tokens_kept_total", "counter", "Whitespace tokens left for the models")
+
 class HybridExtractor:
-    def __init__(self):
-        # Chemin validé par tes logs Docker
-        self.model_path = "/app/trained_models"
-        
-        # Regex de secours pour l'adresse (cherche un code postal 5 chiffres + ville)
-        self.address_regex = re.compile(r'(\d{5}\s+[A-ZÀ-Z\s\-]+)', re.IGNORECASE)
-        # Regex pour les numéros de suivi (souvent 13 à 15 caractères alphanum)
-        self.tracking_regex = re.compile(r'\b[A-Z0-9]{10,20}\b')
+    def __init__(self, model_path: str = None, version: str = None, strict: bool = False):
+        """``strict`` : un modèle absent ou illisible lève au lieu de servir un modèle vide"""
+        # Imports lourds différés : importer le module (FIELDS, ...) reste léger
+        import spacy
+        from src.boilerplate import BoilerplateModel
+        from src.postal import PostalIndex
 
+        # Modèle cuit dans l'image (/app/trained_models) ou version du registre
+        self.model_path = model_path or settings.model_path
+        self.version = version or os.environ.get("MODEL_VERSION", "baked")
+        
         if os.path.exists(os.path.join(self.model_path, "config.cfg")):
             try:
                 self.nlp = spacy.load(self.model_path)
                 logger.info("✅ CERVEAU CONNECTÉ : Modèle chargé.")
             except Exception as e:
                 logger.error(f"❌ CRASH CHARGEMENT : {e}")
+                if strict:
+                    raise
                 self.nlp = spacy.blank("fr")
+        elif strict:
+            raise FileNotFoundError(f"Modèle introuvable : {self.model_path}")
         else:
             logger.warning("⚠️ GPS PERDU : Modèle introuvable, utilisation d'un modèle vide.")
             self.nlp = spacy.blank("fr")
 
-    def clean_html(self, raw_html):
-        """Nettoyage chirurgical du HTML"""
+        # Index des codes postaux (validation des adresses), optionnel
+        self.postal = PostalIndex.load_default()
+
+        # Boilerplate par domaine d'expéditeur (footers, mentions légales), optionnel
+        self.boilerplate = BoilerplateModel.load_default()
+
+        # Classifieurs CamemBERT (ONNX int8), optionnels
+        self.classifiers = None
+        if settings.cls_enabled:
+            try:
+                from src.classifiers import ClassifierEngine
+                engine = ClassifierEngine()
+                self.classifiers = engine if engine.available else None
+            except ImportError as e:
+                logger.warning(f"⚠️ Classifieurs désactivés ({e.name} non installé)")
+
+    def clean_html(self, raw_html, with_links: bool = False):
+        """Nettoyage chirurgical du HTML (+ liens de suivi des href si ``with_links``)"""
         if not raw_html:
-            return ""
+            return ("", []) if with_links else ""
+        from bs4 import BeautifulSoup
+
         try:
             soup = BeautifulSoup(raw_html, "lxml")
             for element in soup(["script", "style", "head", "title", "meta"]):
                 element.decompose()
             
             # On garde les sauts de ligne pour aider l'IA à voir les blocs
-            text = soup.get_text(separator=' ')
+            # (même parcours de l'arbre que la récolte des href)
+            text, hrefs = links.text_and_links(soup, separator=' ')
             lines = (line.strip() for line in text.splitlines())
-            return "\n".join(chunk for chunk in lines if chunk)
+            text = "\n".join(chunk for chunk in lines if chunk)
+            return (text, links.find_tracking_links(hrefs)) if with_links else text
         except Exception as e:
             logger.error(f"Erreur nettoyage : {e}")
-            return raw_html
+            return (raw_html, []) if with_links else raw_html
 
-    def extract_entities(self, text: str):
-        cleaned_text = self.clean_html(text)
-        doc = self.nlp(cleaned_text)
-        
-        results = {
-            "address": None,
-            "carrier": None,
-            "tracking_number": None
-        }
+    def clean(self, raw_html, sender: str = "", with_links: bool = False):
+        """HTML -> texte, puis suppression du boilerplate propre à l'expéditeur"""
+        text, tracking_links = self.clean_html(raw_html, with_links=True)
+        if self.boilerplate is not None and text:
+            text, stats = self.boilerplate.strip(text, sender)
+            metrics.inc("nlp_boilerplate_chars_removed_total", stats.chars_removed)
+            metrics.inc("nlp_boilerplate_tokens_removed_total", stats.tokens_removed)
+            metrics.inc("nlp_boilerplate_tokens_kept_total", stats.tokens_after)
+        return (text, tracking_links) if with_links else text
+
+    def extract_entities(self, text: str, sender: str = "", subject: str = ""):
+        return self.extract_batch([text], senders=[sender], subjects=[subject])[0]
+
+    def extract_batch(self, texts: list[str], senders: list[str] = None, subjects: list[str] = None,
+                      batch_size: int = 32):
+        """
+        Extraction en cascade sur un lot, chaque champ avec sa confiance :
+
+        - en-têtes : regex sur l'objet + domaine de l'expéditeur, avant même
+          le nettoyage du HTML ; les champs qu'ils règlent sont exclus du NER
+        - tier 0 : liens de suivi des href, regex compilées + dictionnaires
+          (quelques µs par email)
+        - tier 1 : NER spaCy (nlp.pipe), seulement pour les emails dont un
+          champ de ``cascade_fields`` reste sous ``ner_confidence_threshold``
+        - tier 2 : classifieurs ONNX, seulement pour les tâches encore incertaines
+
+        Un champ encore sous le seuil après le dernier tier est rendu à ``None`` ;
+        sa meilleure valeur reste visible dans ``candidates`` (valeur, confiance, source).
+        """
+        threshold = settings.ner_confidence_threshold
+        senders = senders or [""] * len(texts)
+        subjects = subjects or [""] * len(texts)
+
+        # En-têtes : quelques dizaines de caractères, souvent suffisants
+        with metrics.timer("nlp_cascade_seconds_total", tier="header"):
+            results = [self._headers(subject, sender) for subject, sender in zip(subjects, senders)]
+        metrics.inc("nlp_cascade_docs_total", len(results), tier="header")
+        # Exclus du NER : seulement les champs réglés au moins au niveau d'un format
+        header_fields = [
+            {f for f in NER_FIELDS if result["confidence"][f] >= max(threshold, patterns.FORMAT)}
+            for result in results
+        ]
 
-        # 1. Tentative avec l'IA (tes labels entraînés)
+        cleaned = [self.clean(text, sender, with_links=True) for text, sender in zip(texts, senders)]
+        cleaned_texts = [text for text, _ in cleaned]
+
+        with metrics.timer("nlp_cascade_seconds_total", tier="regex"):
+            for result, (text, tracking_links) in zip(results, cleaned):
+                self._tier0(result, text, tracking_links)
+        metrics.inc("nlp_cascade_docs_total", len(results), tier="regex")
+
+        # Tier 1 : NER uniquement sur les emails non résolus
+        ner_fields = [f for f in settings.cascade_fields if f in NER_FIELDS]
+        pending = [
+            i for i, result in enumerate(results)
+            if any(result["confidence"][f] < threshold for f in ner_fields)
+        ]
+        if pending and self.nlp.pipe_names:  # modèle vide : rien à gagner
+            with metrics.timer("nlp_cascade_seconds_total", tier="ner"):
+                docs = self.nlp.pipe((cleaned_texts[i] for i in pending), batch_size=batch_size)
+                for i, doc in zip(pending, docs):
+                    # Limité aux champs que l'objet/l'expéditeur n'ont pas réglés
+                    self._apply_ner(results[i], doc, skip=header_fields[i])
+            metrics.inc("nlp_cascade_docs_total", len(pending), tier="ner")
+
+        # Tier 2 : classifieurs pour les tâches encore sous le seuil
+        if self.classifiers is not None:
+            needed = [
+                [t for t in self.classifiers.tasks if results[i]["confidence"].get(t, 0.0) < threshold]
+                for i in range(len(results))
+            ]
+            pending = [i for i, tasks in enumerate(needed) if tasks]
+            if pending:
+                tasks = sorted({t for i in pending for t in needed[i]})
+                with metrics.timer("nlp_cascade_seconds_total", tier="classifier"):
+                    classifications = self.classifiers.classify(
+                        [cleaned_texts[i] for i in pending], tasks=tasks
+                    )
+                for i, classification in zip(pending, classifications):
+                    self._apply_classification(results[i], classification, needed[i])
+                metrics.inc("nlp_cascade_docs_total", len(pending), tier="classifier")
+
+        for result in results:
+            result["model_version"] = self.version
+            self._withhold_unsettled(result, threshold)
+            for field, source in result["source"].items():
+                metrics.inc("nlp_cascade_hits_total", tier=TIER_OF_SOURCE[source], field=field)
+        return results
+
+    @staticmethod
+    def _withhold_unsettled(result: dict, threshold: float):
+        """Champs sous leur seuil (classifieurs : ``cls_confidence_threshold``) -> ``candidates``"""
+        result["candidates"] = {}
+        for field, source in list(result["source"].items()):
+            minimum = settings.cls_confidence_threshold if source == "classifier" else threshold
+            if result["confidence"][field] < minimum:
+                result["candidates"][field] = {
+                    "value": result[field], "confidence": result["confidence"][field], "source": source,
+                }
+                result[field] = None
+                result["confidence"][field] = 0.0
+                del result["source"][field]
+
+    @staticmethod
+    def _propose(result: dict, field: str, value, confidence: float, source: str):
+        """Garde la valeur la plus sûre pour un champ."""
+        if value and confidence > result["confidence"].get(field, 0.0):
+            result[field] = value
+            result["confidence"][field] = round(confidence, 3)
+            result["source"][field] = source
+
+    def _headers(self, subject: str, sender: str) -> dict:
+        """Résultat initial : objet (regex du tier 0) + domaine de l'expéditeur"""
+        result = {field: None for field in FIELDS}
+        result["confidence"] = {field: 0.0 for field in FIELDS}
+        result["source"] = {}
+        result["classification"] = {}
+
+        for field, code in patterns.find_sender(sender).items():
+            self._propose(result, field, code, patterns.SENDER, "sender")
+        if not subject:
+            return result
+
+        # Les objets citent souvent un n° de commande : seuls les formats
+        # (ou chiffres de contrôle) de transporteur sont retenus
+        candidates = [c for c in patterns.find_tracking(subject) if c[2] >= patterns.FORMAT]
+        if candidates:
+            number, carrier, confidence = candidates[0]
+            self._propose(result, "tracking_number", number, confidence, "subject")
+            if carrier:
+                self._propose(result, "carrier", carrier, confidence - 0.1, "subject")
+        carrier, confidence = patterns.find_carrier(subject)
+        self._propose(result, "carrier", carrier, confidence, "subject")
+        marketplace, confidence = patterns.find_marketplace(subject)
+        self._propose(result, "marketplace", marketplace, confidence, "subject")
+        return result
+
+    def _tier0(self, result: dict, cleaned_text: str, tracking_links: list = ()) -> dict:
+        # Lien vers la page de suivi : numéro et transporteur exacts
+        if tracking_links:
+            number, carrier, confidence, _ = tracking_links[0]
+            self._propose(result, "tracking_number", number, confidence, "link")
+            if carrier:
+                self._propose(result, "carrier", carrier, confidence, "link")
+
+        candidates = patterns.find_tracking(cleaned_text)
+        if candidates:
+            number, carrier, confidence = candidates[0]
+            self._propose(result, "tracking_number", number, confidence, "regex")
+            # Un format propre à un transporteur désigne aussi le transporteur
+            if carrier and confidence >= patterns.FORMAT:
+                self._propose(result, "carrier", carrier, confidence - 0.1, "regex")
+
+        carrier, confidence = patterns.find_carrier(cleaned_text)
+        self._propose(result, "carrier", carrier, confidence, "dictionary")
+        marketplace, confidence = patterns.find_marketplace(cleaned_text)
+        self._propose(result, "marketplace", marketplace, confidence, "dictionary")
+        address, confidence = patterns.find_address(cleaned_text, self.postal)
+        self._propose(result, "address", address, confidence, "regex")
+        return result
+
+    def _apply_ner(self, result: dict, doc, skip: set = frozenset()):
+        confidence = settings.ner_entity_confidence
+        seen = set()
         for ent in doc.ents:
             label = ent.label_
             val = ent.text.strip()
-            
-            if label == "ADDRESS" and not results["address"]:
-                results["address"] = val
-            elif label in ["CARRIER", "ORG"] and not results["carrier"]:
+            if label in seen or NER_LABEL_FIELDS.get(label) in skip:
+                continue
+
+            if label == "ADDRESS":
+                self._propose(result, "address", val, confidence, "ner")
+            elif label in ["CARRIER", "ORG"]:
                 # On évite les captures débiles comme "Monsieur" ou "Aide"
-                if len(val) > 2 and val.lower() not in ["monsieur", "madame", "aide", "bonjour"]:
-                    results["carrier"] = val
-            elif label in ["TRACKING", "TRACKING_NUM"] and not results["tracking_number"]:
-                results["tracking_number"] = val
+                if len(val) <= 2 or val.lower() in ["monsieur", "madame", "aide", "bonjour"]:
+                    continue
+                code = patterns.canonical_carrier(val)
+                # Nom hors dictionnaire : gardé, mais moins sûr
+                self._propose(result, "carrier", code or val,
+                              confidence if code else confidence / 2, "ner")
+            elif label in ["TRACKING", "TRACKING_NUM"]:
+                self._propose(result, "tracking_number", val, confidence, "ner")
+            elif label == "MARKETPLACE":
+                code = patterns.find_marketplace(val)[0]
+                self._propose(result, "marketplace", code or val,
+                              confidence if code else confidence / 2, "ner")
+            else:
+                continue
+            seen.add(label)
 
-        # 2. SYSTÈME DE SECOURS (Si l'IA a échoué)
-        
-        # Secours Adresse : Si rien trouvé, on cherche un code postal dans le texte
-        if not results["address"]:
-            match = self.address_regex.search(cleaned_text)
-            if match:
-                # On prend un peu de texte avant le code postal pour avoir la rue
-                start = max(0, match.start() - 30)
-                results["address"] = cleaned_text[start:match.end()].strip().replace('\n', ' ')
-                logger.info(f"Fallback Regex : Adresse trouvée via code postal")
-
-        # Secours Tracking : On cherche des motifs classiques
-        if not results["tracking_number"]:
-            # On cherche dans le sujet ou le corps (souvent après un #)
-            ids = re.findall(r'#([A-Z0-9]{10,})', cleaned_text)
-            if ids:
-                results["tracking_number"] = ids[0]
-
-        return results
\ No newline at end of file
+    def _apply_classification(self, result: dict, classification: dict, tasks: list[str]):
+        result["classification"] = classification
+        for task in tasks:
+            prediction = classification.get(task)
+            if prediction and prediction["confidence"] >= settings.cls_confidence_threshold:
+                self._propose(result, task, prediction["label"], prediction["confidence"], "classifier")
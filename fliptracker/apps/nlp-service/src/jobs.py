@@ -0,0 +1,293 @@
+"""
+FlipTracker NLP — Extraction jobs
+
+Large syncs and backfills are submitted as jobs instead of one long
+``/extract/batch`` request. Emails and results live in a local SQLite
+database (WAL mode), so queued and partially processed jobs survive a
+restart. Background worker threads share the API's loaded extractor.
+
+Emails are claimed in chunks with a lease: a chunk claimed by a worker that
+died (restart, crash) is claimed again once its lease expires. Active jobs are
+claimed in rotation (least recently claimed first), and with a scheduler the
+chunks are extracted under the job's tenant, so a large backfill does not hold
+back other users' jobs or requests.
+
+A chunk interrupted by a shutdown is released for the next run. A chunk
+whose extraction raises is released too, and the job only fails after
+``max_attempts`` failures in a row (``attempts``, reset by every stored chunk),
+``retry_delay`` seconds apart.
+
+Tables:
+    jobs(id, tenant_id, status, total, done, error, attempts, created_at, updated_at)
+    emails(job_id, idx, body, subject, sender, claimed_at, result)
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    tenant_id TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,            -- queued | running | done | failed
+    total INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    error TEXT,                      -- last error (of a retried chunk, or the failure)
+    attempts INTEGER NOT NULL DEFAULT 0,  -- chunk failures in a row
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS emails (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    subject TEXT NOT NULL DEFAULT '',
+    sender TEXT NOT NULL DEFAULT '',
+    claimed_at REAL,                 -- lease start, NULL when unclaimed
+    result TEXT,                     -- JSON, NULL until processed
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, updated_at);
+"""
+
+metrics.describe("nlp_jobs_emails_total", "counter", "Emails processed by background jobs")
+metrics.describe("nlp_jobs_submitted_total", "counter", "Jobs submitted")
+
+
+class JobStore:
+    """SQLite persistence of jobs, their emails and results."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            if columns and "tenant_id" not in columns:  # database created before tenants
+                db.execute("ALTER TABLE jobs ADD COLUMN tenant_id TEXT NOT NULL DEFAULT ''")
+                db.execute("DROP INDEX IF EXISTS jobs_status")
+            if columns and "attempts" not in columns:  # database created before retries
+                db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def submit(self, emails: list[dict], tenant_id: str = "") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT INTO jobs (id, tenant_id, status, total, created_at, updated_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, tenant_id or "", len(emails), now, now),
+            )
+            db.executemany(
+                "INSERT INTO emails (job_id, idx, body, subject, sender) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, i, e["body"], e.get("subject", ""), e.get("sender", ""))
+                 for i, e in enumerate(emails)],
+            )
+            if not emails:
+                db.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job_id,))
+            db.execute("COMMIT")
+        metrics.inc("nlp_jobs_submitted_total")
+        return job_id
+
+    def get(self, job_id: str):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> list[dict]:
+        """Processed results in email order (``index`` = position in the submission)."""
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT idx, result FROM emails WHERE job_id = ? AND result IS NOT NULL "
+                "ORDER BY idx LIMIT ? OFFSET ?",
+                (job_id, limit, offset),
+            ).fetchall()
+        return [{"index": row["idx"], **json.loads(row["result"])} for row in rows]
+
+    def claim(self, chunk_size: int, lease_seconds: float):
+        """
+        Lease the next ``chunk_size`` unprocessed emails of the least recently
+        claimed active job (claiming bumps ``updated_at``: jobs take turns).
+
+        Returns ``(job_id, [rows])`` or ``(None, [])`` when there is nothing to do;
+        rows carry the job's ``tenant_id``.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")  # one claimer at a time, across processes
+            try:
+                jobs = db.execute(
+                    "SELECT id, tenant_id FROM jobs WHERE status IN ('queued', 'running') "
+                    "ORDER BY updated_at, created_at"
+                ).fetchall()
+                for job in jobs:
+                    rows = db.execute(
+                        "SELECT idx, body, subject, sender FROM emails "
+                        "WHERE job_id = ? AND result IS NULL AND (claimed_at IS NULL OR claimed_at < ?) "
+                        "ORDER BY idx LIMIT ?",
+                        (job["id"], now - lease_seconds, chunk_size),
+                    ).fetchall()
+                    if rows:
+                        db.executemany(
+                            "UPDATE emails SET claimed_at = ? WHERE job_id = ? AND idx = ?",
+                            [(now, job["id"], row["idx"]) for row in rows],
+                        )
+                        db.execute(
+                            "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                            (now, job["id"]),
+                        )
+                        db.execute("COMMIT")
+                        return job["id"], [{**row, "tenant_id": job["tenant_id"]} for row in rows]
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return None, []
+
+    def complete(self, job_id: str, results: list[tuple[int, dict]]):
+        """Store results of a claimed chunk and update the job progress."""
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            stored = db.executemany(
+                "UPDATE emails SET result = ? WHERE job_id = ? AND idx = ? AND result IS NULL",
+                [(json.dumps(result, ensure_ascii=False), job_id, idx) for idx, result in results],
+            ).rowcount  # a chunk re-claimed after its lease expired is only counted once
+            db.execute(
+                "UPDATE jobs SET done = done + ?, attempts = 0, error = NULL, updated_at = ? WHERE id = ?",
+                (stored, now, job_id),
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'done' WHERE id = ? AND done = total", (job_id,)
+            )
+            db.execute("COMMIT")
+
+    def release(self, job_id: str, indices: list[int]):
+        """Give a claimed chunk back without waiting for its lease (shutdown)."""
+        with self._connect() as db:
+            db.executemany(
+                "UPDATE emails SET claimed_at = NULL WHERE job_id = ? AND idx = ? AND result IS NULL",
+                [(job_id, idx) for idx in indices],
+            )
+
+    def retry(self, job_id: str, indices: list[int], error: str, max_attempts: int) -> bool:
+        """
+        Record a failed chunk: released for another attempt, or the job fails
+        once ``max_attempts`` chunks failed in a row. True when the job failed.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "UPDATE jobs SET attempts = attempts + 1, error = ?, updated_at = ? WHERE id = ?",
+                (error, now, job_id),
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'failed' WHERE id = ? AND attempts >= ?",
+                (job_id, max_attempts),
+            )
+            failed = db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()["status"] == "failed"
+            db.executemany(
+                "UPDATE emails SET claimed_at = NULL WHERE job_id = ? AND idx = ? AND result IS NULL",
+                [(job_id, idx) for idx in indices],
+            )
+            db.execute("COMMIT")
+        return failed
+
+    def fail(self, job_id: str, error: str):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+
+
+class JobRunner:
+    """
+    Background threads draining the job store with the shared extractor.
+
+    With a ``scheduler`` (``src.scheduler.FairScheduler``), chunks are queued
+    under the job's tenant and share model batches with API requests.
+    """
+
+    def __init__(self, store: JobStore, get_engine, workers: int = 1,
+                 chunk_size: int = 32, lease_seconds: float = 600.0, scheduler=None,
+                 max_attempts: int = 3, retry_delay: float = 5.0):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # pause after a failed chunk (model reload, ...)
+        self.get_engine = get_engine
+        self.scheduler = scheduler
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"nlp-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._wakeup.set()  # pick up jobs left over from a previous run
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """A job was submitted."""
+        self._wakeup.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            job_id, rows = self.store.claim(self.chunk_size, self.lease_seconds)
+            if not rows:
+                self._wakeup.wait(timeout=5.0)
+                continue
+            bodies, senders = [row["body"] for row in rows], [row["sender"] for row in rows]
+            subjects = [row["subject"] for row in rows]
+            try:
+                if self.scheduler is not None:
+                    results = self.scheduler.extract(rows[0]["tenant_id"], bodies, senders, subjects)
+                else:
+                    results = self.get_engine().extract_batch(bodies, senders=senders, subjects=subjects)
+            except Exception as e:
+                indices = [row["idx"] for row in rows]
+                if self._stop.is_set():  # shutdown (scheduler stopped): resumed by the next run
+                    logger.info(f"⏸️  Job {job_id}: chunk released on shutdown")
+                    self.store.release(job_id, indices)
+                    return
+                error = f"{type(e).__name__}: {e}"
+                if self.store.retry(job_id, indices, error, self.max_attempts):
+                    logger.exception(f"❌ Job {job_id} failed after {self.max_attempts} attempts")
+                else:
+                    logger.warning(f"⚠️  Job {job_id}: chunk failed ({error}), will be retried")
+                    self._stop.wait(self.retry_delay)
+                continue
+            self.store.complete(job_id, [(row["idx"], r) for row, r in zip(rows, results)])
+            metrics.inc("nlp_jobs_emails_total", len(rows))
@@ -0,0 +1,168 @@
+"""
+FlipTracker NLP — Tracking links
+
+Carrier emails nearly always link to the carrier's tracking page, and the
+URL carries the tracking number (``laposte.fr/outils/suivre-vos-envois?code=6A…``,
+``mondialrelay.fr/suivi-de-colis/?numeroExpedition=…``). The cleaners drop
+attributes when they build the text, so hrefs are harvested in the same
+traversal (``text_and_links``) and matched against a table of carrier URL
+patterns:
+
+- a tracking parameter (or path segment) on a carrier's own domain gives
+  both the number and the exact carrier;
+- a tracking-looking parameter on any other domain (marketplace "suivre mon
+  colis" buttons) is kept only when the value has a known carrier format
+  (which then names the carrier); anything else is dropped;
+- redirect wrappers (``click.…/?url=https%3A…``) are unwrapped once.
+
+Usage:
+    text, hrefs = text_and_links(soup, separator=" ")
+    for number, carrier, confidence, url in find_tracking_links(hrefs):
+        ...
+"""
+import re
+from typing import NamedTuple
+from urllib.parse import parse_qsl, urlsplit
+
+from src import patterns
+
+# ── Confidences ──────────────────────────────────────────────────
+LINK = 0.9           # tracking parameter on the carrier's own domain
+
+
+class TrackingLink(NamedTuple):
+    number: str
+    carrier: str | None
+    confidence: float
+    url: str
+
+
+# ── Carrier URL table ────────────────────────────────────────────
+# (carrier, domains, tracking query parameters, path regex) — parameters lower-case
+CARRIER_LINKS = [
+    ("colissimo", ("laposte.fr", "laposte.com", "colissimo.fr"),
+     ("code", "parcelnumber", "colispart", "numero", "idship"),
+     re.compile(r"/suivi[\w-]*/(?:colis/)?([A-Z0-9]{11,15})(?:/|$)", re.IGNORECASE)),
+    ("chronopost", ("chronopost.fr", "chronopost.com"),
+     ("listenumeroslt", "listenumeros", "skybillnumber", "numero"), None),
+    ("mondial_relay", ("mondialrelay.fr", "mondialrelay.com", "mondialrelay.be", "mondialrelay.es"),
+     ("numeroexpedition", "expedition", "numero"), None),
+    ("ups", ("ups.com",), ("tracknum", "tracknums", "inquirynumber1", "trackingnumber"), None),
+    ("dhl", ("dhl.com", "dhl.fr", "dhl.de", "dhlparcel.nl", "dhlparcel.fr"),
+     ("tracking-id", "awb", "piececode", "idc", "trackingnumber"), None),
+    ("dpd", ("dpd.fr", "dpd.com", "dpd.co.uk"), ("parcelnumber", "parcelnr", "query"),
+     re.compile(r"/trace/([A-Z0-9]{10,28})(?:/|$)", re.IGNORECASE)),
+    ("gls", ("gls-group.eu", "gls-group.com", "gls-france.com"), ("match", "tracking", "parcelno"), None),
+    ("fedex", ("fedex.com",), ("trknbr", "tracknumbers", "tracknumber"), None),
+    ("relais_colis", ("relaiscolis.com",), ("numero", "codeenvoi", "num"),
+     re.compile(r"/suivi[\w-]*/([A-Z0-9]{8,})(?:/|$)", re.IGNORECASE)),
+    ("colis_prive", ("colisprive.com", "colisprive.fr"), ("numcolis", "colis", "tracking"), None),
+    ("vinted_go", ("vintedgo.com",), ("tracking", "code"),
+     re.compile(r"/tracking/([A-Z0-9]{8,})(?:/|$)", re.IGNORECASE)),
+    ("amazon_logistics", ("track.amazon.fr", "track.amazon.com"), ("trackingid",),
+     re.compile(r"/tracking/(TBA[A-Z0-9]{9,})(?:/|$)", re.IGNORECASE)),
+]
+CARRIER_DOMAINS = {domain: entry for entry in CARRIER_LINKS for domain in entry[1]}
+
+GENERIC_PARAMS = frozenset((
+    "code", "tracking", "trackingnumber", "tracking_number", "trackingid",
+    "tracknum", "numero", "numcolis", "colis", "parcel", "suivi",
+))
+GENERIC_PATH = re.compile(r"suivi|suivre|track", re.IGNORECASE)
+REDIRECT_PARAMS = frozenset(("url", "u", "redirect", "redirect_url", "target", "dest", "destination", "link"))
+# 8-35 alphanumerics with at least 6 digits (rules out promo codes, ids like "fr")
+TRACKING_VALUE = re.compile(r"^(?=(?:[A-Z]*\d){6})[A-Z0-9]{8,35}$")
+LINK_TAGS = ("a", "area")
+
+
+def _carrier_entry(host: str):
+    """Table entry of the longest registered suffix of ``host`` (``www.laposte.fr`` → laposte.fr)."""
+    labels = host.lower().rstrip(".").split(".")
+    for i in range(max(0, len(labels) - 3), len(labels) - 1):
+        entry = CARRIER_DOMAINS.get(".".join(labels[i:]))
+        if entry is not None:
+            return entry
+    return None
+
+
+def _values(value: str) -> list[str]:
+    """Tracking numbers in a parameter value (``listeNumerosLT=XW1…FR,XW2…FR``)."""
+    numbers = []
+    for part in re.split(r"[,;|\s]+", value.strip()):
+        part = part.replace("-", "").upper()
+        if TRACKING_VALUE.match(part):
+            numbers.append(part)
+    return numbers
+
+
+def _format_confidence(number: str, carrier: str = None):
+    """(carrier, confidence) of ``number`` by its own format (check digits, carrier formats)."""
+    for found, found_carrier, confidence in patterns.find_tracking(number):
+        if found == number and confidence >= patterns.FORMAT and carrier in (None, found_carrier):
+            return found_carrier, confidence
+    return None, 0.0
+
+
+def parse_link(href: str, _depth: int = 0) -> list[TrackingLink]:
+    """Tracking candidates carried by one URL."""
+    try:
+        url = urlsplit(href.strip())
+    except ValueError:
+        return []
+    if url.scheme not in ("http", "https") or not url.hostname:
+        return []
+    params = parse_qsl(url.query, keep_blank_values=False)
+    candidates = []
+
+    entry = _carrier_entry(url.hostname)
+    if entry is not None:
+        carrier, _, names, path_regex = entry
+        values = [v for k, v in params if k.lower() in names]
+        if path_regex is not None:
+            values += [m.group(1) for m in path_regex.finditer(url.path)]
+        for value in values:
+            for number in _values(value):
+                _, confidence = _format_confidence(number, carrier)
+                candidates.append(TrackingLink(number, carrier, max(LINK, confidence), href))
+    elif GENERIC_PATH.search(url.path) or any(k.lower() in GENERIC_PARAMS for k, _ in params):
+        for key, value in params:
+            if key.lower() not in GENERIC_PARAMS:
+                continue
+            for number in _values(value):
+                carrier, confidence = _format_confidence(number)
+                if carrier is not None:  # promo codes, ids, phone numbers: dropped
+                    candidates.append(TrackingLink(number, carrier, confidence, href))
+
+    if _depth == 0:
+        for key, value in params:
+            if key.lower() in REDIRECT_PARAMS and value.startswith(("http://", "https://")):
+                candidates += parse_link(value, _depth + 1)
+    return candidates
+
+
+def find_tracking_links(hrefs) -> list[TrackingLink]:
+    """Tracking candidates of all ``hrefs``, one per number, best first."""
+    best = {}
+    for href in hrefs:
+        for candidate in parse_link(href):
+            current = best.get(candidate.number)
+            if current is None or candidate.confidence > current.confidence:
+                best[candidate.number] = candidate
+    return sorted(best.values(), key=lambda c: -c.confidence)
+
+
+# ── Single-pass HTML traversal ───────────────────────────────────
+def text_and_links(soup, separator: str = "") -> tuple[str, list[str]]:
+    """``soup.get_text(separator)`` and the hrefs of the links, in one walk of the tree."""
+    from bs4.element import CData, NavigableString, Tag
+
+    strings, hrefs = [], []
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            if node.name in LINK_TAGS:
+                href = node.get("href")
+                if href:
+                    hrefs.append(href)
+        elif type(node) in (NavigableString, CData):  # same strings as get_text()
+            strings.append(node)
+    return separator.join(strings), hrefs
@@ -0,0 +1,113 @@
+"""
+FlipTracker NLP — Metrics
+
+Minimal thread-safe counters/gauges rendered in the Prometheus text format
+(``GET /metrics``). No external dependency: the service exposes a handful of
+series (cascade tiers, batching...), not enough to justify a client library.
+
+Usage:
+    from src.metrics import metrics
+    metrics.inc("nlp_cascade_hits_total", tier="regex", field="tracking_number")
+    with metrics.timer("nlp_cascade_seconds_total", tier="ner"):
+        ...
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds — from a single cached email to a large batch
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class MetricsRegistry:
+    """Named series keyed by sorted label pairs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: dict[str, dict[tuple, float]] = {}
+        self._types: dict[str, str] = {}
+        self._help: dict[str, str] = {}
+
+    def describe(self, name: str, kind: str, help_text: str = ""):
+        """Declare a series type (``counter`` or ``gauge``) and its HELP line."""
+        self._types[name] = kind
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = float(value)
+
+    def get(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._values.get(name, {}).get(tuple(sorted(labels.items())), 0.0)
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+        """Histogram observation (``<name>_bucket{le=...}``, ``_sum``, ``_count``)."""
+        self._types.setdefault(name, "histogram")
+        with self._lock:
+            bucket_series = self._values.setdefault(f"{name}_bucket", {})
+            for bound in (*buckets, float("inf")):
+                if value <= bound:
+                    key = tuple(sorted({**labels, "le": _format_bound(bound)}.items()))
+                    bucket_series[key] = bucket_series.get(key, 0.0) + 1
+            key = tuple(sorted(labels.items()))
+            for suffix, increment in (("_sum", value), ("_count", 1.0)):
+                series = self._values.setdefault(name + suffix, {})
+                series[key] = series.get(key, 0.0) + increment
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Add the elapsed wall time (seconds) of the block to a counter."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc(name, time.perf_counter() - start, **labels)
+
+    def _family(self, name: str) -> str:
+        """Histogram series (``x_bucket``, ``x_sum``, ``x_count``) belong to ``x``."""
+        for suffix in ("_bucket", "_sum", "_count"):
+            base = name[:-len(suffix)]
+            if name.endswith(suffix) and self._types.get(base) == "histogram":
+                return base
+        return name
+
+    def snapshot(self) -> dict[str, dict[tuple, float]]:
+        with self._lock:
+            return {name: dict(series) for name, series in self._values.items()}
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        for name, series in sorted(self.snapshot().items()):
+            family = self._family(name)
+            if family == name or name.endswith("_bucket"):
+                if family in self._help:
+                    lines.append(f"# HELP {family} {self._help[family]}")
+                lines.append(f"# TYPE {family} {self._types.get(family, 'untyped')}")
+            for key, value in sorted(series.items()):
+                if key:
+                    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                    lines.append(f"{name}{{{labels}}} {value:g}")
+                else:
+                    lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    """Label value as the text format requires: ``\\``, ``\"`` and ``\n`` escaped."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else f"{bound:g}"
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,279 @@
+"""
+FlipTracker NLP — Tier-0 patterns
+
+Cheap, pre-compiled regexes and keyword dictionaries used before any model
+runs. Every candidate carries a confidence:
+
+- tracking numbers whose check digit validates (UPU S10, UPS 1Z) are
+  near-certain;
+- carrier-specific formats without a check digit are trusted more when a
+  tracking keyword ("suivi", "n°", "colis"...) sits just before them;
+- bare digit runs (DHL, Mondial Relay) are weak hints only: even after a
+  tracking keyword they stay below ``FORMAT`` and the cascade threshold, so
+  they never name the carrier nor settle the field on their own.
+
+The sender's domain names the carrier or marketplace outright
+(``find_sender``), and the subject is scanned with the same regexes as the
+body.
+
+Carrier and marketplace codes match the backend ``Carrier`` / marketplace
+vocabulary (``colissimo``, ``mondial_relay``, ``vinted``...).
+"""
+import re
+
+# ── Confidences ──────────────────────────────────────────────────
+VALIDATED = 0.95      # check digit verified
+FORMAT = 0.7          # carrier-specific format, no check digit
+CONTEXT_BONUS = 0.1   # tracking keyword right before the match
+BARE_DIGITS = 0.4     # digit run (phone, order number...), no keyword
+BARE_CONTEXT = 0.45   # digit run after a tracking keyword, still a hint only
+KEYWORD = 0.75        # single carrier/marketplace named in the text
+AMBIGUOUS = 0.4       # several carriers/marketplaces named
+STREET_ADDRESS = 0.8  # number + street type + postcode + city
+POSTCODE_ONLY = 0.35  # postcode + city, street guessed from the context
+POSTAL_STREET = 0.9   # street line + postcode/commune found in the postal index
+POSTAL_CITY = 0.6     # postcode/commune pair found in the postal index
+GENERIC = 0.3         # "#ABC123..." style identifiers
+SENDER = 0.85         # sender domain of a carrier/marketplace
+
+
+# ── Check digits ─────────────────────────────────────────────────
+_S10_WEIGHTS = (8, 6, 4, 2, 3, 5, 9, 7)
+
+
+def s10_valid(number: str) -> bool:
+    """UPU S10 check digit (``LL123456785FR``, also used by Chronopost XW/XS)."""
+    digits = number[2:11]
+    if len(digits) != 9 or not digits.isdigit():
+        return False
+    total = sum(int(d) * w for d, w in zip(digits[:8], _S10_WEIGHTS))
+    check = 11 - total % 11
+    check = 0 if check == 10 else 5 if check == 11 else check
+    return check == int(digits[8])
+
+
+def ups_valid(number: str) -> bool:
+    """UPS ``1Z`` check digit (mod 10 over the 15 characters after ``1Z``)."""
+    body = number[2:].upper()
+    if len(body) != 16 or not body[15].isdigit():
+        return False
+    total = 0
+    for i, char in enumerate(body[:15]):
+        value = int(char) if char.isdigit() else (ord(char) - 63) % 10
+        total += value * 2 if i % 2 else value
+    return (10 - total % 10) % 10 == int(body[15])
+
+
+# ── Tracking numbers ─────────────────────────────────────────────
+# (carrier, regex, validator, base confidence) — most specific first
+TRACKING_PATTERNS = [
+    ("ups", re.compile(r"\b1Z[A-Z0-9]{16}\b"), ups_valid, FORMAT),
+    ("chronopost", re.compile(r"\bX[WS]\d{9}[A-Z]{2}\b"), s10_valid, FORMAT),
+    ("colissimo", re.compile(r"\b[RLCV][A-Z]\d{9}[A-Z]{2}\b"), s10_valid, FORMAT),
+    ("colissimo", re.compile(r"\b[6-8][AVLRQ]\d{11}\b"), None, FORMAT),
+    ("dpd", re.compile(r"\bGFFR\d{10,20}\b"), None, FORMAT),
+    ("dhl", re.compile(r"\bJJD\d{18,20}\b"), None, FORMAT),
+    ("dhl", re.compile(r"\b\d{10,11}\b"), None, BARE_DIGITS),
+    ("mondial_relay", re.compile(r"\b\d{8,12}\b"), None, BARE_DIGITS),
+]
+
+TRACKING_CONTEXT = re.compile(
+    r"(suivi|tracking|colis|envoi|exp[ée]dition|n°|no\.?|num[ée]ro|#)\W{0,6}$",
+    re.IGNORECASE,
+)
+GENERIC_TRACKING = re.compile(r"#([A-Z0-9]{10,})")
+
+
+def find_tracking(text: str) -> list[tuple[str, str, float]]:
+    """All tracking candidates as ``(number, carrier, confidence)``, best first."""
+    candidates = {}
+    for carrier, regex, validator, base in TRACKING_PATTERNS:
+        for match in regex.finditer(text):
+            number = match.group(0)
+            if number in candidates:
+                continue  # already claimed by a more specific pattern
+            if validator is not None and validator(number):
+                confidence = VALIDATED
+            else:
+                before = text[max(0, match.start() - 30):match.start()]
+                has_context = TRACKING_CONTEXT.search(before) is not None
+                if base == BARE_DIGITS:
+                    confidence = BARE_CONTEXT if has_context else BARE_DIGITS
+                else:
+                    confidence = base + CONTEXT_BONUS if has_context else base
+            candidates[number] = (number, carrier, round(confidence, 3))
+
+    for match in GENERIC_TRACKING.finditer(text):
+        candidates.setdefault(match.group(1), (match.group(1), None, GENERIC))
+
+    return sorted(candidates.values(), key=lambda c: -c[2])
+
+
+# ── Carriers & marketplaces ──────────────────────────────────────
+CARRIER_KEYWORDS = {
+    "chronopost": ["chronopost", "chrono pickup", "chrono relais"],
+    "mondial_relay": ["mondial relay", "mondialrelay"],
+    "colissimo": ["colissimo", "la poste", "laposte"],
+    "dhl": ["dhl"],
+    "ups": ["ups.com", "united parcel"],
+    "fedex": ["fedex"],
+    "dpd": ["dpd"],
+    "gls": ["gls"],
+    "relais_colis": ["relais colis", "relaiscolis"],
+    "colis_prive": ["colis privé", "colis prive", "colisprive"],
+    "vinted_go": ["vinted go", "vintedgo"],
+    "amazon_logistics": ["amazon logistics", "livraison amazon"],
+}
+
+MARKETPLACE_KEYWORDS = {
+    "vinted": ["vinted"],
+    "leboncoin": ["leboncoin", "le bon coin"],
+    "vestiaire_collective": ["vestiaire collective", "vestiairecollective"],
+    "amazon": ["amazon"],
+    "ebay": ["ebay"],
+    "depop": ["depop"],
+    "wallapop": ["wallapop"],
+    "shein": ["shein"],
+    "temu": ["temu"],
+    "cdiscount": ["cdiscount"],
+    "fnac": ["fnac"],
+    "zalando": ["zalando"],
+    "rakuten": ["rakuten"],
+}
+
+
+def _keyword_regex(keywords: dict[str, list[str]]) -> re.Pattern:
+    alternatives = sorted(
+        (kw for kws in keywords.values() for kw in kws), key=len, reverse=True
+    )
+    return re.compile(
+        r"(?<![\w])(" + "|".join(re.escape(kw) for kw in alternatives) + r")(?![\w])",
+        re.IGNORECASE,
+    )
+
+
+def _keyword_lookup(keywords: dict[str, list[str]]) -> dict[str, str]:
+    return {kw: code for code, kws in keywords.items() for kw in kws}
+
+
+CARRIER_REGEX = _keyword_regex(CARRIER_KEYWORDS)
+CARRIER_LOOKUP = _keyword_lookup(CARRIER_KEYWORDS)
+MARKETPLACE_REGEX = _keyword_regex(MARKETPLACE_KEYWORDS)
+MARKETPLACE_LOOKUP = _keyword_lookup(MARKETPLACE_KEYWORDS)
+
+
+def _count_mentions(text: str, regex: re.Pattern, lookup: dict[str, str]) -> dict[str, int]:
+    counts = {}
+    for match in regex.finditer(text):
+        code = lookup[match.group(1).lower()]
+        counts[code] = counts.get(code, 0) + 1
+    return counts
+
+
+def find_keyword(text: str, regex: re.Pattern, lookup: dict[str, str]):
+    """Most mentioned code and its confidence, or ``(None, 0.0)``."""
+    counts = _count_mentions(text, regex, lookup)
+    if not counts:
+        return None, 0.0
+    code = max(counts, key=counts.get)
+    return code, KEYWORD if len(counts) == 1 else AMBIGUOUS
+
+
+def find_carrier(text: str):
+    return find_keyword(text, CARRIER_REGEX, CARRIER_LOOKUP)
+
+
+def find_marketplace(text: str):
+    return find_keyword(text, MARKETPLACE_REGEX, MARKETPLACE_LOOKUP)
+
+
+def canonical_carrier(name: str):
+    """Map a free-text carrier mention (e.g. a NER span) to its backend code."""
+    match = CARRIER_REGEX.search(name)
+    return CARRIER_LOOKUP[match.group(1).lower()] if match else None
+
+
+# ── Sender domains ───────────────────────────────────────────────
+# Registered domain (subdomains match too) → (field, code); webmail domains
+# such as laposte.net are deliberately absent: private senders use them
+SENDER_DOMAINS = {
+    **{d: ("carrier", "colissimo") for d in ("laposte.fr", "colissimo.fr", "notif-colissimo-laposte.info")},
+    **{d: ("carrier", "chronopost") for d in ("chronopost.fr", "chronopost.com")},
+    **{d: ("carrier", "mondial_relay") for d in ("mondialrelay.fr", "mondialrelay.com", "mondialrelay.be")},
+    **{d: ("carrier", "dhl") for d in ("dhl.com", "dhl.fr", "dhl.de", "dhlparcel.fr", "dhlparcel.nl")},
+    **{d: ("carrier", "dpd") for d in ("dpd.fr", "dpd.com", "dpd.co.uk")},
+    **{d: ("carrier", "gls") for d in ("gls-france.com", "gls-group.eu", "gls-group.com")},
+    **{d: ("carrier", "colis_prive") for d in ("colisprive.com", "colisprive.fr")},
+    "ups.com": ("carrier", "ups"),
+    "fedex.com": ("carrier", "fedex"),
+    "relaiscolis.com": ("carrier", "relais_colis"),
+    "vintedgo.com": ("carrier", "vinted_go"),
+    **{f"vinted.{tld}": ("marketplace", "vinted") for tld in ("fr", "com", "be", "es", "it", "de", "nl", "co.uk")},
+    "leboncoin.fr": ("marketplace", "leboncoin"),
+    "vestiairecollective.com": ("marketplace", "vestiaire_collective"),
+    **{f"amazon.{tld}": ("marketplace", "amazon") for tld in ("fr", "com", "de", "es", "it", "co.uk")},
+    **{f"ebay.{tld}": ("marketplace", "ebay") for tld in ("fr", "com", "de", "co.uk")},
+    "depop.com": ("marketplace", "depop"),
+    "wallapop.com": ("marketplace", "wallapop"),
+    "shein.com": ("marketplace", "shein"),
+    "temu.com": ("marketplace", "temu"),
+    "cdiscount.com": ("marketplace", "cdiscount"),
+    "fnac.com": ("marketplace", "fnac"),
+    **{f"zalando.{tld}": ("marketplace", "zalando") for tld in ("fr", "com", "de")},
+    **{f"rakuten.{tld}": ("marketplace", "rakuten") for tld in ("fr", "com")},
+}
+SENDER_ADDRESS = re.compile(r"@([\w.-]+)")
+
+
+def find_sender(sender: str) -> dict[str, str]:
+    """``{"carrier" | "marketplace": code}`` named by the sender's domain (``no-reply@notif.vinted.fr``)."""
+    match = SENDER_ADDRESS.search(sender or "")
+    if not match:
+        return {}
+    labels = match.group(1).lower().rstrip(".").split(".")
+    for i in range(len(labels) - 1):  # longest suffix first
+        entry = SENDER_DOMAINS.get(".".join(labels[i:]))
+        if entry is not None:
+            field, code = entry
+            return {field: code}
+    return {}
+
+
+# ── Addresses ────────────────────────────────────────────────────
+STREET_TYPES = (
+    r"rue|avenue|av\.?|boulevard|bd|chemin|place|pl\.?|all[ée]e|impasse|route|"
+    r"quai|cours|square|r[ée]sidence|lotissement|voie|sentier|passage|faubourg"
+)
+STREET_ADDRESS_REGEX = re.compile(
+    r"\b\d{1,4}\s?(?:bis|ter)?,?\s+(?:" + STREET_TYPES + r")\b[^\n\d]{2,60}?"
+    r"[,\s]+(\d{5})\s+([A-ZÀ-ÿ][A-ZÀ-ÿ'\- ]{1,40})",
+    re.IGNORECASE,
+)
+POSTCODE_REGEX = re.compile(r"\b(\d{5}\s+[A-ZÀ-ÿ\s\-]+)", re.IGNORECASE)
+
+
+def find_address(text: str, postal=None):
+    """
+    Best address candidate and its confidence, or ``(None, 0.0)``.
+
+    With a ``PostalIndex`` only existing postcode/commune pairs are accepted;
+    without one, any 5-digit number + words is a (weak) candidate.
+    """
+    if postal is not None:
+        matches = postal.find_addresses(text)
+        if not matches:
+            return None, 0.0
+        best = max(matches, key=lambda m: (m.has_street, not m.completed))
+        confidence = POSTAL_STREET if best.has_street else POSTAL_CITY
+        return best.address(text), confidence
+
+    match = STREET_ADDRESS_REGEX.search(text)
+    if match:
+        return " ".join(match.group(0).split()), STREET_ADDRESS
+
+    match = POSTCODE_REGEX.search(text)
+    if match:
+        # On prend un peu de texte avant le code postal pour avoir la rue
+        start = max(0, match.start() - 30)
+        return text[start:match.end()].strip().replace("\n", " "), POSTCODE_ONLY
+    return None, 0.0
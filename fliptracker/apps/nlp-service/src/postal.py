@@ -0,0 +1,373 @@
+"""
+FlipTracker NLP — French postal-code index
+
+Validates and completes "<postcode> <commune>" candidates against La Poste's
+official postcode base (Base officielle des codes postaux, "hexasmal" CSV,
+published on data.gouv.fr). The CSV is converted once into a flat binary file:
+
+- sorted postcodes -> commune ids (CSR arrays), and the postcode's routing
+  name (libellé d'acheminement) when it has a single one, for completion
+- commune names (UTF-8 blob + offsets)
+- a trie of normalized names (accents folded, "-"/"'" as spaces,
+  "ST"/"SAINT" both indexed) stored as CSR edge arrays; both the libellé
+  and the commune name are indexed ("LYON" and "LYON 01" for 69001)
+
+The file is memory-mapped and read through ``memoryview`` casts: loading is a
+few milliseconds and matching a name costs O(length) lookups.
+
+Usage:
+    python -m src.postal build data/postal/laposte_hexasmal.csv
+    python -m src.postal lookup "12 rue de la Paix 75002 Paris"
+"""
+import argparse
+import bisect
+import csv
+import json
+import logging
+import mmap
+import re
+import sys
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import NamedTuple
+
+from src.patterns import STREET_TYPES
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FTPOSTAL"
+VERSION = 2
+
+# (name, typecode) — order of the arrays in the file
+ARRAYS = (
+    ("codes", "I"),          # sorted postcodes
+    ("code_ptr", "I"),       # codes[i] -> code_names[code_ptr[i]:code_ptr[i+1]]
+    ("code_names", "I"),     # commune ids, sorted per postcode
+    ("code_city", "i"),      # codes[i] -> its single libellé's name id, -1 when several
+    ("name_ptr", "I"),       # name id -> name_blob[name_ptr[i]:name_ptr[i+1]]
+    ("name_blob", "B"),
+    ("edge_ptr", "I"),       # trie node -> edges[edge_ptr[n]:edge_ptr[n+1]]
+    ("edge_char", "I"),      # code point, sorted per node
+    ("edge_child", "I"),
+    ("node_name", "i"),      # name id ending at this node, -1 otherwise
+)
+
+POSTCODE_REGEX = re.compile(r"(?<![\d\w])(\d{5})(?![\d\w])")
+STREET_REGEX = re.compile(
+    r"\b\d{1,4}\s?(?:bis|ter)?,?\s+(?:" + STREET_TYPES + r")\b[^\n\d]{2,60}?[,\s]*$",
+    re.IGNORECASE,
+)
+_SEPARATORS = re.compile(r"[\s,]*")
+
+_FOLD = {"Œ": "OE", "œ": "OE", "Æ": "AE", "æ": "AE", "ß": "SS"}
+_SPACE_CHARS = set(" -'’.\t")
+_ABBREVIATIONS = {"SAINT": "ST", "SAINTE": "STE", "ST": "SAINT", "STE": "SAINTE"}
+
+
+def fold_char(char: str) -> str:
+    """Normalized form of one character: "" if it ends a name, " " for separators."""
+    if char in _SPACE_CHARS:
+        return " "
+    if char in _FOLD:
+        return _FOLD[char]
+    if char.isalnum():
+        return unicodedata.normalize("NFKD", char)[0].upper()
+    return ""
+
+
+def normalize(name: str) -> str:
+    """Upper-case, accent-free, single-spaced form used as trie key."""
+    return " ".join("".join(fold_char(char) or " " for char in name).split())
+
+
+def name_variants(name: str) -> set[str]:
+    """``ST ETIENNE`` and ``SAINT ETIENNE`` both lead to the same commune."""
+    words = normalize(name).split()
+    if not words:
+        return set()
+    expanded = [_ABBREVIATIONS[w] if w in ("ST", "STE") else w for w in words]
+    abbreviated = [_ABBREVIATIONS[w] if w in ("SAINT", "SAINTE") else w for w in words]
+    return {" ".join(words), " ".join(expanded), " ".join(abbreviated)}
+
+
+class PostalMatch(NamedTuple):
+    start: int          # start of the street line (or of the postcode)
+    end: int            # end of the commune name (or of the postcode)
+    postcode: str
+    city: str           # official commune name
+    has_street: bool
+    completed: bool     # city inferred from a postcode with a single libellé
+
+    def address(self, text: str) -> str:
+        value = " ".join(text[self.start:self.end].split())
+        return f"{value} {self.city}" if self.completed else value
+
+
+# ── Build (offline) ──────────────────────────────────────────────
+def _read_rows(csv_path: Path) -> list[dict]:
+    raw = Path(csv_path).read_bytes()
+    try:
+        content = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        content = raw.decode("latin-1")
+    first_line = content.split("\n", 1)[0]
+    delimiter = ";" if first_line.count(";") >= first_line.count(",") else ","
+    reader = csv.DictReader(content.splitlines(), delimiter=delimiter)
+    return [{(k or "").lstrip("#").strip().lower(): (v or "").strip() for k, v in row.items()}
+            for row in reader]
+
+
+def _column(row: dict, *prefixes) -> str:
+    for prefix in prefixes:
+        for key, value in row.items():
+            if key.startswith(prefix):
+                return value
+    return ""
+
+
+def build_index(csv_path: Path, output_path: Path) -> dict:
+    """Convert the La Poste CSV into the binary index. Returns build stats."""
+    names: dict[str, int] = {}       # normalized -> name id
+    display: list[str] = []
+    code_names: dict[int, set[int]] = {}
+    code_cities: dict[int, set[int]] = {}  # libellés per postcode
+
+    def name_id(raw: str) -> list[int]:
+        ids = []
+        for variant in name_variants(raw):
+            if variant not in names:
+                names[variant] = len(display)
+                display.append(raw.strip().upper())
+            ids.append(names[variant])
+        return ids
+
+    for row in _read_rows(csv_path):
+        code = _column(row, "code_postal")
+        if not code.isdigit() or len(code) != 5:
+            continue
+        city = _column(row, "libell", "nom_de_la_commune", "nom_commune")
+        ids = set(name_id(city))
+        for alias in (_column(row, "nom_de_la_commune", "nom_commune"), _column(row, "ligne_5")):
+            if alias:
+                ids.update(name_id(alias))
+        code_names.setdefault(int(code), set()).update(ids)
+        if normalize(city):
+            code_cities.setdefault(int(code), set()).add(names[normalize(city)])
+
+    # Trie (dict form, then flattened breadth-first)
+    root: dict = {}
+    for normalized, nid in names.items():
+        node = root
+        for char in normalized:
+            node = node.setdefault(char, {})
+        node[None] = nid
+
+    arrays = {name: array(typecode) for name, typecode in ARRAYS}
+    queue = [root]
+    arrays["edge_ptr"].append(0)
+    for node in queue:  # queue grows while iterating
+        arrays["node_name"].append(node.get(None, -1))
+        for char in sorted(k for k in node if k is not None):
+            arrays["edge_char"].append(ord(char))
+            arrays["edge_child"].append(len(queue))
+            queue.append(node[char])
+        arrays["edge_ptr"].append(len(arrays["edge_char"]))
+
+    arrays["code_ptr"].append(0)
+    for code in sorted(code_names):
+        arrays["codes"].append(code)
+        arrays["code_names"].extend(sorted(code_names[code]))
+        arrays["code_ptr"].append(len(arrays["code_names"]))
+        cities = code_cities.get(code, ())
+        arrays["code_city"].append(next(iter(cities)) if len(cities) == 1 else -1)
+
+    arrays["name_ptr"].append(0)
+    for raw in display:
+        arrays["name_blob"].extend(raw.encode("utf-8"))
+        arrays["name_ptr"].append(len(arrays["name_blob"]))
+
+    _write(output_path, arrays)
+    return {"postcodes": len(arrays["codes"]), "names": len(display), "trie_nodes": len(queue)}
+
+
+def _write(path: Path, arrays: dict[str, array]):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    header = {
+        "version": VERSION,
+        "byteorder": sys.byteorder,
+        "lengths": {name: len(arrays[name]) for name, _ in ARRAYS},
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(4, "little"))
+        f.write(header_bytes)
+        for name, _ in ARRAYS:
+            f.write(b"\0" * (-f.tell() % 8))  # keep every array 8-byte aligned
+            f.write(arrays[name].tobytes())
+
+
+# ── Serving ──────────────────────────────────────────────────────
+class PostalIndex:
+    """Memory-mapped postcode/commune index."""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:8]) != MAGIC:
+            raise ValueError(f"{path} is not a postal index")
+        header_size = int.from_bytes(buffer[8:12], "little")
+        header = json.loads(bytes(buffer[12:12 + header_size]))
+        if header["version"] != VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path}: incompatible index (rebuild with `python -m src.postal build`)")
+
+        offset = 12 + header_size
+        for name, typecode in ARRAYS:
+            offset += -offset % 8
+            size = header["lengths"][name] * array(typecode).itemsize
+            setattr(self, name, buffer[offset:offset + size].cast(typecode))
+            offset += size
+
+    @classmethod
+    def load_default(cls):
+        """Index at ``settings.postal_index_path``, or None when it hasn't been built."""
+        from src.config import settings
+
+        path = Path(settings.postal_index_path)
+        if not path.exists():
+            logger.info(f"Postal index not found at {path} — address validation disabled")
+            return None
+        start = time.perf_counter()
+        index = cls(path)
+        logger.info(f"✅ Postal index loaded ({len(index.codes)} postcodes, "
+                    f"{(time.perf_counter() - start) * 1000:.1f}ms)")
+        return index
+
+    def name(self, name_id: int) -> str:
+        return bytes(self.name_blob[self.name_ptr[name_id]:self.name_ptr[name_id + 1]]).decode("utf-8")
+
+    def _code_slot(self, postcode) -> int:
+        code = int(postcode)
+        i = bisect.bisect_left(self.codes, code)
+        return i if i < len(self.codes) and self.codes[i] == code else -1
+
+    def is_valid(self, postcode) -> bool:
+        return self._code_slot(postcode) >= 0
+
+    def _name_ids(self, slot: int):
+        return self.code_names[self.code_ptr[slot]:self.code_ptr[slot + 1]]
+
+    def communes(self, postcode) -> list[str]:
+        """Official commune names served by a postcode."""
+        slot = self._code_slot(postcode)
+        if slot < 0:
+            return []
+        return sorted({self.name(i) for i in self._name_ids(slot)})
+
+    def match_name(self, text: str, pos: int = 0) -> list[tuple[int, int]]:
+        """
+        Walk the trie from ``text[pos]``; return every ``(name_id, end)`` whose
+        name ends on a word boundary, shortest first.
+        """
+        node, matches, previous = 0, [], " "
+        for i in range(pos, len(text)):
+            folded = fold_char(text[i])
+            if not folded:
+                break
+            for char in folded:
+                if char == " " and previous == " ":
+                    continue
+                lo, hi = self.edge_ptr[node], self.edge_ptr[node + 1]
+                j = bisect.bisect_left(self.edge_char, ord(char), lo, hi)
+                if j == hi or self.edge_char[j] != ord(char):
+                    return matches
+                node, previous = self.edge_child[j], char
+            if self.node_name[node] >= 0 and previous != " " and (
+                i + 1 == len(text) or not text[i + 1].isalnum()
+            ):
+                matches.append((self.node_name[node], i + 1))
+        return matches
+
+    def validate(self, postcode, city: str):
+        """Official name if ``city`` is a commune of ``postcode``, else None."""
+        slot = self._code_slot(postcode)
+        if slot < 0:
+            return None
+        ids = self._name_ids(slot)
+        for name_id, end in reversed(self.match_name(city.strip())):
+            if end == len(city.strip()) and name_id in ids:
+                return self.name(name_id)
+        return None
+
+    def find_addresses(self, text: str) -> list[PostalMatch]:
+        """
+        Postcodes of ``text`` that exist and are followed by one of their
+        communes (or preceded by a street line). Dates, prices and order
+        numbers are rejected because their 5 digits aren't a postcode or
+        aren't followed by a matching commune.
+        """
+        matches = []
+        for m in POSTCODE_REGEX.finditer(text):
+            slot = self._code_slot(m.group(1))
+            if slot < 0:
+                continue
+            ids = self._name_ids(slot)
+            city_start = _SEPARATORS.match(text, m.end()).end()
+            city, end = None, m.end()
+            for name_id, name_end in reversed(self.match_name(text, city_start)):
+                if name_id in ids:
+                    city, end = self.name(name_id), name_end
+                    break
+
+            line_start = text.rfind("\n", 0, max(0, text.rfind("\n", 0, m.start())))
+            street = STREET_REGEX.search(text, line_start + 1, m.start())
+            if city is None and street is None:
+                continue
+
+            completed = False
+            if city is None:
+                # Completed with the routing name, even when the commune names
+                # differ (69001: libellé LYON, commune LYON 01)
+                if self.code_city[slot] < 0:
+                    continue
+                city, completed = self.name(self.code_city[slot]), True
+
+            start = street.start() if street else m.start()
+            matches.append(PostalMatch(start, end, m.group(1), city, street is not None, completed))
+        return matches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build the binary index from the La Poste CSV")
+    build.add_argument("csv", type=Path)
+    build.add_argument("--output", type=Path, default=None)
+    lookup = sub.add_parser("lookup", help="Find validated addresses in a text")
+    lookup.add_argument("text")
+    args = parser.parse_args()
+
+    from src.config import settings
+
+    if args.command == "build":
+        output = args.output or Path(settings.postal_index_path)
+        start = time.perf_counter()
+        stats = build_index(args.csv, output)
+        print(f"✅ {output} ({output.stat().st_size / 1e6:.1f} MB) in "
+              f"{time.perf_counter() - start:.1f}s — {stats}")
+    else:
+        index = PostalIndex.load_default()
+        if index is None:
+            print("❌ No postal index — run `python -m src.postal build <csv>` first")
+            return
+        for match in index.find_addresses(args.text):
+            print(f"📍 {match.address(args.text)}  [{match.postcode} {match.city}"
+                  f"{', street' if match.has_street else ''}{', completed' if match.completed else ''}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""
+FlipTracker NLP — Model registry and hot swap
+
+A local directory of versioned, checksummed spaCy model folders:
+
+    registry/
+      ACTIVE                     # name of the version to serve
+      versions/<version>/        # model folder (config.cfg, meta.json, ner/...)
+      versions/<version>/MANIFEST.json   # {version, createdAt, sizeBytes, files: {path: sha256}}
+
+``ModelManager`` serves one ``HybridExtractor`` at a time. Activating another
+version (admin endpoint, or ``ACTIVE`` changed on disk and picked up by the
+watcher) verifies its checksums, loads and warms it up in a background
+thread, then swaps the reference. Callers that already hold the old engine
+finish their batch on it; the next batch uses the new one.
+
+Without a registry (or an empty one) the model baked into the image at
+``settings.model_path`` is served, labelled with ``$MODEL_VERSION``.
+
+Usage:
+    python -m src.registry publish models/ner_full/model-best --version 2025-06-01 --activate
+    python -m src.registry list
+    python -m src.registry activate 2025-06-01
+    python -m src.registry verify 2025-06-01
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "MANIFEST.json"
+ACTIVE = "ACTIVE"
+
+# Short emails run through a freshly loaded engine before it takes traffic
+# (spaCy pipes, ONNX sessions and tokenizers allocate on first use)
+WARMUP_EMAILS = [
+    ("<p>Bonjour, votre colis 6A12345678901 a été expédié par Colissimo. "
+     "Suivez-le sur laposte.fr.</p>", "noreply@laposte.fr"),
+    ("<p>Ton colis Vinted est disponible au point relais Mondial Relay, "
+     "12 rue de la Paix 75002 Paris. Code de retrait : 123456.</p>", "no-reply@vinted.fr"),
+    ("<p>Your order has shipped with UPS, tracking number 1Z999AA10123456784.</p>",
+     "auto-confirm@amazon.fr"),
+]
+
+metrics.describe("nlp_model_info", "gauge", "Model version currently served (1 = active)")
+metrics.describe("nlp_model_swaps_total", "counter", "Model hot swaps, by outcome")
+metrics.describe("nlp_model_load_seconds", "gauge", "Load + warm-up time of the last loaded version")
+
+
+class RegistryError(Exception):
+    """Unknown version, corrupted folder or invalid registry operation."""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _files(folder: Path) -> list[Path]:
+    return sorted(p for p in folder.rglob("*") if p.is_file() and p.name != MANIFEST)
+
+
+def warm_up(engine):
+    """Run ``WARMUP_EMAILS`` through ``engine`` (returns it)."""
+    engine.extract_batch([body for body, _ in WARMUP_EMAILS],
+                         senders=[sender for _, sender in WARMUP_EMAILS])
+    return engine
+
+
+class ModelRegistry:
+    """Versioned model folders + the ``ACTIVE`` pointer."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.versions_dir = self.root / "versions"
+
+    def path(self, version: str) -> Path:
+        return self.versions_dir / version
+
+    def manifest(self, version: str) -> dict:
+        path = self.path(version) / MANIFEST
+        if not path.exists():
+            raise RegistryError(f"Unknown model version: {version}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def versions(self) -> list[dict]:
+        """Manifests of all published versions, oldest first."""
+        if not self.versions_dir.exists():
+            return []
+        manifests = [self.manifest(p.name) for p in self.versions_dir.iterdir()
+                     if (p / MANIFEST).exists()]
+        return sorted(manifests, key=lambda m: m["createdAt"])
+
+    def active(self) -> str:
+        """Version named by ``ACTIVE`` ("" when none)."""
+        path = self.root / ACTIVE
+        return path.read_text(encoding="utf-8").strip() if path.exists() else ""
+
+    def publish(self, source: Path, version: str = None) -> dict:
+        """Copy a model folder in as a new immutable version."""
+        source = Path(source)
+        if not (source / "config.cfg").exists():
+            raise RegistryError(f"{source} is not a spaCy model folder (no config.cfg)")
+        version = version or datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+        if "/" in version or version.startswith("."):
+            raise RegistryError(f"Invalid version name: {version}")
+        target = self.path(version)
+        if target.exists():
+            raise RegistryError(f"Version {version} already exists")
+
+        self.versions_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.versions_dir / f".staging-{version}"
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.copytree(source, staging)
+        files = {str(p.relative_to(staging)): _sha256(p) for p in _files(staging)}
+        manifest = {
+            "version": version,
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "source": str(source),
+            "sizeBytes": sum(p.stat().st_size for p in _files(staging)),
+            "files": files,
+        }
+        with open(staging / MANIFEST, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(staging, target)  # never a half-copied version under its real name
+        return manifest
+
+    def verify(self, version: str) -> dict:
+        """Recompute checksums; raises ``RegistryError`` on any mismatch."""
+        manifest = self.manifest(version)
+        folder = self.path(version)
+        for name, expected in manifest["files"].items():
+            path = folder / name
+            if not path.exists():
+                raise RegistryError(f"{version}: missing file {name}")
+            if _sha256(path) != expected:
+                raise RegistryError(f"{version}: checksum mismatch for {name}")
+        return manifest
+
+    def load_engine(self, version: str):
+        """
+        Verified and warmed-up ``HybridExtractor`` serving ``version``.
+
+        Unlike the baked model, a registry version never degrades to a blank
+        pipeline: a load failure or a model without ``ner`` raises ``RegistryError``.
+        """
+        from src.extractor import HybridExtractor
+
+        manifest = self.verify(version)
+        try:
+            engine = HybridExtractor(model_path=str(self.path(version)), version=manifest["version"], strict=True)
+        except Exception as e:
+            raise RegistryError(f"{version}: cannot load model ({type(e).__name__}: {e})") from e
+        if "ner" not in engine.nlp.pipe_names:
+            raise RegistryError(f"{version}: model has no ner pipe ({engine.nlp.pipe_names})")
+        return warm_up(engine)
+
+    def activate(self, version: str):
+        self.manifest(version)  # must exist
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{ACTIVE}.tmp"
+        tmp.write_text(version + "\n", encoding="utf-8")
+        os.replace(tmp, self.root / ACTIVE)
+
+
+class ModelManager:
+    """The engine being served, swapped atomically to other registry versions."""
+
+    def __init__(self, registry: ModelRegistry, fallback_path: str, fallback_version: str,
+                 watch_interval: float = 0.0):
+        self.registry = registry
+        self.fallback_path = fallback_path
+        self.fallback_version = fallback_version
+        self.watch_interval = watch_interval
+
+        self._lock = threading.Lock()
+        self._engine = None
+        self.version = None
+        self.loading = None      # version being loaded in the background
+        self.last_error = None
+        self._failed = None      # last version that failed to load (not retried by the watcher)
+        self._watcher = None
+
+    @classmethod
+    def from_settings(cls):
+        from src.config import settings
+
+        return cls(
+            ModelRegistry(settings.model_registry_path),
+            fallback_path=settings.model_path,
+            fallback_version=os.environ.get("MODEL_VERSION", "baked"),
+            watch_interval=settings.model_watch_interval,
+        )
+
+    @property
+    def engine(self):
+        return self._engine  # a single reference read: always a fully loaded engine
+
+    # ── Loading ──
+    def _build(self, version: str):
+        start = time.perf_counter()
+        if version == self.fallback_version and not (self.registry.path(version) / MANIFEST).exists():
+            from src.extractor import HybridExtractor
+            engine = warm_up(HybridExtractor(model_path=self.fallback_path, version=version))
+        else:
+            engine = self.registry.load_engine(version)
+        elapsed = time.perf_counter() - start
+        metrics.set("nlp_model_load_seconds", round(elapsed, 3))
+        logger.info(f"✅ Model {version} loaded and warmed up in {elapsed:.1f}s")
+        return engine
+
+    def _install(self, engine, version: str):
+        with self._lock:
+            previous, self._engine, self.version = self.version, engine, version
+        if previous is not None:
+            metrics.set("nlp_model_info", 0, version=previous)
+        metrics.set("nlp_model_info", 1, version=version)
+
+    def load_initial(self, pinned: str = ""):
+        """Synchronous first load: pinned version, else ``ACTIVE``, else the baked model."""
+        version = pinned or self.registry.active() or self.fallback_version
+        try:
+            engine = self._build(version)
+        except RegistryError as e:
+            if version == self.fallback_version:
+                raise
+            logger.error(f"❌ Model {version} unusable ({e}) — serving the baked model")
+            self.last_error = str(e)
+            version = self.fallback_version
+            engine = self._build(version)
+        self._install(engine, version)
+        if self.watch_interval > 0 and self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name="nlp-model-watch", daemon=True)
+            self._watcher.start()
+
+    def swap(self, version: str):
+        """Load ``version`` in the background and swap it in once warm."""
+        with self._lock:
+            if self.loading is not None:
+                raise RuntimeError(f"Model {self.loading} is already loading")
+            if version == self.version:
+                return False
+            self.loading = version
+        threading.Thread(target=self._swap, args=(version,), name="nlp-model-swap", daemon=True).start()
+        return True
+
+    def _swap(self, version: str):
+        logger.info(f"🔄 Loading model {version} (serving {self.version})...")
+        try:
+            engine = self._build(version)
+        except Exception as e:
+            logger.exception(f"❌ Model {version} failed to load — keeping {self.version}")
+            self.last_error = f"{version}: {type(e).__name__}: {e}"
+            self._failed = version
+            metrics.inc("nlp_model_swaps_total", status="failed")
+        else:
+            self._install(engine, version)
+            self.last_error = self._failed = None
+            metrics.inc("nlp_model_swaps_total", status="ok")
+            logger.info(f"✅ Now serving model {version}")
+        finally:
+            with self._lock:
+                self.loading = None
+
+    def _watch(self):
+        """Follow ``ACTIVE`` on disk (e.g. updated by ``python -m src.registry activate``)."""
+        while True:
+            time.sleep(self.watch_interval)
+            try:
+                wanted = self.registry.active()
+            except OSError:
+                continue
+            # A version that failed to load is not retried until ACTIVE changes
+            if wanted and wanted not in (self.version, self.loading, self._failed):
+                try:
+                    self.swap(wanted)
+                except RuntimeError:
+                    pass  # another load in progress: next tick
+
+    def status(self) -> dict:
+        return {
+            "active": self.version,
+            "loading": self.loading,
+            "lastError": self.last_error,
+            "registryActive": self.registry.active() or None,
+            "versions": [
+                {k: m[k] for k in ("version", "createdAt", "sizeBytes")}
+                for m in self.registry.versions()
+            ],
+        }
+
+
+# ── CLI ──────────────────────────────────────────────────────────
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--registry", type=Path, default=None)
+    sub = parser.add_subparsers(dest="command", required=True)
+    publish = sub.add_parser("publish", help="Add a trained model folder as a new version")
+    publish.add_argument("source", type=Path)
+    publish.add_argument("--version", default=None)
+    publish.add_argument("--activate", action="store_true")
+    sub.add_parser("list", help="List published versions")
+    activate = sub.add_parser("activate", help="Point ACTIVE to a version (running services follow)")
+    activate.add_argument("version")
+    verify = sub.add_parser("verify", help="Check a version's checksums")
+    verify.add_argument("version")
+    args = parser.parse_args()
+
+    from src.config import settings
+
+    registry = ModelRegistry(args.registry or settings.model_registry_path)
+    try:
+        if args.command == "publish":
+            manifest = registry.publish(args.source, args.version)
+            print(f"✅ Published {manifest['version']} ({len(manifest['files'])} files, "
+                  f"{manifest['sizeBytes'] / 1e6:.1f} MB)")
+            if args.activate:
+                registry.activate(manifest["version"])
+                print(f"   🎯 ACTIVE → {manifest['version']}")
+        elif args.command == "list":
+            active = registry.active()
+            for manifest in registry.versions():
+                marker = "🎯" if manifest["version"] == active else "  "
+                print(f"{marker} {manifest['version']:<24} {manifest['createdAt']}  "
+                      f"{manifest['sizeBytes'] / 1e6:8.1f} MB")
+        elif args.command == "activate":
+            registry.verify(args.version)
+            registry.activate(args.version)
+            print(f"🎯 ACTIVE → {args.version}")
+        else:
+            manifest = registry.verify(args.version)
+            print(f"✅ {args.version}: {len(manifest['files'])} files OK")
+    except RegistryError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+FlipTracker NLP — Fair scheduling across tenants
+
+``/extract/batch`` requests and background jobs no longer call the extractor
+directly: their emails are queued per tenant, and dispatcher threads build
+the model batches by deficit round-robin (DRR). Every round, each tenant with
+queued emails earns ``quantum`` emails of credit and contributes up to that
+many emails to the batch being built. A user syncing a handful of emails is
+therefore served in the next batch, even while another tenant has thousands
+of emails queued behind it.
+
+Emails without a tenant share the ``"anonymous"`` queue.
+
+A batch that raises is retried request by request, so one tenant's bad
+email only fails its own request. Per-tenant metrics are labelled with the
+first ``tenant_labels`` tenants seen, the others share the ``"other"``
+label: ``tenant_id`` comes from clients and must not grow the series count
+without bound.
+
+Usage:
+    scheduler = FairScheduler(get_engine, batch_size=32, quantum=8)
+    scheduler.start()
+    results = scheduler.extract("user-42", bodies, senders, subjects)
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import deque
+
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ANONYMOUS = "anonymous"
+OTHER = "other"  # metrics label of the tenants beyond ``tenant_labels``
+SAFE_LABEL = re.compile(r"[A-Za-z0-9_.:@-]{1,64}")
+
+metrics.describe("nlp_tenant_emails_total", "counter", "Emails extracted, by tenant")
+metrics.describe("nlp_tenant_requests_total", "counter", "Requests completed, by tenant")
+metrics.describe("nlp_tenant_latency_seconds", "histogram", "Request latency (queue + extraction), by tenant")
+metrics.describe("nlp_tenant_queued_emails", "gauge", "Emails waiting for a batch, by tenant")
+metrics.describe("nlp_scheduler_batches_total", "counter", "Model batches run by the scheduler")
+metrics.describe("nlp_scheduler_batch_tenants", "gauge", "Tenants interleaved in the last batch")
+
+
+class _Request:
+    """One caller's emails; done once every email has a result."""
+
+    def __init__(self, tenant: str, n: int):
+        self.tenant = tenant
+        self.results = [None] * n
+        self.remaining = n
+        self.error = None
+        self.extract_seconds = 0.0  # share of the batches' extraction time
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+
+
+class FairScheduler:
+    """Per-tenant email queues drained into shared batches by deficit round-robin."""
+
+    def __init__(self, get_engine, batch_size: int = 32, quantum: int = 8, workers: int = 1,
+                 tenant_labels: int = 50, timeout: float = 300.0):
+        self.get_engine = get_engine
+        self.timeout = timeout  # longest wait of a request (queue + extraction)
+        self.batch_size = batch_size
+        self.quantum = quantum
+        self.workers = workers
+        self.tenant_labels = tenant_labels
+        self._labelled: set = set()
+        self._labels_lock = threading.Lock()
+
+        self._cond = threading.Condition()
+        self._queues: dict[str, deque] = {}   # tenant -> (request, idx, body, sender, subject)
+        self._active: deque = deque()         # round-robin order of tenants with work
+        self._deficit: dict[str, int] = {}
+        self._stop = False
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"nlp-scheduler-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+            pending = {item[0] for queue in self._queues.values() for item in queue}
+            self._queues.clear(), self._active.clear(), self._deficit.clear()
+        for request in pending:
+            request.error = RuntimeError("Scheduler stopped")
+            request.done.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    # ── Metrics labels ──
+    def _label(self, tenant: str) -> str:
+        """``tenant`` for the first ``tenant_labels`` tenants seen, ``"other"`` beyond."""
+        if not SAFE_LABEL.fullmatch(tenant):  # client-supplied: never raw in the exposition
+            tenant = "h-" + hashlib.sha256(tenant.encode("utf-8")).hexdigest()[:16]
+        with self._labels_lock:
+            if tenant in self._labelled:
+                return tenant
+            if len(self._labelled) < self.tenant_labels:
+                self._labelled.add(tenant)
+                return tenant
+        return OTHER
+
+    def _publish_queued(self, tenant: str):
+        """Queued emails of the tenant's label (summed over the tenants sharing it)."""
+        label = self._label(tenant)
+        if label == OTHER:
+            queued = sum(len(q) for t, q in self._queues.items() if self._label(t) == OTHER)
+        else:
+            queued = len(self._queues.get(tenant, ()))
+        metrics.set("nlp_tenant_queued_emails", queued, tenant=label)
+
+    # ── Submission ──
+    def extract(self, tenant: str, bodies: list[str], senders: list[str] = None,
+                subjects: list[str] = None, stats: dict = None) -> list[dict]:
+        """
+        Queue the emails under ``tenant`` and block until all are extracted
+        (``TimeoutError`` after ``timeout`` seconds, its queued emails withdrawn).
+
+        ``stats["extract_seconds"]`` receives the request's share of the
+        batches' extraction time (queueing excluded).
+        """
+        if not bodies:
+            return []
+        tenant = tenant or ANONYMOUS
+        request = _Request(tenant, len(bodies))
+        senders = senders or [""] * len(bodies)
+        subjects = subjects or [""] * len(bodies)
+        with self._cond:
+            if self._stop:
+                raise RuntimeError("Scheduler is stopped")
+            queue = self._queues.setdefault(tenant, deque())
+            if not queue:
+                self._active.append(tenant)
+                self._deficit[tenant] = 0
+            queue.extend((request, i, body, sender, subject)
+                         for i, (body, sender, subject) in enumerate(zip(bodies, senders, subjects)))
+            self._publish_queued(tenant)
+            self._cond.notify()
+
+        if not request.done.wait(self.timeout):
+            self._withdraw(request)
+            raise TimeoutError(f"Request of tenant {tenant} not extracted within {self.timeout:.0f}s")
+        if request.error is not None:
+            raise request.error
+        if stats is not None:
+            stats["extract_seconds"] = request.extract_seconds
+        return request.results
+
+    def _withdraw(self, request: _Request):
+        """Drop the request's emails still queued (a timed-out caller is gone)."""
+        with self._cond:
+            queue = self._queues.get(request.tenant)
+            if not queue:
+                return
+            kept = deque(item for item in queue if item[0] is not request)
+            if kept:
+                self._queues[request.tenant] = kept
+            else:
+                self._active.remove(request.tenant)
+                del self._queues[request.tenant], self._deficit[request.tenant]
+            self._publish_queued(request.tenant)
+
+    # ── Dispatch ──
+    def _next_batch(self) -> list[tuple]:
+        """DRR over active tenants; a tenant cut off by a full batch keeps its turn."""
+        batch = []
+        while self._active and len(batch) < self.batch_size:
+            tenant = self._active[0]
+            queue = self._queues[tenant]
+            if self._deficit[tenant] < 1:
+                self._deficit[tenant] += self.quantum
+            take = min(self._deficit[tenant], self.batch_size - len(batch), len(queue))
+            batch.extend(queue.popleft() for _ in range(take))
+            self._deficit[tenant] -= take
+
+            if not queue:
+                self._active.popleft()
+                del self._queues[tenant], self._deficit[tenant]
+            elif self._deficit[tenant] < 1:
+                self._active.rotate(-1)
+            self._publish_queued(tenant)
+        return batch
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._active and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                batch = self._next_batch()
+            try:
+                self._run(batch)
+            except Exception as e:  # the dispatcher must outlive any batch
+                logger.exception("❌ Scheduler dispatch failed")
+                for request in {item[0] for item in batch}:
+                    request.error = request.error or e
+                    request.done.set()
+
+    @staticmethod
+    def _extract(engine, items: list[tuple]) -> list[dict]:
+        return engine.extract_batch(
+            [body for _, _, body, _, _ in items],
+            senders=[sender for *_, sender, _ in items],
+            subjects=[subject for *_, subject in items],
+        )
+
+    def _isolate(self, engine, batch: list[tuple], error: Exception):
+        """Failed batch: each request's emails again on their own; ``(results, errors)`` per email."""
+        groups: dict[int, list[int]] = {}
+        for position, (request, *_) in enumerate(batch):
+            groups.setdefault(id(request), []).append(position)
+        results, errors = [None] * len(batch), [error] * len(batch)
+        if len(groups) == 1:
+            return results, errors  # a single request: the same retry would fail the same way
+        for positions in groups.values():
+            try:
+                group_results = self._extract(engine, [batch[p] for p in positions])
+            except Exception as e:
+                logger.error(f"❌ Request of tenant {batch[positions[0]][0].tenant} failed: {e}")
+                group_errors = [e] * len(positions)
+                group_results = [None] * len(positions)
+            else:
+                group_errors = [None] * len(positions)
+            for p, result, group_error in zip(positions, group_results, group_errors):
+                results[p], errors[p] = result, group_error
+        return results, errors
+
+    def _run(self, batch: list[tuple]):
+        tenants = {request.tenant for request, *_ in batch}
+        metrics.inc("nlp_scheduler_batches_total")
+        metrics.set("nlp_scheduler_batch_tenants", len(tenants))
+        start = time.perf_counter()
+        try:
+            engine = self.get_engine()
+        except Exception as e:  # failed load, swap in progress...: every request gets the error
+            logger.exception("❌ No engine for the scheduled batch")
+            results, errors = [None] * len(batch), [e] * len(batch)
+        else:
+            try:
+                results, errors = self._extract(engine, batch), [None] * len(batch)
+            except Exception as e:
+                logger.exception("❌ Scheduled batch failed — retrying its requests separately")
+                results, errors = self._isolate(engine, batch, e)
+        self._finish(batch, results, errors, start)
+
+    def _finish(self, batch: list[tuple], results: list, errors: list, start: float):
+        """Hand results/errors to their requests; wake the requests now complete."""
+        now = time.perf_counter()
+        per_email = (now - start) / len(batch)
+        finished = []
+        with self._cond:  # a request may be split over batches run by several workers
+            for (request, idx, *_), result, error in zip(batch, results, errors):
+                request.results[idx] = result
+                request.extract_seconds += per_email
+                request.remaining -= 1
+                if error is not None:
+                    request.error = error
+                if request.remaining == 0:
+                    finished.append(request)
+        emails = {}
+        for request, *_ in batch:
+            label = self._label(request.tenant)
+            emails[label] = emails.get(label, 0) + 1
+        for label, count in emails.items():
+            metrics.inc("nlp_tenant_emails_total", count, tenant=label)
+        for request in finished:
+            label = self._label(request.tenant)
+            metrics.inc("nlp_tenant_requests_total", tenant=label)
+            metrics.observe("nlp_tenant_latency_seconds", now - request.submitted, tenant=label)
+            request.done.set()
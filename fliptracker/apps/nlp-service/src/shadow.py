@@ -0,0 +1,198 @@
+"""
+FlipTracker NLP — Shadow evaluation of a candidate model
+
+A sampled fraction of ``/extract/batch`` traffic is replayed through a
+candidate registry version after the response has been computed. The
+replay runs in a background thread and never delays the response: when that
+thread falls behind, new samples are dropped and counted, and never queued
+without bound.
+
+For each replayed email the evaluator records:
+
+- per-field agreement with the served model (``agree``: same value,
+  ``primaryOnly`` / ``candidateOnly``: only one model found a value,
+  ``different``: both found different values);
+- extraction time per email (p50/p95/p99), candidate next to the served
+  model (its share of the batches it ran, queueing excluded);
+- CPU seconds spent by the shadow thread, against the process total (a lower
+  bound: ONNX Runtime's own worker threads are not attributed).
+
+Usage:
+    shadow = ShadowEvaluator(registry, "2025-06-01", sample_rate=0.1)
+    shadow.start()
+    shadow.offer(bodies, senders, results, elapsed_seconds)   # after responding
+    shadow.report()
+"""
+import logging
+import math
+import queue
+import random
+import threading
+import time
+from collections import Counter, deque
+
+from src.extractor import FIELDS
+from src.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 10_000   # per-email latencies kept for percentiles
+EXAMPLES_KEPT = 20        # recent disagreements shown in the report
+
+metrics.describe("nlp_shadow_emails_total", "counter", "Emails replayed through the shadow candidate")
+metrics.describe("nlp_shadow_dropped_total", "counter", "Sampled batches dropped (shadow queue full)")
+metrics.describe("nlp_shadow_field_total", "counter", "Shadow comparisons by field and outcome")
+
+
+def _normalize(value) -> str:
+    return " ".join(str(value).split()).lower() if value else ""
+
+
+def compare(primary, candidate) -> str:
+    primary, candidate = _normalize(primary), _normalize(candidate)
+    if primary == candidate:
+        return "agree"
+    if not candidate:
+        return "primaryOnly"
+    if not primary:
+        return "candidateOnly"
+    return "different"
+
+
+def percentiles(values, points=(50, 95, 99)) -> dict:
+    """Nearest-rank percentiles in ms (None without data)."""
+    ordered = sorted(values)
+    if not ordered:
+        return {f"p{p}": None for p in points}
+    return {
+        f"p{p}": round(ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)] * 1000, 2)
+        for p in points
+    }
+
+
+class ShadowEvaluator:
+    """Replays sampled batches through a candidate version and accumulates a report."""
+
+    def __init__(self, registry, version: str, sample_rate: float = 0.1, max_queue: int = 16):
+        self.registry = registry
+        self.version = version
+        self.sample_rate = sample_rate
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.candidate = None
+        self.error = None
+        self.started_at = time.time()
+        self._cpu_start = time.process_time()
+        self.shadow_cpu = 0.0
+        self.emails = 0
+        self.dropped = 0
+        self.outcomes = {field: Counter() for field in FIELDS}
+        self.candidate_latency: deque = deque(maxlen=LATENCY_WINDOW)
+        self.primary_latency: deque = deque(maxlen=LATENCY_WINDOW)
+        self.examples: deque = deque(maxlen=EXAMPLES_KEPT)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="nlp-shadow", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ── Request path (non-blocking) ──
+    def offer(self, bodies: list[str], senders: list[str], results: list[dict], elapsed: float,
+              subjects: list[str] = None):
+        """Maybe sample this batch; ``elapsed``: the served model's extraction time for it."""
+        if self.error or not bodies or random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((bodies, senders, subjects, results, elapsed / len(bodies)))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            metrics.inc("nlp_shadow_dropped_total")
+
+    # ── Shadow thread ──
+    def _loop(self):
+        logger.info(f"👥 Shadow: loading candidate {self.version}...")
+        try:
+            candidate = self.registry.load_engine(self.version)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.error(f"❌ Shadow candidate {self.version} failed to load: {self.error}")
+            return
+        with self._lock:  # CPU overhead measured from here: the one-off load is not traffic
+            self.candidate = candidate
+            self._cpu_start = time.process_time()
+        logger.info(f"✅ Shadow: candidate {self.version} ready")
+
+        while not self._stop.is_set():
+            try:
+                bodies, senders, subjects, primary, primary_latency = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            cpu, start = time.thread_time(), time.perf_counter()
+            try:
+                candidate = self.candidate.extract_batch(bodies, senders=senders, subjects=subjects)
+            except Exception:
+                logger.exception("❌ Shadow batch failed")
+                continue
+            per_email = (time.perf_counter() - start) / len(bodies)
+            self._record(bodies, primary, candidate, per_email, primary_latency,
+                         time.thread_time() - cpu)
+
+    def _record(self, bodies, primary, candidate, per_email, primary_latency, cpu_seconds):
+        with self._lock:
+            self.shadow_cpu += cpu_seconds
+            self.emails += len(bodies)
+            for body, p, c in zip(bodies, primary, candidate):
+                self.candidate_latency.append(per_email)
+                self.primary_latency.append(primary_latency)
+                diffs = {}
+                for field in FIELDS:
+                    outcome = compare(p.get(field), c.get(field))
+                    self.outcomes[field][outcome] += 1
+                    metrics.inc("nlp_shadow_field_total", field=field, outcome=outcome)
+                    if outcome != "agree":
+                        diffs[field] = {"primary": p.get(field), "candidate": c.get(field)}
+                if diffs:
+                    self.examples.append({"excerpt": body[:200], "fields": diffs})
+        metrics.inc("nlp_shadow_emails_total", len(bodies))
+
+    # ── Report ──
+    def report(self) -> dict:
+        with self._lock:
+            process_cpu = time.process_time() - self._cpu_start
+            agreement = {}
+            for field, counts in self.outcomes.items():
+                total = sum(counts.values())
+                agreement[field] = {
+                    "rate": round(counts["agree"] / total, 4) if total else None,
+                    "compared": total,
+                    **{k: counts[k] for k in ("agree", "primaryOnly", "candidateOnly", "different")},
+                }
+            return {
+                "candidate": self.version,
+                "ready": self.candidate is not None,
+                "error": self.error,
+                "sampleRate": self.sample_rate,
+                "since": self.started_at,
+                "emails": self.emails,
+                "dropped": self.dropped,
+                "agreement": agreement,
+                "latencyMs": {
+                    "candidate": percentiles(self.candidate_latency),
+                    "primary": percentiles(self.primary_latency),
+                },
+                "cpu": {
+                    "shadowSeconds": round(self.shadow_cpu, 3),
+                    "processSeconds": round(process_cpu, 3),
+                    # share of the process CPU spent on shadow replays
+                    "overhead": round(self.shadow_cpu / process_cpu, 4) if process_cpu else None,
+                },
+                "disagreements": list(self.examples),
+            }
@@ -0,0 +1,178 @@
+"""
+FlipTracker NLP — Wire formats
+
+Request bodies of ``/extract/batch`` and ``/jobs`` are raw HTML emails
+(50–200 KB each), so parsing and encoding them costs about as much as the
+extraction itself. This module handles both ends without going through
+FastAPI's generic body handling:
+
+- request size: the raw body is counted while it streams in, so chunked
+  uploads (no ``Content-Length``) get the same 413 as declared ones;
+- request decompression: ``Content-Encoding: gzip | deflate | zstd``
+  (zstd needs the optional ``zstandard`` package), bounded against
+  decompression bombs;
+- request formats: JSON, validated in one pass by pydantic-core
+  (``model_validate_json``), or msgpack (``Content-Type: application/msgpack``);
+- responses: orjson-encoded JSON, or msgpack when the client sends
+  ``Accept: application/msgpack``. Results are returned as-is, without
+  re-validation against the response model.
+
+FastAPI no longer sees the body model, so routes declare it for the OpenAPI
+schema with ``openapi_extra=wire.openapi_body(Model)``.
+
+Usage:
+    @app.post("/extract/batch", openapi_extra=wire.openapi_body(EmailBatchRequest))
+    async def extract_batch(request: EmailBatchRequest = Depends(wire.body(EmailBatchRequest)),
+                            accept: str = Header("")):
+        return wire.respond({...}, accept)
+"""
+import gzip
+import io
+import json
+import zlib
+
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response
+from pydantic import ValidationError
+
+try:
+    import orjson
+except ImportError:  # stdlib json fallback, slower on large payloads
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+
+def _is_msgpack(content_type: str) -> bool:
+    return any(t in (content_type or "").lower() for t in MSGPACK_TYPES)
+
+
+# ── Requests ─────────────────────────────────────────────────────
+def _read_limited(stream, limit: int) -> bytes:
+    data = stream.read(limit + 1)
+    if len(data) > limit:
+        raise HTTPException(status_code=413, detail=f"Decompressed body exceeds {limit} bytes")
+    return data
+
+
+async def read_body(request: Request, limit: int) -> bytes:
+    """Request body, 413 as soon as more than ``limit`` bytes have been received."""
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def decompress(raw: bytes, content_encoding: str, limit: int) -> bytes:
+    """Undo ``Content-Encoding`` (applied in order, so decoded in reverse)."""
+    codings = [c.strip().lower() for c in (content_encoding or "").split(",") if c.strip()]
+    for coding in reversed(codings):
+        if coding in ("identity", ""):
+            continue
+        try:
+            if coding in ("gzip", "x-gzip"):
+                raw = _read_limited(gzip.GzipFile(fileobj=io.BytesIO(raw)), limit)
+            elif coding == "deflate":
+                decompressor = zlib.decompressobj()
+                raw = decompressor.decompress(raw, limit + 1)
+                if len(raw) > limit:
+                    raise HTTPException(status_code=413, detail=f"Decompressed body exceeds {limit} bytes")
+            elif coding == "zstd":
+                try:
+                    import zstandard
+                except ImportError:
+                    raise HTTPException(status_code=415, detail="zstd bodies need the zstandard package")
+                raw = _read_limited(zstandard.ZstdDecompressor().stream_reader(io.BytesIO(raw)), limit)
+            else:
+                raise HTTPException(status_code=415, detail=f"Unsupported Content-Encoding: {coding}")
+        except (OSError, EOFError, zlib.error) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {coding} body: {e}")
+    return raw
+
+
+def parse(model, raw: bytes, content_type: str):
+    """Validate ``raw`` (JSON or msgpack) against the pydantic ``model``."""
+    try:
+        if _is_msgpack(content_type):
+            if msgpack is None:
+                raise HTTPException(status_code=415, detail="msgpack bodies need the msgpack package")
+            try:
+                data = msgpack.unpackb(raw, raw=False)
+            except (ValueError, TypeError, msgpack.UnpackException) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid msgpack body: {e}")
+            return model.model_validate(data)
+        return model.model_validate_json(raw)
+    except ValidationError as e:
+        raise RequestValidationError([  # same error shape as FastAPI's own body validation
+            {**error, "loc": ("body", *error["loc"])}
+            for error in e.errors(include_url=False, include_context=False)
+        ])
+
+
+def body(model, limit: int = None):
+    """FastAPI dependency: decompress + parse the request body into ``model``."""
+    if limit is None:
+        from src.config import settings
+        limit = settings.max_batch_bytes * 2
+
+    async def dependency(request: Request):
+        raw = await read_body(request, limit)
+        headers = request.headers
+        # Off the event loop: decompressing / validating MBs of HTML takes a while
+        return await run_in_threadpool(
+            lambda: parse(model, decompress(raw, headers.get("content-encoding", ""), limit),
+                          headers.get("content-type", ""))
+        )
+
+    return dependency
+
+
+def _inline_refs(node, defs: dict):
+    """Replace ``{"$ref": "#/$defs/X"}`` by ``X``'s schema (models here are not recursive)."""
+    if isinstance(node, dict):
+        ref = node.get("$ref", "")
+        if ref.startswith("#/$defs/"):
+            return _inline_refs(defs[ref.rsplit("/", 1)[1]], defs)
+        return {k: _inline_refs(v, defs) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_inline_refs(v, defs) for v in node]
+    return node
+
+
+def openapi_body(model) -> dict:
+    """``openapi_extra`` documenting ``model`` as the (JSON or msgpack) request body."""
+    schema = model.model_json_schema()
+    # "#/$defs/..." would resolve against the OpenAPI document root: inline nested models
+    schema = _inline_refs(schema, schema.pop("$defs", {}))
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {media_type: {"schema": schema}
+                        for media_type in ("application/json", MSGPACK_TYPES[0])},
+        }
+    }
+
+
+# ── Responses ────────────────────────────────────────────────────
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def respond(payload, accept: str = "", status_code: int = 200) -> Response:
+    """Encode ``payload`` directly (no response-model validation)."""
+    if msgpack is not None and _is_msgpack(accept):
+        return Response(msgpack.packb(payload, use_bin_type=True), status_code=status_code,
+                        media_type="application/msgpack")
+    return Response(dumps(payload), status_code=status_code, media_type="application/json")
@@ -0,0 +1,239 @@
+"""
+FlipTracker NLP — Resumable spaCy training checkpoints
+
+The spaCy training loops (train.py CPU fallback, train_spacy_ner.py,
+train_ner_full.py, train_address_ner.py) save a checkpoint every
+``every`` epochs:
+
+    checkpoints/
+      checkpoints.json          # index: latest + every kept checkpoint (epoch, step, score)
+      epoch-0004/
+        model/                  # nlp.to_disk
+        optimizer.pkl           # Adam moments, averages, update counts (thinc Optimizer)
+        rng.pkl                 # random + numpy generator states
+        state.json              # epoch, step, score, metric, extra loop state
+
+The latest checkpoint is always kept (it is what ``--resume`` restarts from);
+among the others only the ``keep_best`` best by dev score survive.
+Checkpoints are written under a temporary name and renamed, and the index is
+replaced atomically, so a run killed mid-save leaves the previous one intact.
+
+Optimizer state is keyed by thinc node ids, which differ from one process to
+the next: keys are stored by the node's position in the pipeline walk and
+mapped back onto the rebuilt pipeline on restore.
+
+Usage:
+    checkpoints = Checkpointer(Path("models/checkpoints/ner"), keep_best=3)
+    optimizer = nlp.initialize(lambda: examples)
+    state = checkpoints.start(nlp, optimizer, resume=args.resume)
+    for epoch in range(state["epoch"] + 1, epochs):
+        ...
+        checkpoints.save(nlp, optimizer, epoch, step, score=dev_f1(nlp, dev))
+"""
+import copy
+import json
+import os
+import pickle
+import random
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+INDEX = "checkpoints.json"
+# thinc Optimizer attributes keyed by (node id, param name)
+KEYED_STATE = ("mom1", "mom2", "averages", "nr_update", "last_seen")
+# Schedules are generators (not picklable); these loops never step them
+UNSAVED_STATE = ("schedules",)
+
+
+def _optimizer_state(optimizer) -> dict:
+    return {slot: getattr(optimizer, slot) for slot in type(optimizer).__slots__ if slot not in UNSAVED_STATE}
+
+
+def _node_ids(nlp) -> list[int]:
+    """Ids of every thinc node of the pipeline, in a stable walk order."""
+    ids, seen = [], set()
+    for _, component in nlp.pipeline:
+        model = getattr(component, "model", None)
+        if model is None or not hasattr(model, "walk"):
+            continue
+        for node in model.walk():
+            if node.id not in seen:
+                seen.add(node.id)
+                ids.append(node.id)
+    return ids
+
+
+def _remap(state: dict, mapping: dict) -> dict:
+    remapped = dict(state)
+    for attr in KEYED_STATE:
+        table = state.get(attr)
+        if not table:
+            continue
+        new_table = copy.copy(table)
+        new_table.clear()
+        for key, value in table.items():
+            if isinstance(key, tuple) and key[0] in mapping:
+                new_table[(mapping[key[0]], *key[1:])] = value
+        remapped[attr] = new_table
+    return remapped
+
+
+def add_arguments(parser):
+    """``--resume`` / ``--checkpoint-dir`` / ``--keep-best`` / ``--checkpoint-every``."""
+    parser.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint")
+    parser.add_argument("--checkpoint-dir", type=Path, default=None)
+    parser.add_argument("--keep-best", type=int, default=3, help="Checkpoints kept by dev score")
+    parser.add_argument("--checkpoint-every", type=int, default=1, help="Checkpoint interval (epochs)")
+
+
+def dev_examples(nlp, path: Path, labels: set = None) -> list:
+    """spaCy-format ``[[text, {"entities": ...}]]`` file → Examples (empty when missing)."""
+    from spacy.training import Example
+
+    path = Path(path)
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    examples = []
+    for item in data:
+        if isinstance(item, list) and len(item) == 2 and item[0] and isinstance(item[1], dict):
+            entities = [e for e in item[1].get("entities", []) if labels is None or e[2] in labels]
+            try:
+                examples.append(Example.from_dict(nlp.make_doc(item[0]), {"entities": entities}))
+            except ValueError:
+                continue
+    return examples
+
+
+def dev_f1(nlp, examples: list) -> float:
+    return float(nlp.evaluate(examples).get("ents_f") or 0.0)
+
+
+class Checkpointer:
+    """Saves, prunes and restores training checkpoints in ``directory``."""
+
+    def __init__(self, directory: Path, keep_best: int = 3, every: int = 1):
+        self.directory = Path(directory)
+        self.keep_best = max(1, keep_best)
+        self.every = max(1, every)
+        self.index = self._load_index()
+
+    def _load_index(self) -> dict:
+        path = self.directory / INDEX
+        if not path.exists():
+            return {"latest": None, "checkpoints": []}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_index(self):
+        tmp = self.directory / f"{INDEX}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp, self.directory / INDEX)
+
+    # ── Save ──
+    def due(self, epoch: int, last_epoch: int) -> bool:
+        return (epoch + 1) % self.every == 0 or epoch == last_epoch
+
+    def save(self, nlp, optimizer, epoch: int, step: int = 0, score: float = None,
+             metric: str = "ents_f", **extra) -> Path:
+        """Checkpoint the end of ``epoch`` (higher ``score`` is better), then prune."""
+        name = f"epoch-{epoch:04d}"
+        final = self.directory / name
+        staging = self.directory / f"{name}.tmp"
+        if staging.exists():
+            shutil.rmtree(staging)
+        staging.mkdir(parents=True)
+
+        nlp.to_disk(staging / "model")
+        node_ids = _node_ids(nlp)
+        positions = {node_id: i for i, node_id in enumerate(node_ids)}
+        with open(staging / "optimizer.pkl", "wb") as f:
+            pickle.dump({"nodes": len(node_ids), "state": _remap(_optimizer_state(optimizer), positions)}, f)
+        with open(staging / "rng.pkl", "wb") as f:
+            pickle.dump({"random": random.getstate(), "numpy": np.random.get_state()}, f)
+        entry = {"name": name, "epoch": epoch, "step": step, "score": score, "metric": metric,
+                 "time": time.time()}
+        with open(staging / "state.json", "w", encoding="utf-8") as f:
+            json.dump({**entry, "extra": extra}, f, indent=2)
+
+        if final.exists():
+            shutil.rmtree(final)
+        staging.rename(final)
+        self.index["checkpoints"] = [c for c in self.index["checkpoints"] if c["name"] != name] + [entry]
+        self.index["latest"] = name
+        self._prune()
+        self._write_index()
+        return final
+
+    def _prune(self):
+        ranked = sorted(
+            self.index["checkpoints"],
+            key=lambda c: (c["score"] if c["score"] is not None else float("-inf"), c["epoch"]),
+            reverse=True,
+        )
+        keep = {c["name"] for c in ranked[:self.keep_best]} | {self.index["latest"]}
+        for checkpoint in self.index["checkpoints"]:
+            if checkpoint["name"] not in keep:
+                shutil.rmtree(self.directory / checkpoint["name"], ignore_errors=True)
+        self.index["checkpoints"] = [c for c in self.index["checkpoints"] if c["name"] in keep]
+
+    # ── Restore ──
+    def latest(self) -> Path | None:
+        name = self.index.get("latest")
+        return self.directory / name if name and (self.directory / name).exists() else None
+
+    def best(self) -> Path | None:
+        scored = [c for c in self.index["checkpoints"] if c["score"] is not None]
+        if not scored:
+            return self.latest()
+        return self.directory / max(scored, key=lambda c: (c["score"], c["epoch"]))["name"]
+
+    def restore(self, nlp, optimizer, path: Path = None) -> dict:
+        """Load weights, optimizer and RNG state into a pipeline built like the saved one."""
+        path = Path(path or self.latest())
+        nlp.from_disk(path / "model")
+        with open(path / "optimizer.pkl", "rb") as f:
+            saved = pickle.load(f)
+        node_ids = _node_ids(nlp)
+        if saved["nodes"] != len(node_ids):
+            raise ValueError(f"{path}: saved for a different architecture "
+                             f"({saved['nodes']} nodes, pipeline has {len(node_ids)})")
+        for attr, value in _remap(saved["state"], dict(enumerate(node_ids))).items():
+            setattr(optimizer, attr, value)
+        with open(path / "rng.pkl", "rb") as f:
+            rng = pickle.load(f)
+        random.setstate(rng["random"])
+        np.random.set_state(rng["numpy"])
+        with open(path / "state.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def reset(self):
+        """Forget previous checkpoints (a fresh run must not compete with an old one's best-N)."""
+        for checkpoint in self.index["checkpoints"]:
+            shutil.rmtree(self.directory / checkpoint["name"], ignore_errors=True)
+        self.index = {"latest": None, "checkpoints": []}
+        if (self.directory / INDEX).exists():
+            self._write_index()
+
+    def start(self, nlp, optimizer, resume: bool) -> dict:
+        """
+        Restore the latest checkpoint when resuming (else start clean).
+
+        Returns the state to continue from: ``epoch`` is the last finished
+        epoch (-1 when starting from scratch), plus ``step`` and ``extra``.
+        """
+        if not resume:
+            self.reset()
+            return {"epoch": -1, "step": 0, "extra": {}}
+        if self.latest() is None:
+            print(f"   ℹ️  No checkpoint in {self.directory} — starting from scratch")
+            return {"epoch": -1, "step": 0, "extra": {}}
+        state = self.restore(nlp, optimizer)
+        print(f"   🔄 Resumed from {state['name']} (epoch {state['epoch'] + 1}, step {state['step']}, "
+              f"{state['metric']}={state['score']})")
+        return state
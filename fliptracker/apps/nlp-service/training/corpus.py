@@ -0,0 +1,363 @@
+"""
+FlipTracker NLP — Columnar training corpus
+
+Labelled emails stored as flat, memory-mapped NumPy columns instead of a JSON
+array (``aa.jsonl.json`` holds a JSON string per record that must be decoded
+twice, and the whole file materialized, before anything can start):
+
+    corpus/
+      meta.json                    # version, doc count, label vocabulary, columns
+      text.bin   text.idx.npy      # UTF-8 buffer + int64 byte offsets (n + 1)
+      id.bin     id.idx.npy        # same layout for each string column
+      sender.* subject.* provider.* created_at.*
+      line_number.npy              # int64, -1 when unknown
+      spans.npy  spans.idx.npy     # int32 (m, 3) start, end, label id + per-doc offsets
+
+Opening a corpus reads ``meta.json`` only; texts are decoded one document at a
+time from the mapped buffers, so load time and resident memory do not grow
+with the corpus. Span offsets are character offsets into the decoded text,
+like the annotated JSON files.
+
+Usage:
+    python training/corpus.py convert aa.jsonl.json data/corpus
+    python training/corpus.py convert data/annotated/val.json data/annotated/val.corpus
+    python training/corpus.py info data/corpus
+
+    corpus = Corpus("data/corpus")
+    for item in corpus.with_entities():      # {"text", "entities": [(s, e, label)], ...}
+        ...
+"""
+import argparse
+import json
+import shutil
+import sys
+from array import array
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+FORMAT_VERSION = 1
+STRING_COLUMNS = ("id", "sender", "subject", "provider", "created_at")
+SUFFIX = ".corpus"
+
+
+# ── Reading ──────────────────────────────────────────────────────
+class _StringColumn:
+    """UTF-8 buffer + offsets, both memory-mapped."""
+
+    def __init__(self, path: Path, name: str):
+        self.offsets = np.load(path / f"{name}.idx.npy", mmap_mode="r")
+        size = int(self.offsets[-1])
+        # np.memmap refuses empty files
+        self.buffer = np.memmap(path / f"{name}.bin", dtype=np.uint8, mode="r") if size else b""
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.buffer[start:end]).decode("utf-8")
+
+
+class Corpus:
+    """
+    Read-only view over a columnar corpus directory.
+
+    Items are dicts shaped like ``data/annotated/*.json`` records (``text``,
+    ``entities`` as ``(start, end, label)``) plus the source metadata, so the
+    training scripts can iterate a corpus wherever they iterated a JSON list.
+    ``indices`` restricts the view to some documents (see ``with_entities``,
+    ``split``).
+    """
+
+    def __init__(self, path, indices: np.ndarray = None):
+        self.path = Path(path)
+        with open(self.path / "meta.json", "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"{self.path}: unsupported corpus version {self.meta.get('version')}")
+        self.labels: list[str] = self.meta["labels"]
+        self._columns = {name: _StringColumn(self.path, name) for name in ("text",) + STRING_COLUMNS}
+        self._line_number = np.load(self.path / "line_number.npy", mmap_mode="r")
+        self._spans = np.load(self.path / "spans.npy", mmap_mode="r")
+        self._span_offsets = np.load(self.path / "spans.idx.npy", mmap_mode="r")
+        self._indices = indices
+
+    @staticmethod
+    def is_corpus(path) -> bool:
+        return (Path(path) / "meta.json").exists()
+
+    def _view(self, indices: np.ndarray) -> "Corpus":
+        view = object.__new__(Corpus)
+        view.__dict__.update(self.__dict__)
+        view._indices = np.asarray(indices, dtype=np.int64)
+        return view
+
+    def _doc(self, i: int) -> int:
+        if self._indices is None:
+            return i
+        return int(self._indices[i])
+
+    def __len__(self) -> int:
+        return self.meta["docs"] if self._indices is None else len(self._indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self._view(self._positions()[i])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        doc = self._doc(i)
+        item = {"text": self._columns["text"][doc], "entities": self._entities(doc)}
+        for name in STRING_COLUMNS:
+            item[name] = self._columns[name][doc]
+        item["line_number"] = int(self._line_number[doc])
+        return item
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _positions(self) -> np.ndarray:
+        return np.arange(self.meta["docs"]) if self._indices is None else self._indices
+
+    def _entities(self, doc: int) -> list[tuple[int, int, str]]:
+        start, end = int(self._span_offsets[doc]), int(self._span_offsets[doc + 1])
+        return [(int(s), int(e), self.labels[label]) for s, e, label in self._spans[start:end]]
+
+    def texts(self):
+        """Texts only, decoded lazily."""
+        column = self._columns["text"]
+        for doc in self._positions():
+            yield column[int(doc)]
+
+    def entity_counts(self) -> np.ndarray:
+        """Entities per document of the view (no text decoded)."""
+        return np.diff(self._span_offsets)[self._positions()]
+
+    def label_counts(self) -> Counter:
+        spans = self._spans[:, 2]
+        if self._indices is not None:
+            doc_of_span = np.repeat(np.arange(self.meta["docs"]), np.diff(self._span_offsets))
+            spans = spans[np.isin(doc_of_span, self._indices)]
+        counts = np.bincount(spans, minlength=len(self.labels))
+        return Counter({label: int(counts[i]) for i, label in enumerate(self.labels) if counts[i]})
+
+    def with_entities(self) -> "Corpus":
+        return self._view(self._positions()[self.entity_counts() > 0])
+
+    def split(self, fraction: float = 0.8, seed: int = 42) -> tuple["Corpus", "Corpus"]:
+        positions = self._positions().copy()
+        np.random.default_rng(seed).shuffle(positions)
+        cut = int(len(positions) * fraction)
+        return self._view(np.sort(positions[:cut])), self._view(np.sort(positions[cut:]))
+
+
+def load_split(annotated_dir: Path, name: str):
+    """``annotated_dir/<name>.corpus`` when converted, else ``<name>.json`` (a list)."""
+    corpus_path = Path(annotated_dir) / f"{name}{SUFFIX}"
+    if Corpus.is_corpus(corpus_path):
+        return Corpus(corpus_path)
+    with open(Path(annotated_dir) / f"{name}.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def with_entities(data):
+    """Samples having at least one entity (a view for a corpus, a list otherwise)."""
+    if isinstance(data, Corpus):
+        return data.with_entities()
+    return [d for d in data if d["entities"]]
+
+
+# ── Writing ──────────────────────────────────────────────────────
+class CorpusWriter:
+    """
+    Streams documents into a new corpus directory.
+
+    Only the offsets and spans are kept in memory (a few bytes per document);
+    the directory is written under a temporary name and renamed on ``close``.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._staging = self.path.with_name(self.path.name + ".tmp")
+        if self._staging.exists():
+            shutil.rmtree(self._staging)
+        self._staging.mkdir(parents=True)
+        self._files = {name: open(self._staging / f"{name}.bin", "wb") for name in ("text",) + STRING_COLUMNS}
+        self._offsets = {name: array("q", [0]) for name in self._files}
+        self._line_numbers = array("q")
+        self._spans = array("i")
+        self._span_offsets = array("q", [0])
+        self._label_ids: dict[str, int] = {}
+        self._closed = False
+        self.docs = 0
+
+    def add(self, text: str, entities=(), line_number: int = -1, **meta):
+        values = {"text": text, **{name: meta.get(name) or "" for name in STRING_COLUMNS}}
+        for name, value in values.items():
+            data = str(value).encode("utf-8")
+            self._files[name].write(data)
+            self._offsets[name].append(self._offsets[name][-1] + len(data))
+        for start, end, label in entities:
+            self._spans.extend((start, end, self._label_ids.setdefault(label, len(self._label_ids))))
+        self._span_offsets.append(len(self._spans) // 3)
+        self._line_numbers.append(line_number if line_number is not None else -1)
+        self.docs += 1
+
+    def close(self, **info) -> Path:
+        """Write the offsets and metadata, then publish the directory. ``info`` goes to meta.json."""
+        if self._closed:
+            return self.path
+        self._closed = True
+        for name, f in self._files.items():
+            f.close()
+            np.save(self._staging / f"{name}.idx.npy", np.frombuffer(self._offsets[name], dtype=np.int64))
+        np.save(self._staging / "line_number.npy", np.frombuffer(self._line_numbers, dtype=np.int64))
+        np.save(self._staging / "spans.npy", np.frombuffer(self._spans, dtype=np.int32).reshape(-1, 3))
+        np.save(self._staging / "spans.idx.npy", np.frombuffer(self._span_offsets, dtype=np.int64))
+        with open(self._staging / "meta.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "version": FORMAT_VERSION,
+                "docs": self.docs,
+                "labels": list(self._label_ids),
+                "columns": ["text", *STRING_COLUMNS, "line_number", "spans"],
+                **info,
+            }, f, ensure_ascii=False, indent=2)
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        self._staging.rename(self.path)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *_):
+        if exc_type is None:
+            self.close()
+        elif not self._closed:
+            for f in self._files.values():
+                f.close()
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+
+# ── Conversion ───────────────────────────────────────────────────
+def _anchor(text: str, start: int, end: int, value) -> tuple[int, int] | None:
+    """
+    Character offsets of an entity in ``text``.
+
+    Labelling-tool offsets in ``aa.jsonl.json`` often point into the
+    JSON-encoded ``line`` rather than the decoded text: when ``value`` is not
+    at ``start``, the occurrence closest to ``start`` is used.
+    """
+    if value is None or text[start:end] == value:
+        return (start, end) if 0 <= start < end <= len(text) else None
+    best, position = None, text.find(value)
+    while position != -1:
+        if best is None or abs(position - start) < abs(best - start):
+            best = position
+        position = text.find(value, position + 1)
+    return (best, best + len(value)) if best is not None else None
+
+
+def normalize_record(record) -> tuple[str, list, dict, int]:
+    """
+    ``(text, entities, meta, dropped)`` for any export/annotation format:
+    ``aa.jsonl.json`` (``line`` + ``entities`` dicts), annotated JSON
+    (``text`` + ``entities`` / ``label`` triples), spaCy tuples, raw samples (``body``).
+    """
+    if isinstance(record, list) and len(record) == 2 and isinstance(record[1], dict):
+        record = {"text": record[0], "entities": record[1].get("entities", [])}
+    source = record
+    if "line" in record and "text" not in record:
+        try:
+            source = {**record, **json.loads(record["line"])}
+        except (json.JSONDecodeError, TypeError):
+            source = {**record, "text": record.get("line") or ""}
+    text = source.get("text") or source.get("body") or source.get("rawBody") or ""
+
+    entities, dropped = [], 0
+    for ent in source.get("entities") or source.get("label") or []:
+        if isinstance(ent, dict):
+            start, end, label, value = ent["start"], ent["end"], ent["entity"], ent.get("value")
+        else:
+            (start, end, label), value = ent[:3], None
+        span = _anchor(text, start, end, value)
+        if span is None:
+            dropped += 1
+        else:
+            entities.append((*span, label))
+
+    meta = {
+        "id": source.get("id"),
+        "sender": source.get("from") or source.get("sender"),
+        "subject": source.get("subject"),
+        "provider": source.get("provider"),
+        "created_at": source.get("createdAt") or source.get("created_at") or source.get("receivedAt"),
+    }
+    return text, sorted(set(entities)), meta, dropped
+
+
+def iter_records(path: Path):
+    """Records of a JSON array, JSONL file or existing corpus."""
+    path = Path(path)
+    if Corpus.is_corpus(path):
+        yield from Corpus(path)
+    elif path.suffix == ".jsonl":
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)
+
+
+def convert(source: Path, output: Path) -> dict:
+    dropped = skipped = 0
+    with CorpusWriter(output) as writer:
+        for record in iter_records(source):
+            text, entities, meta, n_dropped = normalize_record(record)
+            dropped += n_dropped
+            if not text:
+                skipped += 1
+                continue
+            line_number = record.get("line_number", -1) if isinstance(record, dict) else -1
+            writer.add(text, entities, line_number=line_number, **meta)
+        writer.close(source=str(source))
+    return {"docs": writer.docs, "skipped": skipped, "droppedSpans": dropped}
+
+
+def size_on_disk(path: Path) -> int:
+    return sum(p.stat().st_size for p in Path(path).iterdir() if p.is_file())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_convert = sub.add_parser("convert", help="JSON / JSONL export → columnar corpus")
+    p_convert.add_argument("source", type=Path)
+    p_convert.add_argument("output", type=Path)
+    p_info = sub.add_parser("info", help="Summary of a corpus")
+    p_info.add_argument("path", type=Path)
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        if not args.source.exists():
+            sys.exit(f"❌ {args.source} not found")
+        print(f"🔄 Converting {args.source} → {args.output}...")
+        stats = convert(args.source, args.output)
+        print(f"   ✅ {stats['docs']} docs ({stats['skipped']} without text skipped)")
+        if stats["droppedSpans"]:
+            print(f"   ⚠️  {stats['droppedSpans']} spans not found in their text — dropped")
+        args.path = args.output
+
+    corpus = Corpus(args.path)
+    counts = corpus.entity_counts()
+    print(f"📦 {corpus.path}: {len(corpus)} docs, {int((counts > 0).sum())} with entities, "
+          f"{size_on_disk(corpus.path) / 1e6:.1f} MB")
+    for label, count in corpus.label_counts().most_common():
+        print(f"   {label}: {count}")
+
+
+if __name__ == "__main__":
+    main()
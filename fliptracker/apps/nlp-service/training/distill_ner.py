@@ -0,0 +1,216 @@
+"""
+FlipTracker NLP — NER Distillation
+
+Distils the CamemBERT NER (teacher, spacy-transformers) into a small CNN
+tok2vec NER (student) that runs on the light serving image:
+
+1. the teacher labels a large unlabelled pool of exported emails (silver data)
+2. a tok2vec student is trained on the silver labels
+3. student and teacher are compared on the gold validation set:
+   entity P/R/F1 and CPU throughput (docs/s)
+
+Usage:
+    python training/distill_ner.py
+    python training/distill_ner.py --pool data/rawEmails.json data/emails_for_labeling.jsonl
+    python training/distill_ner.py --skip-labelling   # reuse data/distill/*.spacy
+"""
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+
+import numpy as np
+import spacy
+from spacy.tokens import DocBin
+
+from corpus import Corpus, load_split, with_entities
+from evaluate import make_reference_docs, span_array, span_prf
+from prepare_data import strip_html
+
+
+# ── Unlabelled pool ──────────────────────────────────────────────
+def _record_text(record) -> str:
+    """Best-effort text of an exported record (rawEmails, training samples, JSONL exports)."""
+    if isinstance(record, str):
+        return record
+    if "line" in record and "text" not in record:
+        try:
+            record = json.loads(record["line"])
+        except (json.JSONDecodeError, TypeError):
+            return record.get("line") or ""
+    text = record.get("text") or record.get("rawBody") or record.get("body") or ""
+    return strip_html(text) if "<" in text else text
+
+
+def load_pool(paths: list[Path], max_chars: int = 3000) -> list[str]:
+    """Load, clean and de-duplicate texts from JSON / JSONL exports or columnar corpora."""
+    texts = []
+    seen = set()
+    for path in paths:
+        if not path.exists():
+            print(f"   ⚠️  {path} not found — skipping")
+            continue
+        if Corpus.is_corpus(path):
+            records = Corpus(path).texts()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                if path.suffix == ".jsonl":
+                    records = [json.loads(line) for line in f if line.strip()]
+                else:
+                    records = json.load(f)
+        before = len(texts)
+        for record in records:
+            text = _record_text(record).strip()[:max_chars]
+            if len(text) >= 20 and text not in seen:
+                seen.add(text)
+                texts.append(text)
+        print(f"   📂 {path}: {len(texts) - before} texts")
+    return texts
+
+
+# ── 1. Teacher labelling ─────────────────────────────────────────
+def label_with_teacher(teacher, texts: list[str], output_dir: Path,
+                       batch_size: int = 16, dev_ratio: float = 0.1):
+    """Run the teacher over the pool and save silver train/dev DocBins."""
+    blank = spacy.blank("fr")
+    docs = []
+    start = time.perf_counter()
+    for i, pred in enumerate(teacher.pipe(texts, batch_size=batch_size), 1):
+        # Copy only the entities so the DocBin doesn't carry transformer data
+        doc = blank.make_doc(pred.text)
+        spans = (doc.char_span(e.start_char, e.end_char, label=e.label_) for e in pred.ents)
+        doc.ents = [span for span in spans if span is not None]
+        docs.append(doc)
+        if i % 500 == 0:
+            print(f"   🏷️  {i}/{len(texts)} ({i / (time.perf_counter() - start):.1f} docs/s)")
+
+    random.seed(42)
+    random.shuffle(docs)
+    n_dev = max(1, int(len(docs) * dev_ratio))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    DocBin(docs=docs[n_dev:]).to_disk(output_dir / "silver_train.spacy")
+    DocBin(docs=docs[:n_dev]).to_disk(output_dir / "silver_dev.spacy")
+    n_ents = sum(len(d.ents) for d in docs)
+    print(f"   💾 {len(docs) - n_dev} train / {n_dev} dev silver docs ({n_ents} entities)")
+
+
+# ── 2. Student training ──────────────────────────────────────────
+def train_student(data_dir: Path, output_dir: Path, epochs: int = 30):
+    """Train a CNN tok2vec NER on the silver DocBins."""
+    from spacy.cli.init_config import init_config
+    from spacy.cli.train import train
+
+    config = init_config(lang="fr", pipeline=["ner"], optimize="efficiency", gpu=False)
+    config_path = output_dir / "student_config.cfg"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    config.to_disk(config_path)
+
+    train(
+        config_path,
+        output_dir / "student",
+        overrides={
+            "paths.train": str(data_dir / "silver_train.spacy"),
+            "paths.dev": str(data_dir / "silver_dev.spacy"),
+            "training.max_epochs": epochs,
+        },
+    )
+    return output_dir / "student" / "model-best"
+
+
+# ── 3. Comparison ────────────────────────────────────────────────
+def benchmark(nlp, texts: list[str], batch_size: int = 32):
+    """Predict ``texts`` and return (docs, docs/s)."""
+    start = time.perf_counter()
+    docs = list(nlp.pipe(texts, batch_size=batch_size))
+    elapsed = time.perf_counter() - start
+    return docs, len(texts) / elapsed if elapsed else float("inf")
+
+
+def compare(teacher, student, val_data: list[dict]):
+    """Gold F1 + throughput of student vs teacher, and student/teacher agreement."""
+    texts = [d["text"] for d in val_data]
+    references = make_reference_docs(student, val_data)
+    teacher_docs, teacher_speed = benchmark(teacher, texts)
+    student_docs, student_speed = benchmark(student, texts)
+
+    label_ids = {}
+    gold = span_array(references, label_ids)
+    teacher_spans = span_array(teacher_docs, label_ids)
+    student_spans = span_array(student_docs, label_ids)
+    lengths = np.array([len(t) for t in texts], dtype=np.int64)
+    n = len(label_ids)
+    teacher_scores = span_prf(gold, teacher_spans, lengths, n)
+    student_scores = span_prf(gold, student_spans, lengths, n)
+    agreement = span_prf(teacher_spans, student_spans, lengths, n)["micro"]["f"]
+
+    print(f"\n   {'Label':<16} {'Teacher F1':>11} {'Student F1':>11}")
+    print(f"   {'-'*40}")
+    for label, i in sorted(label_ids.items()):
+        print(f"   {label:<16} {teacher_scores['f'][i]:>11.2f} {student_scores['f'][i]:>11.2f}")
+    print(f"   {'-'*40}")
+    print(f"   {'OVERALL':<16} {teacher_scores['micro']['f']:>11.2f} {student_scores['micro']['f']:>11.2f}")
+    print(f"\n   Throughput (CPU): teacher {teacher_speed:.1f} docs/s | "
+          f"student {student_speed:.1f} docs/s ({student_speed / teacher_speed:.1f}x)")
+    print(f"   Student/teacher agreement (F1): {agreement:.2f}")
+
+    return {
+        "teacher_f": float(teacher_scores["micro"]["f"]),
+        "student_f": float(student_scores["micro"]["f"]),
+        "teacher_docs_per_s": teacher_speed,
+        "student_docs_per_s": student_speed,
+        "agreement_f": float(agreement),
+    }
+
+
+def main():
+    root = Path(__file__).parent.parent
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--teacher", type=Path, default=root / "models" / "ner_model" / "model-best")
+    parser.add_argument("--pool", type=Path, nargs="*", default=[
+        root / "data" / "rawEmails.json",
+        root / "data" / "emails_for_labeling.jsonl",
+        root / "aa.jsonl.json",
+    ])
+    parser.add_argument("--output", type=Path, default=root / "models" / "ner_distilled")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--skip-labelling", action="store_true")
+    args = parser.parse_args()
+
+    silver_dir = root / "data" / "distill"
+
+    print("\n" + "="*60)
+    print("🧪 NER Distillation (CamemBERT teacher → tok2vec student)")
+    print("="*60)
+
+    teacher = spacy.load(args.teacher)
+    print(f"   👨‍🏫 Teacher: {args.teacher} ({', '.join(teacher.pipe_names)})")
+
+    if not args.skip_labelling:
+        texts = load_pool(args.pool)
+        if not texts:
+            print("   ❌ Empty unlabelled pool")
+            return
+        print(f"   Labelling {len(texts)} texts with the teacher...")
+        label_with_teacher(teacher, texts, silver_dir, batch_size=args.batch_size)
+
+    print("\n   🎓 Training student...")
+    student_path = train_student(silver_dir, args.output, epochs=args.epochs)
+    student = spacy.load(student_path)
+
+    annotated_dir = root / "data" / "annotated"
+    if not (annotated_dir / "val.json").exists() and not Corpus.is_corpus(annotated_dir / "val.corpus"):
+        print(f"   ⚠️  {annotated_dir / 'val.json'} not found — skipping comparison")
+        return
+    val_data = with_entities(load_split(annotated_dir, "val"))
+
+    print(f"\n   📊 Comparing on {len(val_data)} gold validation samples")
+    report = compare(teacher, student, val_data)
+    with open(args.output / "distill_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Student saved to {student_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,24 +2,117 @@
 FlipTracker NLP — Model Evaluation
 
 Evaluates trained NER and classification models on held-out data.
+Predictions are batched (``nlp.pipe`` for NER, padded tensor batches for the
+classifiers) and metrics are computed with NumPy arrays.
 
 Usage:
     python training/evaluate.py
     python training/evaluate.py --ner-only
     python training/evaluate.py --classifier-only
+    python training/evaluate.py --batch-size 64
+    python training/evaluate.py --ner-only --corpus data/annotated/val.corpus
 """
 import json
 import argparse
 from pathlib import Path
-from collections import defaultdict
 
+import numpy as np
 import spacy
-from spacy.tokens import DocBin
-from spacy.training import Example
-from spacy.scorer import Scorer
 
+from corpus import Corpus, load_split, with_entities
 
-def evaluate_ner(data_dir: Path, model_dir: Path):
+
+# ── Metrics (NumPy) ──────────────────────────────────────────────
+def filter_overlaps(ents: list) -> list:
+    """Keep the longest non-overlapping spans."""
+    filtered = []
+    occupied = set()
+    for ent in sorted(ents, key=lambda e: -(e.end - e.start)):
+        token_range = set(range(ent.start, ent.end))
+        if not token_range & occupied:
+            filtered.append(ent)
+            occupied |= token_range
+    return filtered
+
+
+def make_reference_docs(nlp, data: list[dict]) -> list:
+    """Tokenize gold samples and attach their (token-aligned) entities."""
+    references = []
+    for item, doc in zip(data, nlp.tokenizer.pipe(d["text"] for d in data)):
+        ents = []
+        for start, end, label in item["entities"]:
+            span = doc.char_span(start, end, label=label, alignment_mode="contract")
+            if span:
+                ents.append(span)
+        try:
+            doc.ents = ents
+        except ValueError:
+            doc.ents = filter_overlaps(ents)
+        references.append(doc)
+    return references
+
+
+def span_array(docs: list, label_ids: dict) -> np.ndarray:
+    """Flatten the entities of ``docs`` into an (n, 4) array of doc, start, end, label."""
+    rows = [
+        (i, ent.start_char, ent.end_char, label_ids.setdefault(ent.label_, len(label_ids)))
+        for i, doc in enumerate(docs)
+        for ent in doc.ents
+    ]
+    return np.array(rows, dtype=np.int64).reshape(-1, 4)
+
+
+def _span_keys(spans: np.ndarray, doc_offsets: np.ndarray, max_len: int, n_labels: int) -> np.ndarray:
+    """Encode each span as a single int64 key (global start, length, label)."""
+    starts = doc_offsets[spans[:, 0]] + spans[:, 1]
+    lengths = spans[:, 2] - spans[:, 1]
+    return (starts * (max_len + 1) + lengths) * n_labels + spans[:, 3]
+
+
+def span_prf(gold: np.ndarray, pred: np.ndarray, doc_lengths: np.ndarray, n_labels: int) -> dict:
+    """
+    Exact-match span precision/recall/F1 per label and overall (micro).
+
+    ``gold`` and ``pred`` are (n, 4) arrays as returned by ``span_array``.
+    """
+    doc_offsets = np.concatenate(([0], np.cumsum(doc_lengths + 1)[:-1])).astype(np.int64)
+    max_len = int(doc_lengths.max()) if len(doc_lengths) else 0
+    gold_keys = _span_keys(gold, doc_offsets, max_len, n_labels)
+    pred_keys = _span_keys(pred, doc_offsets, max_len, n_labels)
+    matched = np.isin(pred_keys, gold_keys)
+
+    tp = np.bincount(pred[matched, 3], minlength=n_labels).astype(np.float64)
+    n_pred = np.bincount(pred[:, 3], minlength=n_labels).astype(np.float64)
+    n_gold = np.bincount(gold[:, 3], minlength=n_labels).astype(np.float64)
+    return {
+        "tp": tp,
+        "support": n_gold,
+        **_prf(tp, n_pred, n_gold),
+        "micro": _prf(tp.sum(), n_pred.sum(), n_gold.sum()),
+    }
+
+
+def _prf(tp, n_pred, n_gold) -> dict:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = np.nan_to_num(np.divide(tp, n_pred))
+        r = np.nan_to_num(np.divide(tp, n_gold))
+        f = np.nan_to_num(np.divide(2 * p * r, p + r))
+    return {"p": p, "r": r, "f": f}
+
+
+def confusion_matrix(gold: np.ndarray, pred: np.ndarray, n_labels: int) -> np.ndarray:
+    """Confusion matrix (rows=gold, cols=predicted) from integer label arrays."""
+    return np.bincount(gold * n_labels + pred, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+
+
+def confusion_prf(matrix: np.ndarray) -> dict:
+    """Per-label precision/recall/F1 from a confusion matrix."""
+    tp = np.diag(matrix).astype(np.float64)
+    return {**_prf(tp, matrix.sum(axis=0), matrix.sum(axis=1)), "support": matrix.sum(axis=1)}
+
+
+# ── NER ──────────────────────────────────────────────────────────
+def evaluate_ner(data_dir: Path, model_dir: Path, batch_size: int = 32, corpus_path: Path = None):
     """Evaluate NER model on validation set."""
     print("\n" + "="*60)
     print("📊 Evaluating NER Model")
@@ -32,90 +125,100 @@ def evaluate_ner(data_dir: Path, model_dir: Path):
     
     nlp = spacy.load(model_path)
     
-    # Load validation data
-    val_path = data_dir / "annotated" / "val.json"
-    with open(val_path, "r", encoding="utf-8") as f:
-        val_data = json.load(f)
+    # Load validation data (annotated/val.corpus is memory-mapped when present)
+    if corpus_path is not None:
+        val_data = Corpus(corpus_path)
+    else:
+        val_data = load_split(data_dir / "annotated", "val")
     
-    val_with_ents = [d for d in val_data if d["entities"]]
+    val_with_ents = with_entities(val_data)
     print(f"   Evaluating on {len(val_with_ents)} samples with entities")
     
-    # Create examples
-    examples = []
-    for item in val_with_ents:
-        predicted = nlp.make_doc(item["text"])
-        predicted = nlp(item["text"])
-        reference = nlp.make_doc(item["text"])
-        ents = []
-        for start, end, label in item["entities"]:
-            span = reference.char_span(start, end, label=label, alignment_mode="contract")
-            if span:
-                ents.append(span)
-        try:
-            reference.ents = ents
-        except ValueError:
-            # Overlapping entities
-            filtered = []
-            occupied = set()
-            for ent in sorted(ents, key=lambda e: -(e.end - e.start)):
-                token_range = set(range(ent.start, ent.end))
-                if not token_range & occupied:
-                    filtered.append(ent)
-                    occupied |= token_range
-            reference.ents = filtered
-        
-        examples.append(Example(predicted, reference))
+    texts = [d["text"] for d in val_with_ents]
+    predicted = list(nlp.pipe(texts, batch_size=batch_size))
+    references = make_reference_docs(nlp, val_with_ents)
     
-    # Score
-    scorer = Scorer()
-    scores = scorer.score(examples)
+    label_ids: dict[str, int] = {}
+    gold = span_array(references, label_ids)
+    pred = span_array(predicted, label_ids)
+    doc_lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    scores = span_prf(gold, pred, doc_lengths, len(label_ids))
     
     # Entity-level metrics
     print("\n   Entity-level metrics:")
-    print(f"   {'Label':<20} {'Precision':>10} {'Recall':>10} {'F1':>10}")
-    print(f"   {'-'*52}")
-    
-    ents_per_type = scores.get("ents_per_type", {})
-    for label, metrics in sorted(ents_per_type.items()):
-        p = metrics.get("p", 0)
-        r = metrics.get("r", 0)
-        f = metrics.get("f", 0)
-        print(f"   {label:<20} {p:>10.2f} {r:>10.2f} {f:>10.2f}")
-    
-    overall_p = scores.get("ents_p", 0)
-    overall_r = scores.get("ents_r", 0)
-    overall_f = scores.get("ents_f", 0)
-    print(f"   {'-'*52}")
-    print(f"   {'OVERALL':<20} {overall_p:>10.2f} {overall_r:>10.2f} {overall_f:>10.2f}")
+    print(f"   {'Label':<20} {'Precision':>10} {'Recall':>10} {'F1':>10} {'Support':>8}")
+    print(f"   {'-'*61}")
+    
+    for label, i in sorted(label_ids.items()):
+        print(f"   {label:<20} {scores['p'][i]:>10.2f} {scores['r'][i]:>10.2f} "
+              f"{scores['f'][i]:>10.2f} {int(scores['support'][i]):>8}")
+    
+    micro = scores["micro"]
+    print(f"   {'-'*61}")
+    print(f"   {'OVERALL':<20} {micro['p']:>10.2f} {micro['r']:>10.2f} {micro['f']:>10.2f} "
+          f"{len(gold):>8}")
     
     # Error analysis
     print("\n   Sample predictions vs ground truth:")
-    for i, item in enumerate(val_with_ents[:5]):
-        doc = nlp(item["text"][:200])
+    for i, (item, doc) in enumerate(zip(val_with_ents[:5], predicted)):
         gold_ents = [(s, e, l) for s, e, l in item["entities"] if s < 200]
         print(f"\n   --- Sample {i+1} ---")
-        print(f"   Predicted: {[(ent.text[:30], ent.label_) for ent in doc.ents]}")
+        print(f"   Predicted: {[(ent.text[:30], ent.label_) for ent in doc.ents if ent.start_char < 200]}")
         print(f"   Gold:      {[(item['text'][s:e][:30], l) for s, e, l in gold_ents]}")
     
-    return scores
+    return {
+        "labels": label_ids,
+        "ents_per_type": {
+            label: {"p": float(scores["p"][i]), "r": float(scores["r"][i]), "f": float(scores["f"][i])}
+            for label, i in label_ids.items()
+        },
+        "ents_p": float(micro["p"]),
+        "ents_r": float(micro["r"]),
+        "ents_f": float(micro["f"]),
+    }
+
+
+# ── Classifiers ──────────────────────────────────────────────────
+def predict_classifier(model, tokenizer, texts: list[str], batch_size: int = 32,
+                       max_length: int = 512) -> np.ndarray:
+    """Predict label indices for ``texts`` with length-sorted, padded batches."""
+    import torch
+
+    order = np.argsort([len(t) for t in texts], kind="stable")
+    preds = np.empty(len(texts), dtype=np.int64)
+    for start in range(0, len(texts), batch_size):
+        idx = order[start:start + batch_size]
+        inputs = tokenizer(
+            [texts[i] for i in idx],
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+            max_length=max_length,
+        )
+        with torch.inference_mode():
+            logits = model(**inputs).logits
+        preds[idx] = logits.argmax(-1).numpy()
+    return preds
 
 
-def evaluate_classifiers(data_dir: Path, model_dir: Path):
+def evaluate_classifiers(data_dir: Path, model_dir: Path, batch_size: int = 32,
+                         max_length: int = 512):
     """Evaluate classification models."""
     print("\n" + "="*60)
     print("📊 Evaluating Classification Models")
     print("="*60)
     
     try:
-        from transformers import CamembertTokenizer, CamembertForSequenceClassification
-        import torch
+        from transformers import AutoTokenizer, CamembertForSequenceClassification
+        import torch  # noqa
     except ImportError:
         print("   ❌ transformers/torch not installed")
         return
     
     annotated_dir = data_dir / "annotated"
+    results = {}
     
-    for task in ["carrier", "type", "marketplace"]:
+    for task in ["carrier", "type", "marketplace", "email_type"]:
         task_dir = model_dir / f"cls_{task}"
         model_path = task_dir / "model-best"
         label_map_path = task_dir / "label_map.json"
@@ -135,76 +238,69 @@ def evaluate_classifiers(data_dir: Path, model_dir: Path):
         
         print(f"\n   📋 Evaluating {task} classifier...")
         
-        tokenizer = CamembertTokenizer.from_pretrained(str(model_path))
+        tokenizer = AutoTokenizer.from_pretrained(str(model_path), use_fast=True)
         model = CamembertForSequenceClassification.from_pretrained(str(model_path))
         model.eval()
         
         # Use last 20% as test
         split_idx = int(len(cls_data) * 0.8)
         test_data = cls_data[split_idx:]
+        if not test_data:
+            continue
         
-        correct = 0
-        total = 0
-        confusion = defaultdict(lambda: defaultdict(int))
-        
+        # Gold labels unknown to the model get their own column
+        all_labels = list(label_names)
+        label_ids = {l: i for i, l in enumerate(all_labels)}
         for item in test_data:
-            text = item["text"][:512]
-            label = item["label"]
-            
-            inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-            with torch.no_grad():
-                outputs = model(**inputs)
-                pred_idx = outputs.logits.argmax(-1).item()
-            
-            if pred_idx < len(label_names):
-                pred_label = label_names[pred_idx]
-            else:
-                pred_label = "UNKNOWN"
-            
-            confusion[label][pred_label] += 1
-            if pred_label == label:
-                correct += 1
-            total += 1
+            if item["label"] not in label_ids:
+                label_ids[item["label"]] = len(all_labels)
+                all_labels.append(item["label"])
         
-        accuracy = correct / total if total > 0 else 0
-        print(f"      Accuracy: {accuracy:.2%} ({correct}/{total})")
+        gold = np.array([label_ids[item["label"]] for item in test_data], dtype=np.int64)
+        pred = predict_classifier(model, tokenizer, [item["text"] for item in test_data],
+                                  batch_size, max_length)
         
-        # Confusion matrix
-        print(f"\n      Confusion matrix (rows=gold, cols=predicted):")
-        all_labels = sorted(set(
-            list(confusion.keys()) + 
-            [p for g in confusion.values() for p in g.keys()]
-        ))
+        matrix = confusion_matrix(gold, pred, len(all_labels))
+        correct = int(np.trace(matrix))
+        total = len(gold)
+        print(f"      Accuracy: {correct / total:.2%} ({correct}/{total})")
         
-        # Header
-        header = f"      {'':>15}"
-        for l in all_labels:
-            header += f" {l[:8]:>8}"
-        print(header)
+        metrics = confusion_prf(matrix)
+        print(f"\n      {'Label':<15} {'Precision':>10} {'Recall':>10} {'F1':>10} {'Support':>8}")
+        for i, label in enumerate(all_labels):
+            print(f"      {label[:15]:<15} {metrics['p'][i]:>10.2f} {metrics['r'][i]:>10.2f} "
+                  f"{metrics['f'][i]:>10.2f} {int(metrics['support'][i]):>8}")
+        
+        # Confusion matrix (only labels that occur)
+        present = np.flatnonzero(matrix.sum(axis=0) + matrix.sum(axis=1))
+        print(f"\n      Confusion matrix (rows=gold, cols=predicted):")
+        print(f"      {'':>15}" + "".join(f" {all_labels[j][:8]:>8}" for j in present))
+        for i in present:
+            print(f"      {all_labels[i][:15]:>15}" + "".join(f" {matrix[i, j]:>8}" for j in present))
         
-        for gold in all_labels:
-            row = f"      {gold[:15]:>15}"
-            for pred in all_labels:
-                row += f" {confusion[gold][pred]:>8}"
-            print(row)
+        results[task] = {"labels": all_labels, "confusion": matrix, "accuracy": correct / total}
     
-    return
+    return results
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--ner-only", action="store_true")
     parser.add_argument("--classifier-only", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-length", type=int, default=512, help="Classifier max tokens")
+    parser.add_argument("--corpus", type=Path, default=None, help="Evaluate NER on a columnar corpus")
     args = parser.parse_args()
     
     data_dir = Path(__file__).parent.parent / "data"
     model_dir = Path(__file__).parent.parent / "models"
     
     if not args.classifier_only:
-        evaluate_ner(data_dir, model_dir)
+        evaluate_ner(data_dir, model_dir, batch_size=args.batch_size, corpus_path=args.corpus)
     
     if not args.ner_only:
-        evaluate_classifiers(data_dir, model_dir)
+        evaluate_classifiers(data_dir, model_dir, batch_size=args.batch_size,
+                             max_length=args.max_length)
     
     print("\n✅ Evaluation complete!")
 
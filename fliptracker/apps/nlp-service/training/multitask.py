@@ -0,0 +1,112 @@
+"""
+FlipTracker NLP — Multi-task classifier
+
+One CamemBERT encoder shared by four classification heads (carrier, type,
+marketplace, email_type). Trained on the union of the ``cls_*.json`` datasets:
+a text only contributes to the loss of the tasks it is labelled for (the other
+labels are masked with -100).
+"""
+import json
+from pathlib import Path
+
+import torch
+from torch import nn
+from transformers import AutoConfig, AutoModel
+
+TASKS = ("carrier", "type", "marketplace", "email_type")
+IGNORE_INDEX = -100
+
+
+class MultiTaskClassifier(nn.Module):
+    """Shared encoder + one RoBERTa-style classification head per task."""
+
+    def __init__(self, encoder, task_labels: dict[str, list[str]], dropout: float = 0.1):
+        super().__init__()
+        self.encoder = encoder
+        self.task_labels = task_labels
+        hidden = encoder.config.hidden_size
+        # ModuleDict keys must not clash with nn.Module attributes (e.g. "type")
+        self.heads = nn.ModuleDict({
+            f"{task}_head": nn.Sequential(
+                nn.Dropout(dropout),
+                nn.Linear(hidden, hidden),
+                nn.Tanh(),
+                nn.Dropout(dropout),
+                nn.Linear(hidden, len(labels)),
+            )
+            for task, labels in task_labels.items()
+        })
+        self.loss_fn = nn.CrossEntropyLoss(ignore_index=IGNORE_INDEX)
+
+    @classmethod
+    def from_pretrained_encoder(cls, name: str, task_labels: dict[str, list[str]]):
+        return cls(AutoModel.from_pretrained(name, add_pooling_layer=False), task_labels)
+
+    def forward(self, input_ids, attention_mask=None, labels=None):
+        hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+        cls_token = hidden[:, 0]
+        logits = {task: self.heads[f"{task}_head"](cls_token) for task in self.task_labels}
+
+        if labels is None:
+            # Tuple output (task order) — used by the ONNX export
+            return tuple(logits.values())
+
+        loss = hidden.new_zeros(())
+        for i, task in enumerate(self.task_labels):
+            task_labels = labels[:, i]
+            if (task_labels != IGNORE_INDEX).any():
+                loss = loss + self.loss_fn(logits[task], task_labels)
+        return {"loss": loss, **{f"logits_{task}": value for task, value in logits.items()}}
+
+    @property
+    def output_names(self) -> list[str]:
+        return [f"logits_{task}" for task in self.task_labels]
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.encoder.config.save_pretrained(str(path))
+        torch.save(self.state_dict(), path / "multitask.pt")
+        with open(path / "tasks.json", "w", encoding="utf-8") as f:
+            json.dump({"tasks": self.task_labels}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: Path):
+        path = Path(path)
+        with open(path / "tasks.json", "r", encoding="utf-8") as f:
+            task_labels = json.load(f)["tasks"]
+        encoder = AutoModel.from_config(AutoConfig.from_pretrained(str(path)), add_pooling_layer=False)
+        model = cls(encoder, task_labels)
+        model.load_state_dict(torch.load(path / "multitask.pt", map_location="cpu"))
+        model.eval()
+        return model
+
+
+def load_multitask_data(annotated_dir: Path, tasks=TASKS) -> tuple[list[str], list[list[int]], dict]:
+    """
+    Merge ``cls_<task>.json`` files by text.
+
+    Returns (texts, label matrix rows, {task: label names}); missing labels are -100.
+    """
+    per_task = {}
+    for task in tasks:
+        cls_path = annotated_dir / f"cls_{task}.json"
+        if cls_path.exists():
+            with open(cls_path, "r", encoding="utf-8") as f:
+                per_task[task] = json.load(f)
+
+    task_labels = {
+        task: sorted({d["label"] for d in data})
+        for task, data in per_task.items()
+    }
+    label_ids = {task: {l: i for i, l in enumerate(labels)} for task, labels in task_labels.items()}
+    task_index = {task: i for i, task in enumerate(task_labels)}
+
+    rows: dict[str, list[int]] = {}
+    for task, data in per_task.items():
+        for d in data:
+            row = rows.setdefault(d["text"], [IGNORE_INDEX] * len(task_labels))
+            row[task_index[task]] = label_ids[task][d["label"]]
+
+    texts = list(rows)
+    return texts, [rows[t] for t in texts], task_labels
@@ -1,15 +1,32 @@
 """
 FlipTracker NLP — Auto-annotation Pipeline v2
 Extrait: TRACKING, ADDRESS, SHOP_NAME
++ projection des labels connus (project_labels.py) : TRACKING, ORDER_NUMBER,
+  CARRIER, PERSON, ADDRESS
 AVEC vérification d'alignement spaCy
+
+Usage:
+    python training/prepare_data.py                                # training_samples.json → spacy_*.json
+    python training/prepare_data.py --workers 8                    # annotation en parallèle
+    python training/prepare_data.py --input data/corpus --corpus   # corpus in, annotated/*.corpus out (streamed)
 """
+import argparse
 import json
+import os
 import re
+import sys
+from multiprocessing import get_context
 from pathlib import Path
 from bs4 import BeautifulSoup
 import spacy
 from spacy.training import offsets_to_biluo_tags
 import random
+from collections import Counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from corpus import Corpus, CorpusWriter
+from project_labels import build_automaton, project
 
 
 def strip_html(html: str) -> str:
@@ -68,10 +85,18 @@ def find_shop_names(text: str, nlp) -> list:
     return list(found)
 
 
-def find_addresses(text: str, nlp) -> list:
-    """Extract addresses with alignment check"""
+def find_addresses(text: str, nlp, postal=None) -> list:
+    """Extract addresses with alignment check (validated by the postal index if available)"""
     addresses = []
     doc = nlp.make_doc(text)
+
+    if postal is not None:
+        # Only real postcode/commune pairs (+ their street line)
+        for match in postal.find_addresses(text):
+            tags = offsets_to_biluo_tags(doc, [(match.start, match.end, 'ADDRESS')])
+            if '-' not in tags:  # Well aligned
+                addresses.append((match.start, match.end, 'ADDRESS'))
+        return list(set(addresses))
     
     # Pattern 1: Numéro + RUE/AVENUE/STREET + CODE POSTAL
     patterns = [
@@ -95,8 +120,8 @@ def find_addresses(text: str, nlp) -> list:
     return list(set(addresses))
 
 
-def annotate_sample(sample: dict, nlp) -> dict:
-    """Convert a sample to NER format"""
+def annotate_sample(sample: dict, nlp, postal=None, automaton=None) -> dict:
+    """Convert a sample to NER format (known labels projected first, then regex guesses)"""
     body = sample.get("body", "")
     if not body or len(body) < 20:
         return None
@@ -105,14 +130,21 @@ def annotate_sample(sample: dict, nlp) -> dict:
     if len(text) > 3000:
         text = text[:3000]
     
+    # Known values (parsedEmails/parcels) located in the text
+    projected = project(text, sample.get("labels") or {}, automaton, nlp) if automaton else []
+
     # Extract all entities (with alignment check)
-    entities = []
-    entities.extend(find_tracking_numbers(text, nlp))
-    entities.extend(find_addresses(text, nlp))
-    entities.extend(find_shop_names(text, nlp))
+    guessed = []
+    guessed.extend(find_tracking_numbers(text, nlp))
+    guessed.extend(find_addresses(text, nlp, postal))
+    guessed.extend(find_shop_names(text, nlp))
+
+    # Ground truth wins over overlapping regex guesses
+    guessed = [(s, e, label) for s, e, label in guessed
+               if not any(s < p_end and p_start < e for p_start, p_end, _ in projected)]
     
     # Remove duplicates and overlaps
-    entities = list(set(entities))
+    entities = list(set(projected + guessed))
     entities.sort(key=lambda x: x[0])
     
     # Remove overlapping
@@ -132,27 +164,121 @@ def annotate_sample(sample: dict, nlp) -> dict:
     }
 
 
+# ── Parallel annotation ──────────────────────────────────────────
+_nlp = None
+_postal = None
+_automaton = None
+
+
+def _init_annotator(automaton):
+    """One blank pipeline + postal index per worker; the automaton is sent once."""
+    global _nlp, _postal, _automaton
+    from src.postal import PostalIndex
+
+    _nlp, _postal, _automaton = spacy.blank("fr"), PostalIndex.load_default(), automaton
+
+
+def _annotate(sample: dict):
+    meta = {key: sample.get(key) for key in ("id", "sender", "subject")}
+    return meta, annotate_sample(sample, _nlp, _postal, _automaton)
+
+
+def annotate_all(samples, automaton=None, workers: int = 1):
+    """``(id/sender/subject, annotation or None)`` per sample, in input order."""
+    if workers <= 1:
+        _init_annotator(automaton)
+        yield from map(_annotate, samples)
+        return
+    with get_context("spawn").Pool(workers, _init_annotator, (automaton,)) as pool:
+        yield from pool.imap(_annotate, samples, chunksize=32)
+
+
+def annotate_to_corpus(samples, output_dir: Path, train_ratio: float = 0.8,
+                       automaton=None, workers: int = 1) -> Counter:
+    """
+    Annotate and stream straight into annotated/train.corpus and val.corpus.
+
+    Each sample goes to train with probability ``train_ratio`` (seeded), so
+    nothing but the offsets is held in memory whatever the corpus size.
+    """
+    rng = random.Random(42)
+    entity_counts = Counter()
+    skipped = 0
+    with CorpusWriter(output_dir / "train.corpus") as train, CorpusWriter(output_dir / "val.corpus") as val:
+        for meta, result in annotate_all(samples, automaton, workers):
+            if not result:
+                skipped += 1
+                continue
+            entity_counts.update(label for _, _, label in result["entities"])
+            writer = train if rng.random() < train_ratio else val
+            writer.add(result["text"], result["entities"], **meta)
+
+    print(f"   ✅ Annotated: {train.docs + val.docs}")
+    print(f"   ⏭️  Skipped: {skipped}")
+    print(f"\n✂️  Split: {train.docs} train / {val.docs} val")
+    print(f"   💾 {train.path}")
+    print(f"   💾 {val.path}")
+    return entity_counts
+
+
 def main():
-    # Load spaCy for alignment checking
-    nlp = spacy.blank("fr")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=Path, default=None,
+                        help="Samples JSON (default data/training_samples.json) or a columnar corpus")
+    parser.add_argument("--corpus", action="store_true",
+                        help="Write annotated/{train,val}.corpus (streamed) instead of spacy_*.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Annotation processes")
+    parser.add_argument("--no-projection", action="store_true",
+                        help="Regex guesses only (ignore the samples' known labels)")
+    args = parser.parse_args()
+
+    from src.postal import PostalIndex
+    if PostalIndex.load_default() is None:
+        print("⚠️  No postal index (python -m src.postal build <csv>) — unvalidated address patterns")
     
     data_dir = Path(__file__).parent.parent / "data"
-    samples_path = data_dir / "training_samples.json"
+    samples_path = args.input or data_dir / "training_samples.json"
     
     if not samples_path.exists():
-        print("❌ training_samples.json not found")
+        print(f"❌ {samples_path} not found")
         return
     
     print("📂 Loading training samples...")
-    with open(samples_path, "r", encoding="utf-8") as f:
-        samples = json.load(f)
-    print(f"   Loaded {len(samples)} samples")
+    if Corpus.is_corpus(samples_path):
+        # Memory-mapped: texts are decoded one at a time
+        corpus = Corpus(samples_path)
+        samples = ({"body": item["text"], "id": item["id"], "sender": item["sender"],
+                    "subject": item["subject"]} for item in corpus)
+        print(f"   Opened corpus with {len(corpus)} samples")
+    else:
+        with open(samples_path, "r", encoding="utf-8") as f:
+            samples = json.load(f)
+        print(f"   Loaded {len(samples)} samples")
+
+    # Known values of parsedEmails/parcels (export_data.py) → one automaton
+    automaton = None
+    if not args.no_projection and isinstance(samples, list):
+        automaton = build_automaton(samples)
+        print(f"   🔤 {len(automaton)} known label values to project")
+    if not automaton:
+        automaton = None
+        print("   ℹ️  No known labels — regex guesses only")
+    
+    print(f"\n🏷️  Auto-annotating (with alignment check, {args.workers} workers)...")
+    if args.corpus:
+        output_dir = data_dir / "annotated"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        entity_counts = annotate_to_corpus(samples, output_dir, automaton=automaton, workers=args.workers)
+        print("\n📊 Entity types found:")
+        for label, count in entity_counts.most_common():
+            print(f"   {label}: {count}")
+        print("\n✅ Annotation complete!")
+        return
     
-    print("\n🏷️  Auto-annotating (with alignment check)...")
     annotated = []
     skipped = 0
-    for sample in samples:
-        result = annotate_sample(sample, nlp)
+    for _, result in annotate_all(samples, automaton, args.workers):
         if result:
             annotated.append(result)
         else:
@@ -166,7 +292,6 @@ def main():
         return
     
     # Entity statistics
-    from collections import Counter
     entity_counts = Counter()
     for item in annotated:
         for _, _, label in item["entities"]:
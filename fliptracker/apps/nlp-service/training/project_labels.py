@@ -0,0 +1,305 @@
+"""
+FlipTracker NLP — Label projection
+
+``export_data.build_training_samples`` joins each raw email with the values
+the backend already knows for it (``trackingNumber``, ``carrier``,
+``pickupAddress``, ``recipientName``, ``orderNumber``). This stage finds
+those strings in the cleaned text and turns them into entity spans, instead
+of guessing spans with regexes:
+
+- all known values of the corpus go into one token-level Aho-Corasick
+  automaton, and each text is scanned once, whatever the number of values.
+  Tokens are folded (case, accents, street abbreviations), so whitespace,
+  line breaks and punctuation between words do not matter;
+- identifiers (tracking and order numbers) are projected wherever they
+  appear, so a follow-up email without a parsed result of its own is
+  labelled by the one that had it; carriers, names and addresses are only
+  projected into their own email;
+- addresses match tolerantly: the full value, the value without a leading
+  relay-point name, or its street line and its postcode + city found close
+  together, merged into one span (a street line or a postcode + city found
+  alone is not labelled);
+- spans that do not align with spaCy tokens are dropped.
+
+``prepare_data.py`` runs the projection in its annotation workers, before
+the regex guesses (which only fill what projection left empty).
+
+Usage:
+    python training/project_labels.py                                  # coverage report
+    python training/project_labels.py --input data/training_samples.json --workers 8
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter, deque
+from multiprocessing import get_context
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.patterns import CARRIER_KEYWORDS, canonical_carrier
+
+# sample["labels"] field → entity label
+LABEL_FIELDS = {
+    "trackingNumber": "TRACKING",
+    "orderNumber": "ORDER_NUMBER",
+    "carrier": "CARRIER",
+    "recipientName": "PERSON",
+    "pickupAddress": "ADDRESS",
+}
+# Projected into every email that contains them, not only their own
+GLOBAL_LABELS = {"TRACKING", "ORDER_NUMBER"}
+MAX_ADDRESS_GAP = 4  # tokens allowed between a street line and its postcode + city
+
+TOKEN_REGEX = re.compile(r"\w+")
+POSTCODE = re.compile(r"^\d{5}$")
+_ABBREVIATIONS = {
+    "SAINT": "ST", "SAINTE": "STE", "AVENUE": "AV", "BOULEVARD": "BD", "PLACE": "PL",
+    "CHEMIN": "CH", "ROUTE": "RTE", "IMPASSE": "IMP", "ALLEE": "ALL", "FAUBOURG": "FBG",
+}
+
+
+# ── Tokens ───────────────────────────────────────────────────────
+def fold(token: str) -> str:
+    """Upper-case, accent-free, abbreviated form of one token."""
+    folded = unicodedata.normalize("NFKD", token).encode("ascii", "ignore").decode("ascii").upper()
+    return _ABBREVIATIONS.get(folded, folded)
+
+
+def tokenize(text: str) -> list[tuple[str, int, int]]:
+    """``(folded token, start, end)`` of every word of ``text``."""
+    return [(fold(m.group(0)), m.start(), m.end()) for m in TOKEN_REGEX.finditer(text)]
+
+
+def _key(value: str) -> tuple:
+    return tuple(token for token, _, _ in tokenize(value) if token)
+
+
+# ── Automaton ────────────────────────────────────────────────────
+class LabelAutomaton:
+    """Aho-Corasick automaton over folded tokens; each pattern is ``(label, part)``."""
+
+    def __init__(self):
+        self.goto: list[dict] = [{}]
+        self.fail: list[int] = [0]
+        self.out: list[list] = [[]]     # node -> [(pattern length, pattern id)]
+        self.patterns: dict[tuple, int] = {}
+        self.info: list[tuple] = []     # pattern id -> (label, part)
+
+    def add(self, key: tuple, label: str, part: str = "full") -> int:
+        if not key:
+            return -1
+        if key in self.patterns:
+            return self.patterns[key]
+        node = 0
+        for token in key:
+            child = self.goto[node].get(token)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][token] = child
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            node = child
+        pattern_id = len(self.info)
+        self.patterns[key] = pattern_id
+        self.info.append((label, part))
+        self.out[node].append((len(key), pattern_id))
+        return pattern_id
+
+    def build(self) -> "LabelAutomaton":
+        """Failure links (breadth-first) and merged outputs."""
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(token, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+        return self
+
+    def scan(self, tokens: list[str]):
+        """``(first token, last token + 1, pattern id)`` of every occurrence, in one pass."""
+        node = 0
+        goto, fail, out = self.goto, self.fail, self.out
+        for i, token in enumerate(tokens):
+            while node and token not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(token, 0)
+            for length, pattern_id in out[node]:
+                yield i + 1 - length, i + 1, pattern_id
+
+    def __len__(self):
+        return len(self.info)
+
+
+def label_keys(labels: dict) -> list[tuple]:
+    """``(key, label, part)`` patterns for one sample's known values."""
+    keys = []
+    for field, label in LABEL_FIELDS.items():
+        value = labels.get(field)
+        if not value or not isinstance(value, str):
+            continue
+        key = _key(value)
+        if not key:
+            continue
+
+        if label in GLOBAL_LABELS:
+            # Identifiers only: a digit and some length, not "FR" or a word
+            joined = "".join(key)
+            if len(joined) >= 5 and any(c.isdigit() for c in joined):
+                keys.append((key, label, "full"))
+        elif label == "CARRIER":
+            code = canonical_carrier(value) or value.lower().replace(" ", "_")
+            surfaces = [value] + CARRIER_KEYWORDS.get(code, [])
+            keys.extend((_key(surface), label, "full") for surface in surfaces if _key(surface))
+        elif label == "PERSON":
+            if sum(len(token) for token in key) >= 3 and not any(c.isdigit() for c in "".join(key)):
+                keys.append((key, label, "full"))
+                if len(key) == 2:
+                    keys.append((key[::-1], label, "full"))  # "DUPONT MARIE"
+        elif label == "ADDRESS":
+            keys.append((key, label, "full"))
+            # Without a leading relay-point name: from the house number on
+            number = next((i for i, token in enumerate(key) if token.isdigit() and len(token) <= 4), None)
+            if number:
+                keys.append((key[number:], label, "full"))
+            postcode = next((i for i, token in enumerate(key) if POSTCODE.match(token)), None)
+            if postcode is not None:
+                street = key[number or 0:postcode]
+                if len(street) >= 2:
+                    keys.append((street, label, "street"))
+                if postcode + 1 < len(key):
+                    keys.append((key[postcode:], label, "city"))
+    return keys
+
+
+def build_automaton(samples) -> LabelAutomaton:
+    """One automaton for the known values of every sample."""
+    automaton = LabelAutomaton()
+    for sample in samples:
+        for key, label, part in label_keys(sample.get("labels") or {}):
+            automaton.add(key, label, part)
+    return automaton.build()
+
+
+# ── Projection ───────────────────────────────────────────────────
+def _merge_addresses(hits: list[tuple]) -> list[tuple]:
+    """Street line followed closely by its postcode + city → one address hit; lone parts are dropped."""
+    streets = [h for h in hits if h[3] == "street"]
+    cities = [h for h in hits if h[3] == "city"]
+    merged = []
+    for s_start, s_end, label, _ in streets:
+        following = [c for c in cities if 0 <= c[0] - s_end <= MAX_ADDRESS_GAP]
+        if following:
+            merged.append((s_start, min(following)[1], label, "full"))
+    return [h for h in hits if h[3] == "full"] + merged
+
+
+def project(text: str, labels: dict, automaton: LabelAutomaton, nlp=None) -> list[tuple]:
+    """
+    ``(start, end, label)`` spans of the known values found in ``text``.
+
+    ``labels`` is the sample's own ``labels`` dict; identifiers of other
+    samples are projected too. With ``nlp``, misaligned spans are dropped.
+    """
+    tokens = tokenize(text)
+    if not tokens or automaton is None or not len(automaton):
+        return []
+    own = {automaton.patterns.get(key) for key, _, _ in label_keys(labels)}
+    hits = []
+    for first, last, pattern_id in automaton.scan([token for token, _, _ in tokens]):
+        label, part = automaton.info[pattern_id]
+        if label in GLOBAL_LABELS or pattern_id in own:
+            hits.append((first, last, label, part))
+    hits = _merge_addresses(hits)
+
+    # Longest first, then leftmost; no overlaps
+    taken = []
+    for first, last, label, _ in sorted(hits, key=lambda h: (h[0] - h[1], h[0])):
+        if all(last <= f or first >= l for f, l, _ in taken):
+            taken.append((first, last, label))
+
+    spans = [(tokens[first][1], tokens[last - 1][2], label) for first, last, label in taken]
+    if nlp is not None:
+        doc = nlp.make_doc(text)
+        spans = [s for s in spans if doc.char_span(s[0], s[1]) is not None]
+    return sorted(spans)
+
+
+# ── Coverage report ──────────────────────────────────────────────
+_automaton = None
+_nlp = None
+
+
+def _init_worker(automaton):
+    global _automaton, _nlp
+    import spacy
+
+    _automaton, _nlp = automaton, spacy.blank("fr")
+
+
+def _project_sample(sample: dict):
+    from prepare_data import strip_html
+
+    text = strip_html(sample.get("body") or "")[:3000]
+    labels = sample.get("labels") or {}
+    spans = project(text, labels, _automaton, _nlp)
+    known = {LABEL_FIELDS[f] for f in LABEL_FIELDS if labels.get(f)}
+    return known, [label for _, _, label in spans]
+
+
+def main():
+    data_dir = Path(__file__).parent.parent / "data"
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", type=Path, default=data_dir / "training_samples.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    if not args.input.exists():
+        print(f"❌ {args.input} not found (python training/export_data.py)")
+        sys.exit(1)
+    with open(args.input, "r", encoding="utf-8") as f:
+        samples = json.load(f)
+
+    start = time.perf_counter()
+    automaton = build_automaton(samples)
+    print(f"🔤 {len(automaton)} known values, {len(automaton.goto)} automaton states "
+          f"({time.perf_counter() - start:.1f}s)")
+
+    known, found, docs = Counter(), Counter(), 0
+    start = time.perf_counter()
+    if args.workers <= 1:
+        _init_worker(automaton)
+        results = map(_project_sample, samples)
+        pool = None
+    else:
+        pool = get_context("spawn").Pool(args.workers, _init_worker, (automaton,))
+        results = pool.imap(_project_sample, samples, chunksize=64)
+    try:
+        for sample_known, labels in results:
+            known.update(sample_known)
+            found.update(labels)
+            docs += bool(labels)
+    finally:
+        if pool is not None:
+            pool.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"   {docs}/{len(samples)} emails with projected spans "
+          f"({len(samples) / elapsed:.0f} emails/s, {args.workers} workers)")
+    print(f"\n   {'Label':<14} {'known':>7} {'spans':>7}")
+    for label in LABEL_FIELDS.values():
+        print(f"   {label:<14} {known[label]:>7} {found[label]:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+FlipTracker NLP — Model promotion gate
+
+Runs a candidate NER model and the production model over the same held-out
+set and compares accuracy *and* cost:
+
+- per-label and micro span F1 (same exact-match scoring as evaluate.py);
+- throughput (docs/s, batched ``nlp.pipe`` as in serving);
+- latency per doc p50/p95/p99 (single-doc calls, after warm-up);
+- peak RSS (each model is measured in its own subprocess) and size on disk.
+
+Exits with status 1 when the candidate regresses beyond the budgets (F1 drop,
+p95 latency, throughput, peak RSS, size), so it can gate a CI job or
+``python -m src.registry activate``.
+
+Usage:
+    python training/promote.py models/ner_full/model-best
+    python training/promote.py 2025-06-01 --production 2025-05-01      # registry versions
+    python training/promote.py models/ner_full/model-best --max-p95-regression 0.05 --report promote.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import numpy as np
+
+SERVICE_DIR = Path(__file__).parent.parent
+DEFAULT_DATA = [SERVICE_DIR / "data" / "annotated" / "val.corpus", SERVICE_DIR / "data" / "annotated" / "val.json",
+                SERVICE_DIR / "data" / "spacy_val.json"]
+
+# Budgets: relative regressions tolerated (0.10 = 10 % worse), absolute F1 drop
+MAX_F1_DROP = 0.01
+MAX_P95_REGRESSION = 0.10
+MAX_THROUGHPUT_REGRESSION = 0.10
+MAX_RSS_REGRESSION = 0.15
+MAX_SIZE_REGRESSION = 0.25
+
+
+# ── Data / models ────────────────────────────────────────────────
+def load_heldout(path: Path) -> list[dict]:
+    """``[{text, entities}]`` from annotated/val.json, spacy_val.json (``[text, {entities}]``) or a corpus."""
+    from corpus import Corpus
+
+    if Corpus.is_corpus(path):
+        return [{"text": s["text"], "entities": s["entities"]} for s in Corpus(path) if s["text"]]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    samples = []
+    for item in data:
+        if isinstance(item, dict):
+            samples.append({"text": item["text"], "entities": item.get("entities", [])})
+        elif isinstance(item, list) and len(item) == 2 and isinstance(item[1], dict):
+            samples.append({"text": item[0], "entities": item[1].get("entities", [])})
+    return [s for s in samples if s["text"]]
+
+
+def resolve_model(name: str) -> Path:
+    """A model folder, or a registry version (checksums verified)."""
+    path = Path(name).resolve()  # the measuring subprocess runs from training/
+    if (path / "config.cfg").exists():
+        return path
+    from src.config import settings
+    from src.registry import ModelRegistry, RegistryError
+
+    registry = ModelRegistry(settings.model_registry_path)
+    try:
+        registry.verify(name)
+    except RegistryError as e:
+        raise SystemExit(f"❌ {name}: not a model folder nor a valid registry version ({e})")
+    return registry.path(name)
+
+
+def default_production() -> Path:
+    from src.config import settings
+    from src.registry import ModelRegistry
+
+    active = ModelRegistry(settings.model_registry_path).active()
+    if active:
+        return resolve_model(active)
+    for path in (Path(settings.model_path), SERVICE_DIR / "models" / "ner_model" / "model-best"):
+        if (path / "config.cfg").exists():
+            return path.resolve()
+    raise SystemExit("❌ No production model found (registry ACTIVE, NLP_MODEL_PATH) — pass --production")
+
+
+def size_on_disk(path: Path) -> int:
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+# ── Measurement (runs in a subprocess per model) ─────────────────
+def measure(model_path: Path, data_path: Path, batch_size: int, warmup: int, max_chars: int,
+            rounds: int) -> dict:
+    import spacy
+    from evaluate import make_reference_docs, span_array, span_prf
+
+    samples = load_heldout(data_path)
+    texts = [s["text"][:max_chars] for s in samples]
+
+    start = time.perf_counter()
+    nlp = spacy.load(model_path)
+    load_seconds = time.perf_counter() - start
+
+    for text in texts[:warmup]:
+        nlp(text)
+
+    # Throughput: batched, like HybridExtractor.extract_batch (best round)
+    pipe_seconds = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        predicted = list(nlp.pipe(texts, batch_size=batch_size))
+        pipe_seconds = min(pipe_seconds, time.perf_counter() - start)
+
+    # Latency: one doc at a time (fastest round per doc: scheduler noise out)
+    latencies = np.full(len(texts), np.inf)
+    for _ in range(rounds):
+        for i, text in enumerate(texts):
+            start = time.perf_counter()
+            nlp(text)
+            latencies[i] = min(latencies[i], time.perf_counter() - start)
+
+    gold_samples = [
+        {"text": text, "entities": [e for e in s["entities"] if e[1] <= len(text)]}
+        for text, s in zip(texts, samples)
+    ]
+    references = make_reference_docs(nlp, gold_samples)
+    label_ids: dict[str, int] = {}
+    gold = span_array(references, label_ids)
+    pred = span_array(predicted, label_ids)
+    doc_lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=len(texts))
+    scores = span_prf(gold, pred, doc_lengths, max(len(label_ids), 1))
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000 if len(texts) else (0.0, 0.0, 0.0)
+    return {
+        "model": str(model_path),
+        "docs": len(texts),
+        "f1": {label: float(scores["f"][i]) for label, i in label_ids.items()},
+        "support": {label: int(scores["support"][i]) for label, i in label_ids.items()},
+        "microF1": float(scores["micro"]["f"]),
+        "docsPerSecond": len(texts) / pipe_seconds if pipe_seconds else 0.0,
+        "latencyMs": {"p50": float(p50), "p95": float(p95), "p99": float(p99)},
+        "loadSeconds": load_seconds,
+        "peakRssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # KB on Linux
+        "sizeMb": size_on_disk(model_path) / 1e6,
+    }
+
+
+def run_measure(model_path: Path, args) -> dict:
+    """Measure in a fresh interpreter so peak RSS belongs to this model only."""
+    print(f"   ⏱️  Measuring {model_path}...")
+    proc = subprocess.run(
+        [sys.executable, __file__, "--measure", str(model_path), "--data", str(args.data),
+         "--batch-size", str(args.batch_size), "--warmup", str(args.warmup),
+         "--max-chars", str(args.max_chars), "--rounds", str(args.rounds)],
+        cwd=Path(__file__).parent, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": f"{SERVICE_DIR}{os.pathsep}{Path(__file__).parent}"},
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"❌ Measuring {model_path} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+# ── Gate ─────────────────────────────────────────────────────────
+def relative(candidate: float, production: float) -> float:
+    return (candidate - production) / production if production else 0.0
+
+
+def check(production: dict, candidate: dict, args) -> list[str]:
+    failures = []
+    f1_drop = production["microF1"] - candidate["microF1"]
+    if f1_drop > args.max_f1_drop:
+        failures.append(f"micro F1 dropped by {f1_drop:.3f} (budget {args.max_f1_drop:.3f})")
+    for label, f1 in production["f1"].items():
+        drop = f1 - candidate["f1"].get(label, 0.0)
+        if drop > args.max_label_f1_drop:
+            failures.append(f"{label} F1 dropped by {drop:.3f} (budget {args.max_label_f1_drop:.3f})")
+    budgets = [
+        ("p95 latency", relative(candidate["latencyMs"]["p95"], production["latencyMs"]["p95"]),
+         args.max_p95_regression),
+        ("throughput", -relative(candidate["docsPerSecond"], production["docsPerSecond"]),
+         args.max_throughput_regression),
+        ("peak RSS", relative(candidate["peakRssMb"], production["peakRssMb"]), args.max_rss_regression),
+        ("size on disk", relative(candidate["sizeMb"], production["sizeMb"]), args.max_size_regression),
+    ]
+    for name, regression, budget in budgets:
+        if regression > budget:
+            failures.append(f"{name} regressed by {regression:.0%} (budget {budget:.0%})")
+    return failures
+
+
+def print_report(production: dict, candidate: dict):
+    print(f"\n   {'':<22} {'production':>12} {'candidate':>12} {'delta':>10}")
+    print(f"   {'-' * 58}")
+    for label in sorted(set(production["f1"]) | set(candidate["f1"])):
+        p, c = production["f1"].get(label, 0.0), candidate["f1"].get(label, 0.0)
+        support = max(production["support"].get(label, 0), candidate["support"].get(label, 0))
+        print(f"   {'F1 ' + label[:15] + f' ({support})':<22} {p:>12.3f} {c:>12.3f} {c - p:>+10.3f}")
+    p, c = production["microF1"], candidate["microF1"]
+    print(f"   {'F1 micro':<22} {p:>12.3f} {c:>12.3f} {c - p:>+10.3f}")
+    rows = [
+        ("docs/s", production["docsPerSecond"], candidate["docsPerSecond"]),
+        ("ms/doc p50", production["latencyMs"]["p50"], candidate["latencyMs"]["p50"]),
+        ("ms/doc p95", production["latencyMs"]["p95"], candidate["latencyMs"]["p95"]),
+        ("ms/doc p99", production["latencyMs"]["p99"], candidate["latencyMs"]["p99"]),
+        ("peak RSS (MB)", production["peakRssMb"], candidate["peakRssMb"]),
+        ("size on disk (MB)", production["sizeMb"], candidate["sizeMb"]),
+        ("load (s)", production["loadSeconds"], candidate["loadSeconds"]),
+    ]
+    for name, p, c in rows:
+        print(f"   {name:<22} {p:>12.2f} {c:>12.2f} {relative(c, p):>+10.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("candidate", nargs="?", help="Model folder or registry version")
+    parser.add_argument("--production", default=None,
+                        help="Model folder or registry version (default: registry ACTIVE, then NLP_MODEL_PATH)")
+    parser.add_argument("--data", type=Path, default=None, help="Held-out set (annotated/val.json format or a corpus)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3, help="Timing passes, fastest kept")
+    parser.add_argument("--max-chars", type=int, default=3000, help="Truncate docs like serving does")
+    parser.add_argument("--max-f1-drop", type=float, default=MAX_F1_DROP)
+    parser.add_argument("--max-label-f1-drop", type=float, default=0.03)
+    parser.add_argument("--max-p95-regression", type=float, default=MAX_P95_REGRESSION)
+    parser.add_argument("--max-throughput-regression", type=float, default=MAX_THROUGHPUT_REGRESSION)
+    parser.add_argument("--max-rss-regression", type=float, default=MAX_RSS_REGRESSION)
+    parser.add_argument("--max-size-regression", type=float, default=MAX_SIZE_REGRESSION)
+    parser.add_argument("--report", type=Path, default=None, help="Write the comparison as JSON")
+    parser.add_argument("--measure", type=Path, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.data is None:
+        args.data = next((p for p in DEFAULT_DATA if p.exists()), None)
+        if args.data is None:
+            raise SystemExit("❌ No held-out set found — run prepare_data.py or pass --data")
+    args.data = args.data.resolve()
+
+    if args.measure:  # child process
+        print(json.dumps(measure(args.measure, args.data, args.batch_size, args.warmup, args.max_chars,
+                                max(1, args.rounds))))
+        return
+    if not args.candidate:
+        parser.error("candidate is required")
+
+    candidate_path = resolve_model(args.candidate)
+    production_path = resolve_model(args.production) if args.production else default_production()
+
+    print("=" * 60)
+    print("🚦 Model promotion gate")
+    print("=" * 60)
+    print(f"   Held-out set: {args.data}")
+    production = run_measure(production_path, args)
+    candidate = run_measure(candidate_path, args)
+    print(f"   {candidate['docs']} docs, batch size {args.batch_size}, best of {args.rounds} rounds")
+
+    print_report(production, candidate)
+    failures = check(production, candidate, args)
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"production": production, "candidate": candidate, "failures": failures}, f, indent=2)
+        print(f"\n   📝 Report → {args.report}")
+
+    if failures:
+        print("\n❌ Candidate NOT promotable:")
+        for failure in failures:
+            print(f"   - {failure}")
+        sys.exit(1)
+    print("\n✅ Candidate within budgets — ready to promote")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+FlipTracker NLP — Hyperparameter sweep for the CPU NER
+
+Trains tok2vec NER variants (the architecture of the CPU fallback in
+train.py and of the distilled student) over a search space, several trials
+at a time:
+
+- each worker process is pinned to its own cores (``sched_setaffinity``) and
+  BLAS/OpenMP thread pools are sized to match (``--threads-per-trial``), so
+  trials do not fight over cores;
+- dev F1 is computed after every epoch; a trial whose F1 falls below the
+  median of the other trials at the same epoch (after ``--warmup-epochs``)
+  is pruned, so its worker moves on to the next configuration;
+- completed trials are benchmarked (docs/s, single worker, same pinning) and
+  a table of F1 and speed is written to ``results.csv`` / ``results.json``.
+
+The search space is a JSON object of ``{param: [values]}``; params are the
+aliases below or any dotted spaCy config path. Without ``--trials`` the full
+grid runs, otherwise a seeded random sample of it.
+
+Usage:
+    python training/sweep.py
+    python training/sweep.py --space sweep_space.json --trials 24 --epochs 20
+    python training/sweep.py --corpus data/corpus --threads-per-trial 2
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing as mp
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+SERVICE_DIR = Path(__file__).parent.parent
+
+# Friendly names → spaCy config paths (efficiency NER config)
+PARAMS = {
+    "width": "components.tok2vec.model.encode.width",
+    "depth": "components.tok2vec.model.encode.depth",
+    "window_size": "components.tok2vec.model.encode.window_size",
+    "hidden_width": "components.ner.model.hidden_width",
+    "maxout_pieces": "components.ner.model.maxout_pieces",
+    "learn_rate": "training.optimizer.learn_rate",
+    "L2": "training.optimizer.L2",
+}
+# Applied by the training loop rather than the config
+LOOP_PARAMS = ("dropout", "batch_size")
+
+DEFAULT_SPACE = {
+    "width": [64, 96, 128],
+    "depth": [2, 4],
+    "hidden_width": [64, 128],
+    "dropout": [0.1, 0.2, 0.3],
+    "learn_rate": [0.001, 0.0005],
+    "batch_size": [16, 32],
+}
+
+THREAD_ENV = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+# ── Search space ─────────────────────────────────────────────────
+def configurations(space: dict, trials: int = None, seed: int = 42) -> list[dict]:
+    names = list(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    if trials is not None and trials < len(grid):
+        grid = random.Random(seed).sample(grid, trials)
+    return grid
+
+
+def core_slots(threads: int, workers: int) -> list[list[int]]:
+    """Disjoint core sets, one per worker (reused round-robin when cores run out)."""
+    cores = sorted(os.sched_getaffinity(0))
+    slots = [cores[i:i + threads] for i in range(0, len(cores) - threads + 1, threads)] or [cores]
+    if len(slots) < workers:
+        print(f"   ⚠️  {len(cores)} cores for {workers} workers × {threads} threads — cores will be shared")
+    return [slots[i % len(slots)] for i in range(workers)]
+
+
+# ── Pruning ──────────────────────────────────────────────────────
+class MedianPruner:
+    """Prunes a trial whose dev F1 is below the median of the others at the same epoch."""
+
+    def __init__(self, history, lock, warmup_epochs: int = 3, min_trials: int = 3):
+        self.history = history  # Manager dict: epoch → [scores]
+        self.lock = lock
+        self.warmup_epochs = warmup_epochs
+        self.min_trials = min_trials
+
+    def report(self, epoch: int, score: float) -> bool:
+        with self.lock:
+            others = list(self.history.get(epoch, []))
+            self.history[epoch] = others + [score]
+        if epoch < self.warmup_epochs or len(others) < self.min_trials:
+            return False
+        return score < statistics.median(others)
+
+
+# ── Worker side ──────────────────────────────────────────────────
+_cores: list[int] = []
+_threads = 1
+
+
+def _init_worker(slots, threads: int):
+    """Pin this worker to a free core set before numpy/spaCy are imported."""
+    global _cores, _threads
+    _cores, _threads = slots.get(), threads
+    os.sched_setaffinity(0, _cores)
+    for name in THREAD_ENV:
+        os.environ[name] = str(threads)
+    # Misaligned weak labels are expected (and skipped by spaCy): one warning per doc per trial otherwise
+    warnings.filterwarnings("ignore", message=r"\[W030\]")
+
+
+def load_data(corpus_path: Path = None):
+    from corpus import Corpus, load_split, with_entities
+
+    if corpus_path is not None:
+        train, dev = Corpus(corpus_path).split(0.8)
+    else:
+        annotated = SERVICE_DIR / "data" / "annotated"
+        train, dev = load_split(annotated, "train"), load_split(annotated, "val")
+    return with_entities(train), with_entities(dev)
+
+
+def build_nlp(params: dict, labels: set):
+    import spacy
+    from spacy.cli.init_config import init_config
+
+    config = init_config(lang="fr", pipeline=["ner"], optimize="efficiency", gpu=False)
+    for name, value in params.items():
+        if name in LOOP_PARAMS:
+            continue
+        section = config
+        *parents, key = PARAMS.get(name, name).split(".")
+        for parent in parents:
+            section = section[parent]
+        section[key] = value
+    nlp = spacy.util.load_model_from_config(config, auto_fill=True, validate=True)
+    for label in sorted(labels):
+        nlp.get_pipe("ner").add_label(label)
+    return nlp
+
+
+def dev_f1(nlp, dev_texts, references) -> float:
+    import numpy as np
+    from evaluate import span_array, span_prf
+
+    label_ids: dict[str, int] = {}
+    gold = span_array(references, label_ids)
+    pred = span_array(list(nlp.pipe(dev_texts, batch_size=64)), label_ids)
+    doc_lengths = np.fromiter((len(t) for t in dev_texts), dtype=np.int64, count=len(dev_texts))
+    return float(span_prf(gold, pred, doc_lengths, max(len(label_ids), 1))["micro"]["f"])
+
+
+def run_trial(trial: int, params: dict, args, history, lock) -> dict:
+    """Train one configuration; returns its results row."""
+    from spacy.training import Example
+    from spacy.util import fix_random_seed, minibatch
+    from evaluate import make_reference_docs
+
+    if "torch" in sys.modules:  # thinc imports torch whenever it is installed
+        sys.modules["torch"].set_num_threads(_threads)
+
+    start = time.perf_counter()
+    row = {"trial": trial, **params, "status": "complete", "epochs": 0, "f1": 0.0,
+           "docsPerSecond": None, "seconds": None, "cores": ",".join(map(str, _cores))}
+    trial_dir = args.output / f"trial-{trial:03d}"
+    trial_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        fix_random_seed(args.seed + trial)
+        train, dev = load_data(args.corpus)
+        labels = {label for item in train for _, _, label in item["entities"]}
+        nlp = build_nlp(params, labels)
+        examples = []
+        for item in train:
+            try:
+                examples.append(Example.from_dict(nlp.make_doc(item["text"]), {"entities": item["entities"]}))
+            except ValueError:
+                continue
+        dev_texts = [item["text"] for item in dev]
+        references = make_reference_docs(nlp, dev)
+        optimizer = nlp.initialize(lambda: examples)
+        pruner = MedianPruner(history, lock, args.warmup_epochs)
+        rng = random.Random(trial)
+
+        for epoch in range(args.epochs):
+            rng.shuffle(examples)
+            for batch in minibatch(examples, size=params.get("batch_size", 32)):
+                nlp.update(batch, drop=params.get("dropout", 0.1), sgd=optimizer)
+            f1 = dev_f1(nlp, dev_texts, references)
+            row["epochs"] = epoch + 1
+            if f1 > row["f1"]:
+                row["f1"] = f1
+                nlp.to_disk(trial_dir / "model-best")
+            if pruner.report(epoch, f1):
+                row["status"] = "pruned"
+                break
+
+        if row["status"] == "complete":
+            bench_start = time.perf_counter()
+            for _ in nlp.pipe(dev_texts, batch_size=32):
+                pass
+            elapsed = time.perf_counter() - bench_start
+            row["docsPerSecond"] = len(dev_texts) / elapsed if elapsed else None
+    except Exception as e:
+        row["status"] = f"failed: {type(e).__name__}: {e}"
+    row["seconds"] = round(time.perf_counter() - start, 1)
+    return row
+
+
+# ── Coordinator ──────────────────────────────────────────────────
+def print_table(rows: list[dict], params: list[str]):
+    header = f"   {'#':>3} " + " ".join(f"{p[:12]:>12}" for p in params) + \
+             f" {'F1':>7} {'docs/s':>9} {'epochs':>6} {'status':<10}"
+    print(header)
+    print("   " + "-" * (len(header) - 3))
+    for row in rows:
+        speed = f"{row['docsPerSecond']:.0f}" if row["docsPerSecond"] else "-"
+        print(f"   {row['trial']:>3} " + " ".join(f"{str(row[p])[:12]:>12}" for p in params) +
+              f" {row['f1']:>7.3f} {speed:>9} {row['epochs']:>6} {row['status'][:40]:<10}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--space", type=Path, default=None, help="JSON {param: [values]} (default: built-in)")
+    parser.add_argument("--trials", type=int, default=None, help="Random sample of the grid (default: full grid)")
+    parser.add_argument("--epochs", type=int, default=15)
+    parser.add_argument("--warmup-epochs", type=int, default=3, help="Epochs before pruning may start")
+    parser.add_argument("--threads-per-trial", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None, help="Parallel trials (default: cores / threads)")
+    parser.add_argument("--corpus", type=Path, default=None, help="Columnar corpus, split 80/20")
+    parser.add_argument("--output", type=Path, default=SERVICE_DIR / "models" / "sweep")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.space:
+        with open(args.space, "r", encoding="utf-8") as f:
+            space = json.load(f)
+    else:
+        space = DEFAULT_SPACE
+    configs = configurations(space, args.trials, args.seed)
+    threads = max(1, args.threads_per_trial)
+    workers = args.workers or max(1, len(os.sched_getaffinity(0)) // threads)
+    workers = min(workers, len(configs))
+    args.output.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 60)
+    print("🔍 NER hyperparameter sweep")
+    print("=" * 60)
+    print(f"   {len(configs)} trials, {workers} workers × {threads} threads, up to {args.epochs} epochs")
+
+    ctx = mp.get_context("spawn")  # fresh interpreters: thread env set before numpy loads
+    slots = ctx.Queue()
+    for cores in core_slots(threads, workers):
+        slots.put(cores)
+    with ctx.Manager() as manager:
+        history, lock = manager.dict(), manager.Lock()
+        with ctx.Pool(workers, initializer=_init_worker, initargs=(slots, threads)) as pool:
+            pending = [pool.apply_async(run_trial, (i, params, args, history, lock))
+                       for i, params in enumerate(configs)]
+            rows = []
+            for result in pending:
+                row = result.get()
+                rows.append(row)
+                emoji = {"complete": "✅", "pruned": "✂️ "}.get(row["status"], "❌")
+                print(f"   {emoji} trial {row['trial']:>3}: F1 {row['f1']:.3f} after {row['epochs']} epochs "
+                      f"({row['status']}, {row['seconds']}s)")
+
+    rows.sort(key=lambda r: (r["status"] == "complete", r["f1"]), reverse=True)
+    print()
+    print_table(rows, list(space))
+
+    with open(args.output / "results.json", "w", encoding="utf-8") as f:
+        json.dump({"space": space, "epochs": args.epochs, "trials": rows}, f, indent=2)
+    with open(args.output / "results.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    best = next((r for r in rows if r["status"] == "complete"), None)
+    print(f"\n   📝 {args.output / 'results.csv'}")
+    if best:
+        model_path = args.output / f"trial-{best['trial']:03d}" / "model-best"
+        print(f"✅ Best: trial {best['trial']} — F1 {best['f1']:.3f}, {best['docsPerSecond']:.0f} docs/s → {model_path}")
+
+
+if __name__ == "__main__":
+    main()
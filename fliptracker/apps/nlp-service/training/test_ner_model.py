@@ -4,9 +4,14 @@ Shows extraction results with statistics
 """
 import spacy
 import json
+import argparse
 from pathlib import Path
 from collections import Counter
 
+import numpy as np
+
+from evaluate import span_array, span_prf
+
 
 def load_validation_data(data_dir: str):
     """Load validation data"""
@@ -30,13 +35,13 @@ def load_validation_data(data_dir: str):
     return validation_data
 
 
-def extract_entities_from_text(nlp, text):
-    """Extract entities using the model"""
-    doc = nlp(text[:3000])
-    return [(ent.text, ent.label_) for ent in doc.ents]
+def extract_entities(nlp, texts, batch_size: int = 64):
+    """Extract entities for all texts in one batched pass"""
+    return list(nlp.pipe((text[:3000] for text in texts), batch_size=batch_size))
 
 
-def test_ner_model(model_path: str = "models/ner_full/model-best"):
+def test_ner_model(model_path: str = "models/ner_full/model-best", limit: int = None,
+                   show: int = 20, batch_size: int = 64):
     """Test NER model on validation data"""
     
     print("=" * 60)
@@ -60,61 +65,71 @@ def test_ner_model(model_path: str = "models/ner_full/model-best"):
         print("❌ No validation data!")
         return
     
+    if limit:
+        validation_data = validation_data[:limit]
+    
     print(f"✅ Loaded {len(validation_data)} validation samples\n")
     
-    # Test extraction
+    # Test extraction (single pass, reused for display and statistics)
     print("=" * 60)
     print("🔍 TESTING EXTRACTION")
     print("=" * 60)
     
-    results = []
+    texts = [text for text, _ in validation_data]
+    docs = extract_entities(nlp, texts, batch_size=batch_size)
+    
     entity_counts = Counter()
+    matches = 0
     
-    for idx, (text, ground_truth_entities) in enumerate(validation_data[:20], 1):
-        # Extract
-        predicted = extract_entities_from_text(nlp, text)
+    for idx, ((text, ground_truth_entities), doc) in enumerate(zip(validation_data, docs), 1):
+        predicted = {(ent.start_char, ent.end_char, ent.label_) for ent in doc.ents}
+        gold = {(s, e, l) for s, e, l in ground_truth_entities if s < 3000}
         
-        # Count entities
-        for _, label in predicted:
-            entity_counts[label] += 1
+        for ent in doc.ents:
+            entity_counts[ent.label_] += 1
         
-        # Store result
-        results.append({
-            "text": text[:80] + "..." if len(text) > 80 else text,
-            "predicted": predicted,
-            "ground_truth": ground_truth_entities
-        })
+        is_match = predicted == gold
+        matches += is_match
         
-        print(f"\n📧 Sample {idx}:")
-        print(f"   Text: {text[:60]}...")
-        print(f"   🔷 Predicted: {predicted}")
-        print(f"   🔹 Ground truth: {ground_truth_entities}")
-        
-        # Check matches
-        if predicted == ground_truth_entities:
-            print(f"   ✅ MATCH!")
-        else:
-            print(f"   ❌ MISMATCH!")
+        if idx <= show:
+            print(f"\n📧 Sample {idx}:")
+            print(f"   Text: {text[:60]}...")
+            print(f"   🔷 Predicted: {[(ent.text, ent.label_) for ent in doc.ents]}")
+            print(f"   🔹 Ground truth: {[(text[s:e], l) for s, e, l in sorted(gold)]}")
+            print(f"   ✅ MATCH!" if is_match else f"   ❌ MISMATCH!")
     
     # Statistics
     print("\n" + "=" * 60)
     print("📊 STATISTICS")
     print("=" * 60)
     
-    print(f"\nTotal samples tested: {min(20, len(validation_data))}")
+    print(f"\nTotal samples tested: {len(validation_data)}")
     print(f"\n📝 Entity types found:")
     for label, count in entity_counts.most_common():
         print(f"   {label}: {count}")
     
-    # Accuracy
-    matches = 0
-    for _, (text, ground_truth) in enumerate(validation_data[:20]):
-        predicted = extract_entities_from_text(nlp, text)
-        if predicted == ground_truth:
-            matches += 1
+    # Span-level metrics
+    label_ids = {}
+    ref_docs = []
+    for (text, ground_truth), doc in zip(validation_data, docs):
+        ref = nlp.make_doc(doc.text)
+        spans = [ref.char_span(s, e, label=l, alignment_mode="contract")
+                 for s, e, l in ground_truth if e <= len(doc.text)]
+        ref.ents = spacy.util.filter_spans([s for s in spans if s is not None])
+        ref_docs.append(ref)
+    gold = span_array(ref_docs, label_ids)
+    pred = span_array(docs, label_ids)
+    doc_lengths = np.array([len(doc.text) for doc in docs], dtype=np.int64)
+    scores = span_prf(gold, pred, doc_lengths, len(label_ids))
+    
+    print(f"\n   {'Label':<20} {'Precision':>10} {'Recall':>10} {'F1':>10}")
+    for label, i in sorted(label_ids.items()):
+        print(f"   {label:<20} {scores['p'][i]:>10.2f} {scores['r'][i]:>10.2f} {scores['f'][i]:>10.2f}")
     
-    accuracy = (matches / min(20, len(validation_data))) * 100
+    # Accuracy
+    accuracy = (matches / len(validation_data)) * 100
     print(f"\n✨ Accuracy (exact match): {accuracy:.1f}%")
+    print(f"✨ Span F1: {scores['micro']['f']:.2f}")
     
     print("\n" + "=" * 60)
     print("✅ TEST COMPLETE!")
@@ -122,4 +137,10 @@ def test_ner_model(model_path: str = "models/ner_full/model-best"):
 
 
 if __name__ == "__main__":
-    test_ner_model()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="models/ner_full/model-best")
+    parser.add_argument("--limit", type=int, default=None, help="Only test the first N samples")
+    parser.add_argument("--show", type=int, default=20, help="Number of samples to print")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+    test_ner_model(args.model, limit=args.limit, show=args.show, batch_size=args.batch_size)
@@ -9,17 +9,27 @@ Usage:
     python training/train.py                    # Train both
     python training/train.py --ner-only         # NER only
     python training/train.py --classifier-only  # Classifiers only
+    python training/train.py --classifier-only --multitask  # One encoder, four heads
+    python training/train.py --ner-only --corpus data/corpus  # Columnar corpus, split 80/20
+    python training/train.py --resume           # Continue interrupted runs from their checkpoints
 """
 import json
 import sys
+import hashlib
 import argparse
 from pathlib import Path
 
+import numpy as np
 import spacy
 from spacy.tokens import DocBin
 from spacy.training import Example
 from spacy.util import minibatch, compounding
 
+from checkpoint import Checkpointer, dev_f1, add_arguments as add_checkpoint_arguments
+from corpus import Corpus, load_split, with_entities
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
 
 # ── NER Training with spaCy + CamemBERT ─────────────────────────
 def create_spacy_docbin(data: list[dict], nlp, output_path: Path):
@@ -57,23 +67,24 @@ def create_spacy_docbin(data: list[dict], nlp, output_path: Path):
     print(f"   💾 Saved {len(data)} docs to {output_path} (skipped {skipped} misaligned spans)")
 
 
-def train_ner(data_dir: Path, output_dir: Path, epochs: int = 30):
+def train_ner(data_dir: Path, output_dir: Path, epochs: int = 30, corpus_path: Path = None,
+              resume: bool = False, checkpoint_dir: Path = None, keep_best: int = 3,
+              checkpoint_every: int = 1):
     """Train spaCy NER model with CamemBERT transformer."""
     print("\n" + "="*60)
     print("🧠 Training NER Model (spaCy + CamemBERT)")
     print("="*60)
     
-    train_path = data_dir / "annotated" / "train.json"
-    val_path = data_dir / "annotated" / "val.json"
-    
-    with open(train_path, "r", encoding="utf-8") as f:
-        train_data = json.load(f)
-    with open(val_path, "r", encoding="utf-8") as f:
-        val_data = json.load(f)
+    # Memory-mapped corpora are read lazily (annotated/<split>.corpus, or --corpus split 80/20)
+    if corpus_path is not None:
+        train_data, val_data = Corpus(corpus_path).split(0.8)
+    else:
+        train_data = load_split(data_dir / "annotated", "train")
+        val_data = load_split(data_dir / "annotated", "val")
     
     # Filter samples that have at least one entity
-    train_with_ents = [d for d in train_data if d["entities"]]
-    val_with_ents = [d for d in val_data if d["entities"]]
+    train_with_ents = with_entities(train_data)
+    val_with_ents = with_entities(val_data)
     
     print(f"   Train samples with entities: {len(train_with_ents)}/{len(train_data)}")
     print(f"   Val samples with entities: {len(val_with_ents)}/{len(val_data)}")
@@ -201,36 +212,154 @@ buffer = 256
             ner.add_label(label)
         
         # Prepare training data
-        examples = []
-        for item in train_with_ents:
-            doc = nlp.make_doc(item["text"])
-            entities = {"entities": item["entities"]}
-            try:
-                example = Example.from_dict(doc, entities)
-                examples.append(example)
-            except Exception:
-                continue
+        def to_examples(items):
+            examples = []
+            for item in items:
+                doc = nlp.make_doc(item["text"])
+                entities = {"entities": item["entities"]}
+                try:
+                    example = Example.from_dict(doc, entities)
+                    examples.append(example)
+                except Exception:
+                    continue
+            return examples
+        
+        examples = to_examples(train_with_ents)
+        dev = to_examples(val_with_ents)
         
         print(f"   Training on {len(examples)} examples for {epochs} epochs...")
         
         optimizer = nlp.begin_training()
-        for epoch in range(epochs):
+        checkpoints = Checkpointer(checkpoint_dir or output_dir / "checkpoints" / "ner",
+                                   keep_best=keep_best, every=checkpoint_every)
+        state = checkpoints.start(nlp, optimizer, resume)
+        step = state["step"]
+        for epoch in range(state["epoch"] + 1, epochs):
             losses = {}
             batches = minibatch(examples, size=compounding(4.0, 32.0, 1.001))
             for batch in batches:
                 nlp.update(batch, sgd=optimizer, losses=losses)
+                step += 1
             if epoch % 5 == 0:
                 print(f"   Epoch {epoch}: loss={losses.get('ner', 0):.4f}")
+            if checkpoints.due(epoch, epochs - 1):
+                checkpoints.save(nlp, optimizer, epoch, step, score=dev_f1(nlp, dev) if dev else None)
         
-        # Save
+        # Save (best checkpoint by dev F1)
         model_path = output_dir / "ner_model" / "model-best"
+        best = checkpoints.best()
+        if best is not None:
+            nlp.from_disk(best / "model")
         model_path.mkdir(parents=True, exist_ok=True)
         nlp.to_disk(model_path)
-        print(f"   ✅ NER model saved to {model_path}")
+        print(f"   ✅ NER model saved to {model_path}" + (f" (from {best.name})" if best else ""))
 
 
 # ── Classification Training with HuggingFace ────────────────────
-def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
+LENGTH_BINS = [32, 64, 128, 192, 256, 384, 512]
+
+
+def token_length_histogram(lengths: np.ndarray, bins=LENGTH_BINS):
+    """Print the token-length distribution of the corpus."""
+    edges = [0] + list(bins) + [max(int(lengths.max()) + 1, bins[-1] + 1)]
+    counts, _ = np.histogram(lengths, bins=edges)
+    print(f"      Token lengths: p50={np.percentile(lengths, 50):.0f} "
+          f"p90={np.percentile(lengths, 90):.0f} p95={np.percentile(lengths, 95):.0f} "
+          f"max={lengths.max()}")
+    width = max(counts.max(), 1)
+    for lo, hi, count in zip(edges[:-1], edges[1:], counts):
+        label = f"{lo}-{hi - 1}" if hi <= bins[-1] else f"{lo}+"
+        print(f"      {label:>9} | {'█' * int(40 * count / width):<40} {count}")
+
+
+def choose_max_length(lengths: np.ndarray, percentile: float = 95, cap: int = 512) -> int:
+    """Smallest multiple of 8 covering ``percentile`` % of the corpus, capped at ``cap``."""
+    target = int(np.ceil(np.percentile(lengths, percentile)))
+    return int(min(cap, max(8, -(-target // 8) * 8)))
+
+
+def prepare_cls_dataset(texts: list[str], labels: list, tokenizer, cache_dir: Path,
+                        max_length: int = None, percentile: float = 95, use_cache: bool = True):
+    """
+    Tokenize a classification dataset without padding (the collator pads each
+    batch dynamically) and split it 80/20.
+
+    ``max_length`` defaults to the ``percentile`` of the corpus token lengths.
+    Tokenized datasets are cached on disk, keyed by content, tokenizer and
+    max length.
+    """
+    from datasets import Dataset, load_from_disk
+
+    lengths = np.array([len(ids) for ids in tokenizer(texts, truncation=False)["input_ids"]])
+    token_length_histogram(lengths)
+    if not max_length:
+        max_length = choose_max_length(lengths, percentile)
+    truncated = int((lengths > max_length).sum())
+    print(f"      max_length={max_length} ({truncated}/{len(texts)} texts truncated)")
+
+    digest = hashlib.sha1()
+    digest.update(json.dumps([texts, labels], ensure_ascii=False).encode("utf-8"))
+    digest.update(f"{tokenizer.name_or_path}:{len(tokenizer)}:{max_length}".encode("utf-8"))
+    cache_path = cache_dir / digest.hexdigest()[:16]
+
+    if use_cache and cache_path.exists():
+        print(f"      ♻️  Using cached tokenized dataset {cache_path}")
+        return load_from_disk(str(cache_path)), max_length
+
+    def tokenize_fn(examples):
+        encoded = tokenizer(examples["text"], truncation=True, max_length=max_length)
+        encoded["length"] = [len(ids) for ids in encoded["input_ids"]]
+        return encoded
+
+    dataset = Dataset.from_dict({"text": texts, "labels": labels})
+    dataset = dataset.map(tokenize_fn, batched=True, remove_columns=["text"])
+    split = dataset.train_test_split(test_size=0.2, seed=42)
+
+    if use_cache:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        split.save_to_disk(str(cache_path))
+    return split, max_length
+
+
+def cls_training_args(task_output: Path, epochs: int, keep_best: int = 3, **kwargs):
+    """Shared TrainingArguments: length-grouped batches, eval + checkpoint each epoch."""
+    from transformers import TrainingArguments
+
+    return TrainingArguments(
+        output_dir=str(task_output),
+        num_train_epochs=epochs,
+        per_device_train_batch_size=8,
+        per_device_eval_batch_size=8,
+        warmup_steps=50,
+        weight_decay=0.01,
+        logging_dir=str(task_output / "logs"),
+        logging_steps=10,
+        eval_strategy="epoch",
+        save_strategy="epoch",
+        save_total_limit=max(2, keep_best),  # best + latest are always kept
+        load_best_model_at_end=True,
+        metric_for_best_model="eval_loss",
+        group_by_length=True,
+        length_column_name="length",
+        **kwargs,
+    )
+
+
+def last_hf_checkpoint(task_output: Path, resume: bool):
+    """Latest Trainer checkpoint-N in ``task_output`` when resuming (optimizer, scheduler, RNG included)."""
+    if not resume or not task_output.exists():
+        return None
+    from transformers.trainer_utils import get_last_checkpoint
+
+    checkpoint = get_last_checkpoint(str(task_output))
+    if checkpoint:
+        print(f"      🔄 Resuming from {checkpoint}")
+    return checkpoint
+
+
+def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5,
+                      max_length: int = None, length_percentile: float = 95,
+                      use_cache: bool = True, resume: bool = False, keep_best: int = 3):
     """Train classification models for carrier, type, marketplace, email_type."""
     print("\n" + "="*60)
     print("🏷️  Training Classification Models")
@@ -238,11 +367,10 @@ def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
     
     try:
         from transformers import (
-            CamembertTokenizer, CamembertForSequenceClassification,
-            TrainingArguments, Trainer
+            AutoTokenizer, CamembertForSequenceClassification,
+            DataCollatorWithPadding, Trainer
         )
-        from datasets import Dataset
-        import torch
+        import torch  # noqa
         from sklearn.preprocessing import LabelEncoder
     except ImportError as e:
         print(f"   ❌ Missing dependency: {e}")
@@ -250,6 +378,9 @@ def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
         return
     
     annotated_dir = data_dir / "annotated"
+    cache_dir = data_dir / "cache" / "tokenized"
+    tokenizer = AutoTokenizer.from_pretrained("camembert-base", use_fast=True)
+    collator = DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8)
     
     for task in ["carrier", "type", "marketplace", "email_type"]:
         cls_path = annotated_dir / f"cls_{task}.json"
@@ -273,26 +404,10 @@ def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
         label_names = le.classes_.tolist()
         print(f"      Labels: {label_names}")
         
-        # Tokenize
-        tokenizer = CamembertTokenizer.from_pretrained("camembert-base")
-        
-        def tokenize_fn(examples):
-            return tokenizer(
-                examples["text"],
-                truncation=True,
-                padding="max_length",
-                max_length=512,
-            )
-        
-        # Create dataset
-        dataset = Dataset.from_dict({
-            "text": [d["text"] for d in cls_data],
-            "label": encoded_labels.tolist(),
-        })
-        dataset = dataset.map(tokenize_fn, batched=True)
-        
-        # Split
-        split = dataset.train_test_split(test_size=0.2, seed=42)
+        split, _ = prepare_cls_dataset(
+            [d["text"] for d in cls_data], encoded_labels.tolist(), tokenizer, cache_dir,
+            max_length=max_length, percentile=length_percentile, use_cache=use_cache,
+        )
         
         # Model
         model = CamembertForSequenceClassification.from_pretrained(
@@ -302,29 +417,15 @@ def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
         
         # Training
         task_output = output_dir / f"cls_{task}"
-        training_args = TrainingArguments(
-            output_dir=str(task_output),
-            num_train_epochs=epochs,
-            per_device_train_batch_size=8,
-            per_device_eval_batch_size=8,
-            warmup_steps=50,
-            weight_decay=0.01,
-            logging_dir=str(task_output / "logs"),
-            logging_steps=10,
-            eval_strategy="epoch",
-            save_strategy="epoch",
-            load_best_model_at_end=True,
-            metric_for_best_model="eval_loss",
-        )
-        
         trainer = Trainer(
             model=model,
-            args=training_args,
+            args=cls_training_args(task_output, epochs, keep_best),
             train_dataset=split["train"],
             eval_dataset=split["test"],
+            data_collator=collator,
         )
         
-        trainer.train()
+        trainer.train(resume_from_checkpoint=last_hf_checkpoint(task_output, resume))
         
         # Save model + label mapping
         model.save_pretrained(task_output / "model-best")
@@ -337,6 +438,62 @@ def train_classifiers(data_dir: Path, output_dir: Path, epochs: int = 5):
         print(f"      ✅ {task} classifier saved to {task_output}")
 
 
+def train_multitask_classifier(data_dir: Path, output_dir: Path, epochs: int = 5,
+                               max_length: int = None, length_percentile: float = 95,
+                               use_cache: bool = True, resume: bool = False, keep_best: int = 3):
+    """Train a single encoder with carrier/type/marketplace/email_type heads."""
+    print("\n" + "="*60)
+    print("🏷️  Training Multi-task Classifier (shared encoder)")
+    print("="*60)
+    
+    try:
+        from transformers import AutoTokenizer, DataCollatorWithPadding, Trainer
+        from multitask import MultiTaskClassifier, load_multitask_data
+        from src.classifiers import export_onnx
+    except ImportError as e:
+        print(f"   ❌ Missing dependency: {e}")
+        print("   Install: pip install transformers datasets torch onnxruntime")
+        return
+    
+    texts, labels, task_labels = load_multitask_data(data_dir / "annotated")
+    if len(texts) < 10:
+        print(f"   ⚠️  Too few samples ({len(texts)}) — skipping")
+        return
+    
+    print(f"   📋 {len(texts)} unique texts")
+    for i, (task, names) in enumerate(task_labels.items()):
+        labelled = sum(1 for row in labels if row[i] >= 0)
+        print(f"      {task}: {labelled} labelled, {len(names)} labels")
+    
+    tokenizer = AutoTokenizer.from_pretrained("camembert-base", use_fast=True)
+    split, _ = prepare_cls_dataset(
+        texts, labels, tokenizer, data_dir / "cache" / "tokenized",
+        max_length=max_length, percentile=length_percentile, use_cache=use_cache,
+    )
+    
+    model = MultiTaskClassifier.from_pretrained_encoder("camembert-base", task_labels)
+    
+    task_output = output_dir / "cls_multitask"
+    trainer = Trainer(
+        model=model,
+        args=cls_training_args(task_output, epochs, keep_best, label_names=["labels"]),
+        train_dataset=split["train"],
+        eval_dataset=split["test"],
+        data_collator=DataCollatorWithPadding(tokenizer, pad_to_multiple_of=8),
+    )
+    
+    trainer.train(resume_from_checkpoint=last_hf_checkpoint(task_output, resume))
+    
+    # Save model + label mapping + ONNX (one forward pass → four heads)
+    model.save(task_output / "model-best")
+    tokenizer.save_pretrained(task_output / "model-best")
+    with open(task_output / "label_map.json", "w") as f:
+        json.dump({"tasks": task_labels}, f)
+    
+    onnx_path = export_onnx(model, tokenizer, task_output / "onnx", model.output_names)
+    print(f"      ✅ Multi-task classifier saved to {task_output} (ONNX: {onnx_path.name})")
+
+
 # ── Main ─────────────────────────────────────────────────────────
 def main():
     parser = argparse.ArgumentParser()
@@ -344,6 +501,15 @@ def main():
     parser.add_argument("--classifier-only", action="store_true")
     parser.add_argument("--epochs-ner", type=int, default=30)
     parser.add_argument("--epochs-cls", type=int, default=5)
+    parser.add_argument("--multitask", action="store_true",
+                        help="Train one shared encoder with four heads instead of four models")
+    parser.add_argument("--cls-max-length", type=int, default=None,
+                        help="Classifier max tokens (default: chosen from the length distribution)")
+    parser.add_argument("--cls-length-percentile", type=float, default=95)
+    parser.add_argument("--no-cache", action="store_true", help="Re-tokenize instead of using data/cache")
+    parser.add_argument("--corpus", type=Path, default=None,
+                        help="Train NER on a columnar corpus (training/corpus.py) instead of annotated/")
+    add_checkpoint_arguments(parser)
     args = parser.parse_args()
     
     data_dir = Path(__file__).parent.parent / "data"
@@ -351,10 +517,23 @@ def main():
     output_dir.mkdir(parents=True, exist_ok=True)
     
     if not args.classifier_only:
-        train_ner(data_dir, output_dir, epochs=args.epochs_ner)
+        train_ner(data_dir, output_dir, epochs=args.epochs_ner, corpus_path=args.corpus,
+                  resume=args.resume, checkpoint_dir=args.checkpoint_dir, keep_best=args.keep_best,
+                  checkpoint_every=args.checkpoint_every)
     
     if not args.ner_only:
-        train_classifiers(data_dir, output_dir, epochs=args.epochs_cls)
+        cls_kwargs = dict(
+            epochs=args.epochs_cls,
+            max_length=args.cls_max_length,
+            length_percentile=args.cls_length_percentile,
+            use_cache=not args.no_cache,
+            resume=args.resume,
+            keep_best=args.keep_best,
+        )
+        if args.multitask:
+            train_multitask_classifier(data_dir, output_dir, **cls_kwargs)
+        else:
+            train_classifiers(data_dir, output_dir, **cls_kwargs)
     
     print("\n" + "="*60)
     print("🎉 Training complete!")
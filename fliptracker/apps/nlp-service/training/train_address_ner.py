@@ -2,8 +2,11 @@ import spacy
 from spacy.training import Example
 import json
 from pathlib import Path
+import argparse
 import random
 
+from checkpoint import Checkpointer, add_arguments, dev_examples, dev_f1
+
 def load_address_data():
     """Charge les données d'adresses du fichier spacy_train.json"""
     data_path = Path("data/annotated/spacy_train.json")
@@ -38,7 +41,9 @@ def load_address_data():
     return training_data
 
 
-def train_address_ner(epochs: int = 30):
+def train_address_ner(epochs: int = 30, resume: bool = False, checkpoint_dir: Path = None,
+                      keep_best: int = 3, checkpoint_every: int = 1,
+                      optimizer_per_epoch: bool = False):
     print("🚀 Loading address training data...")
     train_data = load_address_data()
     
@@ -68,17 +73,22 @@ def train_address_ner(epochs: int = 30):
         print("❌ Could not create examples!")
         return
     
-    nlp.initialize(lambda: examples)
+    optimizer = nlp.initialize(lambda: examples)
+    dev = dev_examples(nlp, Path("data/annotated/spacy_val.json"), labels={"ADDRESS"})
+    checkpoints = Checkpointer(checkpoint_dir or Path("models/checkpoints/address_ner"),
+                               keep_best=keep_best, every=checkpoint_every)
+    state = checkpoints.start(nlp, optimizer, resume)
     
     print(f"\n🎓 Training for {epochs} epochs...\n")
     
-    # Train
-    for epoch in range(epochs):
-        random.shuffle(train_data)
+    # Train (one optimizer for the whole run: its moments are checkpointed;
+    # --optimizer-per-epoch restores the former fresh Adam state every epoch)
+    for epoch in range(state["epoch"] + 1, epochs):
+        sgd = nlp.create_optimizer() if optimizer_per_epoch else optimizer
         losses = {}
         epoch_examples = []
         
-        for text, annotations in train_data:
+        for text, annotations in random.sample(train_data, len(train_data)):
             try:
                 doc = nlp.make_doc(text)
                 example = Example.from_dict(doc, annotations)
@@ -86,13 +96,21 @@ def train_address_ner(epochs: int = 30):
             except:
                 continue
         
-        nlp.update(epoch_examples, drop=0.5, sgd=nlp.create_optimizer(), losses=losses)
+        nlp.update(epoch_examples, drop=0.5, sgd=sgd, losses=losses)
         loss = losses.get('ner', 0)
         
         if (epoch + 1) % 5 == 0:
             print(f"Epoch {epoch+1:2d}/{epochs} | Loss: {loss:.6f}")
+        if checkpoints.due(epoch, epochs - 1):
+            if dev:
+                checkpoints.save(nlp, sgd, epoch, epoch + 1, score=dev_f1(nlp, dev))
+            else:
+                checkpoints.save(nlp, sgd, epoch, epoch + 1, score=-loss, metric="neg_loss")
     
-    # Save
+    # Save (best checkpoint by dev score)
+    best = checkpoints.best()
+    if best is not None:
+        nlp.from_disk(best / "model")
     print(f"\n💾 Saving model...")
     model_dir = Path("models/address_ner/model-best")
     model_dir.mkdir(parents=True, exist_ok=True)
@@ -102,4 +120,12 @@ def train_address_ner(epochs: int = 30):
 
 
 if __name__ == "__main__":
-    train_address_ner(epochs=30)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=30)
+    add_arguments(parser)
+    parser.add_argument("--optimizer-per-epoch", action="store_true",
+                        help="Fresh optimizer every epoch (behaviour before checkpoints)")
+    args = parser.parse_args()
+    train_address_ner(args.epochs, resume=args.resume, checkpoint_dir=args.checkpoint_dir,
+                      keep_best=args.keep_best, checkpoint_every=args.checkpoint_every,
+                      optimizer_per_epoch=args.optimizer_per_epoch)
\ No newline at end of file
@@ -5,6 +5,8 @@ from pathlib import Path
 import argparse
 import random
 
+from checkpoint import Checkpointer, add_arguments, dev_examples, dev_f1
+
 def load_training_data(data_dir: str):
     train_data = []
     data_path = Path(data_dir)
@@ -28,7 +30,9 @@ def load_training_data(data_dir: str):
     return train_data
 
 
-def train_ner_model(epochs: int = 20):
+def train_ner_model(epochs: int = 20, resume: bool = False, checkpoint_dir: Path = None,
+                    keep_best: int = 3, checkpoint_every: int = 1,
+                    optimizer_per_epoch: bool = False):
     print("🚀 Loading training data...")
     train_data = load_training_data("data/annotated")
     
@@ -91,17 +95,22 @@ def train_ner_model(epochs: int = 20):
         except:
             continue
     
-    nlp.initialize(lambda: examples)
+    optimizer = nlp.initialize(lambda: examples)
+    dev = dev_examples(nlp, Path("data/annotated/spacy_val.json"))
+    checkpoints = Checkpointer(checkpoint_dir or Path("models/checkpoints/ner_model"),
+                               keep_best=keep_best, every=checkpoint_every)
+    state = checkpoints.start(nlp, optimizer, resume)
     
     print(f"\n🎓 Training for {epochs} epochs...\n")
     
-    # Train
-    for epoch in range(epochs):
-        random.shuffle(aligned_data)
+    # Train (one optimizer for the whole run: its moments are checkpointed;
+    # --optimizer-per-epoch restores the former fresh Adam state every epoch)
+    for epoch in range(state["epoch"] + 1, epochs):
+        sgd = nlp.create_optimizer() if optimizer_per_epoch else optimizer
         losses = {}
         epoch_examples = []
         
-        for text, annotations in aligned_data:
+        for text, annotations in random.sample(aligned_data, len(aligned_data)):
             try:
                 doc = nlp.make_doc(text)
                 example = Example.from_dict(doc, annotations)
@@ -109,11 +118,19 @@ def train_ner_model(epochs: int = 20):
             except:
                 continue
         
-        nlp.update(epoch_examples, drop=0.5, sgd=nlp.create_optimizer(), losses=losses)
+        nlp.update(epoch_examples, drop=0.5, sgd=sgd, losses=losses)
         loss = losses.get('ner', 0)
         print(f"Epoch {epoch+1:2d}/{epochs} | Loss: {loss:.6f}")
-    
-    # Save
+        if checkpoints.due(epoch, epochs - 1):
+            if dev:
+                checkpoints.save(nlp, sgd, epoch, epoch + 1, score=dev_f1(nlp, dev))
+            else:
+                checkpoints.save(nlp, sgd, epoch, epoch + 1, score=-loss, metric="neg_loss")
+    
+    # Save (best checkpoint by dev score)
+    best = checkpoints.best()
+    if best is not None:
+        nlp.from_disk(best / "model")
     print(f"\n💾 Saving...")
     model_dir = Path("models/ner_model/model-best")
     model_dir.mkdir(parents=True, exist_ok=True)
@@ -125,5 +142,10 @@ def train_ner_model(epochs: int = 20):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--epochs", type=int, default=20)
+    add_arguments(parser)
+    parser.add_argument("--optimizer-per-epoch", action="store_true",
+                        help="Fresh optimizer every epoch (behaviour before checkpoints)")
     args = parser.parse_args()
-    train_ner_model(args.epochs)
\ No newline at end of file
+    train_ner_model(args.epochs, resume=args.resume, checkpoint_dir=args.checkpoint_dir,
+                    keep_best=args.keep_best, checkpoint_every=args.checkpoint_every,
+                    optimizer_per_epoch=args.optimizer_per_epoch)
\ No newline at end of file